@@ -0,0 +1,83 @@
+'''admission.py
+Decides which clients that are allowed to start a session, so that one client (or IP address) can not use up
+all the capacity of the server. Also contains helpers for finding clients that have disappeared.'''
+import logging, socket, sys, threading
+sys.path.append(".")
+from const import *
+from metrics import ACTIVE_SESSIONS, REJECTED_SESSIONS
+
+logger = logging.getLogger(__name__)
+
+class AdmissionController:
+    '''Keeps track of the active sessions, in total and for every IP address.
+    Can be used from several threads at the same time.'''
+    def __init__(self, max_sessions=MAX_SESSIONS, max_sessions_per_ip=MAX_SESSIONS_PER_IP):
+        '''Initializes an admission controller.
+
+        :param max_sessions: Max number of sessions at the same time. 0 means no limit.
+
+        :param max_sessions_per_ip: Max number of sessions at the same time from one IP address. 0 means no limit.'''
+        self.max_sessions = max_sessions
+        self.max_sessions_per_ip = max_sessions_per_ip
+        self.active_sessions = 0
+        self.sessions_per_ip = {}
+        self.rejected_sessions = 0
+        self.lock = threading.Lock()
+
+    def try_admit(self, ip):
+        '''Starts a session for a client if the limits allow it. release() has to be called when the session ends.
+
+        :param ip: The IP address of the client.
+
+        :returns: True if the client was admitted, False if it should be rejected.'''
+        with self.lock:
+            if self.max_sessions > 0 and self.active_sessions >= self.max_sessions:
+                logger.warning(f"Rejecting client {ip}: max number of sessions ({self.max_sessions}) reached.")
+            elif self.max_sessions_per_ip > 0 and self.sessions_per_ip.get(ip, 0) >= self.max_sessions_per_ip:
+                logger.warning(f"Rejecting client {ip}: max number of sessions for the IP ({self.max_sessions_per_ip}) reached.")
+            else:
+                self.active_sessions += 1
+                self.sessions_per_ip[ip] = self.sessions_per_ip.get(ip, 0) + 1
+                ACTIVE_SESSIONS.inc()
+                return True
+            self.rejected_sessions += 1
+            REJECTED_SESSIONS.inc()
+            return False
+
+    def release(self, ip):
+        '''Ends a session that was started with try_admit().
+
+        :param ip: The IP address of the client.'''
+        with self.lock:
+            self.active_sessions -= 1
+            self.sessions_per_ip[ip] -= 1
+            if self.sessions_per_ip[ip] <= 0:
+                del self.sessions_per_ip[ip]
+        ACTIVE_SESSIONS.dec()
+
+def configure_send_buffer(client_socket:socket.socket):
+    '''Sets the size of the send buffer of a client socket (see SEND_BUFFER_SIZE). A big buffer would hide that a client is
+    behind until many old frames are queued up for it.'''
+    if SEND_BUFFER_SIZE <= 0 or client_socket is None:
+        return
+    try:
+        client_socket.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, SEND_BUFFER_SIZE)
+    except OSError as e:
+        logger.warning(f"Failed to set the send buffer size (the error {e} occurred).")
+
+def configure_keepalive(client_socket:socket.socket):
+    '''Turns on TCP keepalive for a client socket (if enabled), so that the connection is dropped if the client disappears
+    without closing it. Without this, a session could wait for input from a client that is gone forever.'''
+    if not TCP_KEEPALIVE or client_socket is None:
+        return
+    try:
+        client_socket.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
+        #The timing options are not available on all platforms
+        if hasattr(socket, "TCP_KEEPIDLE"):
+            client_socket.setsockopt(socket.IPPROTO_TCP, socket.TCP_KEEPIDLE, TCP_KEEPALIVE_IDLE)
+        if hasattr(socket, "TCP_KEEPINTVL"):
+            client_socket.setsockopt(socket.IPPROTO_TCP, socket.TCP_KEEPINTVL, TCP_KEEPALIVE_INTERVAL)
+        if hasattr(socket, "TCP_KEEPCNT"):
+            client_socket.setsockopt(socket.IPPROTO_TCP, socket.TCP_KEEPCNT, TCP_KEEPALIVE_COUNT)
+    except OSError as e:
+        logger.warning(f"Failed to configure TCP keepalive (the error {e} occurred).")
@@ -0,0 +1,232 @@
+'''async_server.py
+Runs the superbrain using asyncio. Every client session is a coroutine instead of an OS thread,
+so sessions that are sitting idle on a page only cost a socket and their scene.
+Blocking work (loading pages and sending form data) is run in the bounded executor from session.py.'''
+import asyncio, logging, sys
+sys.path.append(".")
+from const import *
+from session import Session, SlowClientError, get_blocking_executor
+from admission import AdmissionController, configure_keepalive, configure_send_buffer
+try:
+    import resource
+except ImportError: #Not available on Windows
+    resource = None
+
+logger = logging.getLogger(__name__)
+
+def raise_open_file_limit():
+    '''Raises the soft limit of open files to the hard limit (if possible) since every session needs a socket.'''
+    if resource is None:
+        logger.debug("Can not raise open file limit on this platform.")
+        return
+    soft_limit, hard_limit = resource.getrlimit(resource.RLIMIT_NOFILE)
+    if soft_limit != hard_limit:
+        try:
+            resource.setrlimit(resource.RLIMIT_NOFILE, (hard_limit, hard_limit))
+            logger.info(f"Raised open file limit from {soft_limit} to {hard_limit}.")
+        except (ValueError, OSError) as e:
+            logger.warning(f"Failed to raise open file limit (the error {e} occurred). The limit is {soft_limit}.")
+
+class AsyncTelnetServer:
+    '''A Telnet server that runs every client session as a coroutine.'''
+    def __init__(self, host, port, backlog=LISTEN_BACKLOG, reuse_port=False, heartbeat=None, on_listening=None):
+        '''Initializes the server.
+
+        :param host: The host to run the server on.
+
+        :param port: The port to run the server on.
+
+        :param backlog: Max number of connections that are waiting to be accepted.
+
+        :param reuse_port: If True, SO_REUSEPORT is set so that several processes can listen on the same port.
+
+        :param heartbeat: A function that is called regularly from the event loop while the server is running, if any.
+        Since it runs on the event loop, it stops being called if the event loop gets stuck.
+
+        :param on_listening: A function that is called once the server is listening, if any (like startup.start_prewarm()).'''
+        self.host = host
+        self.port = port
+        self.backlog = backlog
+        self.reuse_port = reuse_port
+        self.heartbeat = heartbeat
+        self.on_listening = on_listening
+        self.admission = AdmissionController()
+        self.logger = logging.getLogger(__name__)
+
+    async def run_blocking(self, function, *args):
+        '''Runs a blocking function in the shared executor and waits for it to finish.'''
+        return await asyncio.get_running_loop().run_in_executor(get_blocking_executor(), function, *args)
+
+    async def wait_for_negotiation(self, session:Session, reader:asyncio.StreamReader, writer:asyncio.StreamWriter):
+        '''Waits (at most NEGOTIATION_TIMEOUT seconds) for the client to answer Telnet negotiation,
+        so that the first frame can be drawn with the right size.'''
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + NEGOTIATION_TIMEOUT
+        try:
+            while session.negotiating and loop.time() < deadline:
+                data = await asyncio.wait_for(reader.read(READ_SIZE), deadline - loop.time())
+                if data == b"":
+                    break
+                session.receive(data)
+                session.write_telnet_data()
+                writer.write(session.frame_writer.pop())
+        except asyncio.TimeoutError:
+            self.logger.info("Client did not finish Telnet negotiation in time.")
+
+    def send_output(self, session:Session, writer:asyncio.StreamWriter):
+        '''Hands the session's output to the transport, which sends it as the client can receive it.'''
+        data = session.frame_writer.pop()
+        if len(data) > 0:
+            writer.write(data)
+        session.check_pending_output(writer.transport.get_write_buffer_size())
+
+    def draw_frame(self, session:Session, writer:asyncio.StreamWriter, scene=None):
+        '''Draws a frame of a scene and sends it, unless the client has not received the last frame yet (see Session.defer_frame()).
+        Same logic as RequestHandler.draw_frame() in handler.py.
+
+        :param scene: The scene to draw. If None, the current scene of the session is drawn.'''
+        if writer.transport.get_write_buffer_size() > 0:
+            session.defer_frame()
+        else:
+            session.write_frame(scene) #Note that asyncio sets TCP_NODELAY on its own
+        self.send_output(session, writer)
+
+    async def run_load(self, session:Session, writer:asyncio.StreamWriter, wait_for_input):
+        '''Shows the loading screen while the session loads a page in the background. Input is still read while loading,
+        so that the user can cancel the load. Same logic as RequestHandler.run_load() in handler.py.
+
+        :param wait_for_input: The function that waits for input from the client (see handle_client()).'''
+        self.draw_frame(session, writer, session.get_loading_scene())
+        session.start_load()
+        while session.load_in_progress and not session.closed:
+            timeout = LOADING_ANIMATION_INTERVAL if LOADING_ANIMATION_INTERVAL > 0 else LOAD_TIMEOUT or None
+            data = await wait_for_input(session.get_wait_timeout(timeout))
+            if data == b"": #Connection was closed by the client
+                session.closed = True
+                break
+            if data is not None:
+                session.receive_while_loading(data)
+            else:
+                session.handle_held_keys()
+            session.update_load()
+            if session.load_in_progress and session.frame_deferred:
+                self.draw_frame(session, writer, session.get_loading_scene())
+            elif session.load_in_progress and LOADING_ANIMATION_INTERVAL > 0 and writer.transport.get_write_buffer_size() == 0:
+                session.write_loading_status()
+                self.send_output(session, writer)
+
+    async def reject_client(self, writer:asyncio.StreamWriter):
+        '''Sends the busy message to a client that was not admitted and disconnects it.'''
+        try:
+            writer.write(Session.get_busy_frame())
+            await asyncio.wait_for(writer.drain(), BUSY_FRAME_SEND_TIMEOUT)
+        except (ConnectionError, asyncio.TimeoutError):
+            pass
+        finally:
+            writer.close()
+
+    async def handle_client(self, reader:asyncio.StreamReader, writer:asyncio.StreamWriter):
+        '''Handles a client that has connected to the server. Same logic as RequestHandler.handle() in handler.py.'''
+        self.logger.info("Received a request from a client!")
+        client_address = writer.get_extra_info("peername")
+        if not self.admission.try_admit(client_address[0]):
+            await self.reject_client(writer)
+            return
+        configure_keepalive(writer.get_extra_info("socket"))
+        configure_send_buffer(writer.get_extra_info("socket"))
+        #Pause writing as soon as anything is buffered, so that drain() waits until the client has received everything
+        writer.transport.set_write_buffer_limits(high=0)
+        session = Session(client_address)
+        loop = asyncio.get_running_loop()
+        wake_event = asyncio.Event() #Set when the session is woken up (for example by the refresher) from another thread
+        session.wake = lambda: loop.call_soon_threadsafe(wake_event.set)
+        read_task = None
+
+        async def wait_for_input(timeout):
+            '''Waits for input from the client or for the session to be woken up. The read is kept between wakeups so that no data is lost.
+
+            :returns: The received data, or None if the session was woken up, the timeout passed or a frame that was deferred
+            (see Session.defer_frame()) can be drawn now.'''
+            nonlocal read_task
+            if read_task is None:
+                read_task = asyncio.ensure_future(reader.read(INPUT_BURST_SIZE))
+            wake_task = asyncio.ensure_future(wake_event.wait())
+            tasks = [read_task, wake_task]
+            if session.frame_deferred and writer.transport.get_write_buffer_size() > 0:
+                tasks.append(asyncio.ensure_future(writer.drain())) #Done when the client has received everything
+            done, _ = await asyncio.wait(tasks, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+            for task in tasks[1:]:
+                if task in done:
+                    task.result() #Raises if the connection was lost while draining
+                else:
+                    task.cancel()
+            if wake_task in done: #Also if data was read in the same round, or the next wait would return at once
+                wake_event.clear()
+            if read_task not in done:
+                return None
+            data = read_task.result()
+            read_task = None
+            return data
+
+        try:
+            session.start()
+            session.write_telnet_data()
+            writer.write(session.frame_writer.pop())
+            await self.wait_for_negotiation(session, reader, writer)
+            #Load the start file
+            await self.run_blocking(session.load_start_scene)
+            #Wait for client input
+            while not session.closed:
+                if session.is_loading():
+                    await self.run_load(session, writer, wait_for_input)
+                    continue
+                if session.needs_blocking_work():
+                    await self.run_blocking(session.do_blocking_work)
+                    continue
+                self.logger.info("Redrawing image...")
+                self.draw_frame(session, writer)
+                #Wait for client input or for the session to be woken up
+                data = await wait_for_input(session.get_wait_timeout(session.get_timeout()))
+                if data is None:
+                    if session.get_timeout_reason() is not None:
+                        raise asyncio.TimeoutError()
+                    session.handle_held_keys()
+                    continue #Woken up because there is something new to draw (or a held back escape key has been handled)
+                if data == b"": #Connection was closed by the client
+                    break
+                session.receive(data)
+        except ConnectionError as e:
+            self.logger.info(f"Client disconnected ({e}).")
+        except asyncio.TimeoutError:
+            self.logger.info(f"Closing session. {session.get_timeout_reason()}")
+        except SlowClientError as e:
+            self.logger.info(f"Closing session. {e}")
+        finally:
+            if read_task is not None:
+                read_task.cancel()
+            session.close()
+            self.admission.release(client_address[0])
+            self.logger.info(f"Session closed. {self.admission.active_sessions} sessions are active.")
+            writer.close()
+
+    async def serve_forever(self):
+        '''Starts the server and serves clients until the server is stopped.'''
+        raise_open_file_limit()
+        server = await asyncio.start_server(self.handle_client, self.host, self.port, backlog=self.backlog, reuse_port=self.reuse_port or None)
+        if self.heartbeat is not None:
+            heartbeat_task = asyncio.create_task(self.send_heartbeats())
+        if self.on_listening is not None:
+            self.on_listening()
+        async with server:
+            self.logger.info(f"Running asyncio Telnet server on {self.host}:{self.port} until close...")
+            await server.serve_forever()
+
+    async def send_heartbeats(self):
+        '''Calls the heartbeat function regularly.'''
+        while True:
+            self.heartbeat()
+            await asyncio.sleep(HEARTBEAT_INTERVAL)
+
+    def run(self):
+        '''Runs the server until it is stopped.'''
+        asyncio.run(self.serve_forever())
@@ -7,9 +7,15 @@ KEY_DOWN = "\x1b[B"
 KEY_UP = "\x1b[A"
 KEY_ESCAPE = chr(27)
 KEY_ENTER = chr(13)
-CLEAR_SCREEN = KEY_ESCAPE + "[2J"
+KEY_BACKSPACE = "\x7f"
+KEY_BACKSPACE_ALTERNATIVE = "\x08" #Some clients send Ctrl+H for backspace
+CLEAR_SCREEN = KEY_ESCAPE + "[2J" + KEY_ESCAPE + "[H" #Clears the screen and moves the cursor to the top left
 KEY_COMBINATION_CTRL_C = "\x03"
 KEY_COMBINATION_CTRL_Q = "\x11"
+KEY_COMBINATION_CTRL_P = "\x10"
+KEY_COMBINATION_CTRL_O = "\x0f"
+KEY_COMBINATION_CTRL_B = "\x02"
+KEY_COMBINATION_CTRL_F = "\x06"
 ARROW_KEYS = {
     "left": b"\x1b[D",
     "right": b"\x1b[C",
@@ -118,6 +124,96 @@ WORKING_DIRECTORY = os.getcwd() #Working directory
 SERVER_DIRECTORY = os.path.dirname(os.path.realpath(__file__)) #Directory that the server is placed in
 HTML_CONTENT_DIRECTORY = os.path.join(WORKING_DIRECTORY, "html_content")
 WEBSITE_INDEX_HANDLER_DIRECTORY = os.path.join(WORKING_DIRECTORY, "website_index_handler")
+#The page that sessions start on (and go back to on Ctrl+C). A file in the website index handler directory or a URL
+START_PAGE = os.getenv("SUPERBRAIN_START_PAGE", os.path.join(WEBSITE_INDEX_HANDLER_DIRECTORY, "website_index_out.html"))
+
+#Server configuration (can be changed using environment variables)
+SERVER_MODE_THREADED = "threaded" #One thread per client
+SERVER_MODE_ASYNCIO = "asyncio" #One coroutine per client
+SERVER_MODE = os.getenv("SUPERBRAIN_SERVER_MODE", SERVER_MODE_THREADED)
+BLOCKING_WORKERS = int(os.getenv("SUPERBRAIN_BLOCKING_WORKERS", 32)) #Max number of threads used for blocking work such as loading pages
+#Number of processes that websites are translated in, so that translating a big page does not hold up other sessions (see translation_pool.py).
+#0 means that pages are translated on the threads for blocking work. By default, one CPU core is left for the server itself
+TRANSLATION_WORKERS = int(os.getenv("SUPERBRAIN_TRANSLATION_WORKERS", min((os.cpu_count() or 1) - 1, 4)))
+TRANSLATION_QUEUE_SIZE = int(os.getenv("SUPERBRAIN_TRANSLATION_QUEUE_SIZE", 64)) #Max number of pages that can be waiting for or being translated at the same time
+TRANSLATION_TIMEOUT = float(os.getenv("SUPERBRAIN_TRANSLATION_TIMEOUT", 10)) #Max seconds that translating a page can take before it is given up on. 0 means no limit
+WORKER_PARENT_CHECK_INTERVAL = 1 #Seconds between checks in translation workers for if the server is still running
+LISTEN_BACKLOG = int(os.getenv("SUPERBRAIN_LISTEN_BACKLOG", 1024)) #Max number of connections waiting to be accepted
+DEFAULT_CLIENT_WIDTH = 80 #Screen size to use for clients that do not tell us their window size
+DEFAULT_CLIENT_HEIGHT = 24
+NEGOTIATION_TIMEOUT = float(os.getenv("SUPERBRAIN_NEGOTIATION_TIMEOUT", 0.5)) #Max time (in seconds) to wait for Telnet negotiation before drawing the first frame
+ESCAPE_KEY_TIMEOUT = 0.3 #Seconds to wait for the rest of an escape sequence before a lone escape is handled as the escape key
+READ_SIZE = 4096 #Max number of bytes to read from a client at once
+INPUT_BURST_SIZE = 65536 #Max number of bytes of input (like pasted text) that is read and applied at once, before the next frame is drawn
+FRAME_BUFFER_SIZE = 4096 #Initial size (in bytes) of the buffer that every frame is written to before being sent
+#Size (in bytes) of the socket send buffer of every client. The smaller it is, the sooner clients on slow connections start skipping
+#old frames instead of getting more and more behind (see Session.defer_frame()). 0 keeps the default of the OS
+SEND_BUFFER_SIZE = int(os.getenv("SUPERBRAIN_SEND_BUFFER_SIZE", 32768))
+MAX_PENDING_OUTPUT = int(os.getenv("SUPERBRAIN_MAX_PENDING_OUTPUT", 262144)) #Max bytes of output that a client has not received before its session is closed. 0 means no limit
+DIFFERENTIAL_UPDATES = os.getenv("SUPERBRAIN_DIFFERENTIAL_UPDATES", "true").lower() == "true" #Only redraw lines that changed instead of the whole screen
+#Render profiles, from the one with the biggest output to the one with the smallest (see render_profiles.py)
+RENDER_PROFILE_COLOR = "color" #Pages as they are, with colors
+RENDER_PROFILE_MONOCHROME = "monochrome" #Without colors, but with font weights like bold and underlined text
+RENDER_PROFILE_PLAIN = "plain" #Without any terminal styles
+RENDER_PROFILE_COMPACT = "compact" #Without terminal styles, and with buttons and text boxes on one line without borders or padding
+RENDER_PROFILES = [RENDER_PROFILE_COLOR, RENDER_PROFILE_MONOCHROME, RENDER_PROFILE_PLAIN, RENDER_PROFILE_COMPACT]
+#The render profile to use for all clients, or "auto" to pick one for every client from its terminal type and how fast its connection is
+RENDER_PROFILE = os.getenv("SUPERBRAIN_RENDER_PROFILE", "auto").lower()
+#With the "auto" render profile, clients are switched to the next smaller profile when this many frames have been skipped for them
+#within SLOW_LINK_WINDOW seconds (see Session.defer_frame()). 0 means that clients are never switched because of their connection
+SLOW_LINK_FRAMES = int(os.getenv("SUPERBRAIN_SLOW_LINK_FRAMES", 20))
+SLOW_LINK_WINDOW = 10
+MCCP_ENABLED = os.getenv("SUPERBRAIN_MCCP", "true").lower() == "true" #Offer compressed output (MCCP version 2) to clients that support it
+MCCP_COMPRESSION_LEVEL = int(os.getenv("SUPERBRAIN_MCCP_LEVEL", 6)) #zlib compression level (1-9) for compressed output
+MAX_SESSIONS = int(os.getenv("SUPERBRAIN_MAX_SESSIONS", 10000)) #Max number of sessions at the same time (per worker). 0 means no limit
+MAX_SESSIONS_PER_IP = int(os.getenv("SUPERBRAIN_MAX_SESSIONS_PER_IP", 20)) #Max number of sessions at the same time from one IP address. 0 means no limit
+IDLE_TIMEOUT = float(os.getenv("SUPERBRAIN_IDLE_TIMEOUT", 1800)) #Seconds without input from a client before its session is closed. 0 means no timeout
+MAX_SESSION_LIFETIME = float(os.getenv("SUPERBRAIN_MAX_SESSION_LIFETIME", 86400)) #Max number of seconds that a session can be open. 0 means no limit
+TCP_KEEPALIVE = os.getenv("SUPERBRAIN_TCP_KEEPALIVE", "true").lower() == "true" #Use TCP keepalive to find clients that have disappeared without closing the connection
+TCP_KEEPALIVE_IDLE = int(os.getenv("SUPERBRAIN_TCP_KEEPALIVE_IDLE", 60)) #Seconds without traffic before keepalive probes are sent
+TCP_KEEPALIVE_INTERVAL = 15 #Seconds between keepalive probes
+TCP_KEEPALIVE_COUNT = 4 #Number of unanswered keepalive probes before the connection is dropped
+BUSY_FRAME_SEND_TIMEOUT = 2 #Max number of seconds to spend sending the busy frame to a client that is rejected (asyncio server)
+BUSY_MESSAGE = "The superbrain is busy! Please try again in a little while.\r\n" #Sent instead of the busy frame until it has been rendered
+WORKERS = int(os.getenv("SUPERBRAIN_WORKERS", 1)) #Number of worker processes. If more than 1, a supervisor runs the workers on the same port (see supervisor.py)
+HEARTBEAT_INTERVAL = 1 #Seconds between heartbeats from a worker to the supervisor
+HEALTH_CHECK_INTERVAL = float(os.getenv("SUPERBRAIN_HEALTH_CHECK_INTERVAL", 5)) #Seconds between checks of the workers
+WORKER_HEARTBEAT_TIMEOUT = float(os.getenv("SUPERBRAIN_WORKER_HEARTBEAT_TIMEOUT", 30)) #A worker that has not sent a heartbeat for this many seconds is restarted
+WORKER_RESTART_DELAY = 1 #Seconds to wait before restarting a worker that has crashed. Doubled for every crash in a row
+WORKER_MAX_RESTART_DELAY = 60 #Max number of seconds to wait before restarting a worker
+WORKER_STOP_TIMEOUT = 5 #Seconds to wait for a worker to stop before it is killed
+METRICS_ENABLED = os.getenv("SUPERBRAIN_METRICS", "true").lower() == "true" #Collect metrics (see metrics.py)
+METRICS_HOST = os.getenv("SUPERBRAIN_METRICS_HOST", "127.0.0.1") #Host to expose metrics on
+METRICS_PORT = int(os.getenv("SUPERBRAIN_METRICS_PORT", 0)) #Port to expose metrics on over HTTP. 0 means that they are not exposed over HTTP
+METRICS_FILE = os.getenv("SUPERBRAIN_METRICS_FILE", "") #File to write metrics to. Empty means that they are not written to a file
+METRICS_FILE_INTERVAL = 15 #Seconds between writes of the metrics file
+MIN_REFRESH_INTERVAL = float(os.getenv("SUPERBRAIN_MIN_REFRESH_INTERVAL", 2)) #Pages that opt in to being refreshed are not checked for changes more often than this (in seconds)
+FETCH_CONNECT_TIMEOUT = float(os.getenv("SUPERBRAIN_FETCH_CONNECT_TIMEOUT", 5)) #Max seconds to wait for a website to accept a connection
+FETCH_READ_TIMEOUT = float(os.getenv("SUPERBRAIN_FETCH_READ_TIMEOUT", 15)) #Max seconds to wait for a website to send more data
+FETCH_TIMEOUT = (FETCH_CONNECT_TIMEOUT, FETCH_READ_TIMEOUT) #Timeout for requests to websites, as passed to the requests library
+FETCH_RETRIES = int(os.getenv("SUPERBRAIN_FETCH_RETRIES", 2)) #Max number of times to retry a request to a website that failed to connect or is temporarily unavailable (see http_client.py)
+FETCH_RETRY_BACKOFF = float(os.getenv("SUPERBRAIN_FETCH_RETRY_BACKOFF", 0.25)) #The first retry is sent right away, and retry n after this many seconds times 2^(n-1)
+FETCH_RETRY_STATUS_CODES = (502, 503, 504) #Status codes that mean that a website is temporarily unavailable
+HTTP_POOL_HOSTS = int(os.getenv("SUPERBRAIN_HTTP_POOL_HOSTS", 32)) #Max number of hosts to keep connections to
+HTTP_POOL_SIZE = int(os.getenv("SUPERBRAIN_HTTP_POOL_SIZE", 10)) #Max number of idle connections to keep to every host
+MAX_REQUESTS_PER_ORIGIN = int(os.getenv("SUPERBRAIN_MAX_REQUESTS_PER_ORIGIN", 4)) #Max number of requests that are sent to one website at the same time. 0 means no limit
+ORIGIN_WAIT_TIMEOUT = FETCH_READ_TIMEOUT #Max seconds that a request waits for a free slot of its website before it fails
+HTTP_CACHE_SIZE = int(os.getenv("SUPERBRAIN_HTTP_CACHE_SIZE", 32768)) #Max size (in KiB) of the website responses that are cached for all sessions (see http_cache.py). 0 turns the cache off
+LOAD_TIMEOUT = float(os.getenv("SUPERBRAIN_LOAD_TIMEOUT", 30)) #Max seconds that loading a page can take before an error is shown. 0 means no limit
+LOADING_ANIMATION_INTERVAL = float(os.getenv("SUPERBRAIN_LOADING_ANIMATION_INTERVAL", 0.25)) #Seconds between updates of the loading indicator. 0 turns it off
+LOADING_SPINNER = "|/-\\" #Characters that are shown one after another in the loading indicator
+PROFILING_ENABLED = os.getenv("SUPERBRAIN_PROFILING", "false").lower() == "true" #Let operators profile their sessions (see profiling.py)
+#Addresses of the clients that can profile their sessions (with Ctrl+P and Ctrl+O) if profiling is enabled. "*" means all clients
+PROFILING_CLIENTS = [address.strip() for address in os.getenv("SUPERBRAIN_PROFILING_CLIENTS", "127.0.0.1,::1").split(",")]
+PROFILE_FRAMES = int(os.getenv("SUPERBRAIN_PROFILE_FRAMES", 50)) #Number of frames that are kept in the profile of a session
+PROFILE_DIRECTORY = os.getenv("SUPERBRAIN_PROFILE_DIRECTORY", os.path.join(WORKING_DIRECTORY, "profiles")) #Where profiles are dumped
+TRACE_DIRECTORY = os.getenv("SUPERBRAIN_TRACE_DIRECTORY", "") #Where sessions are recorded as traces to replay (see tracing.py). Sessions are not recorded if empty
+SCENE_CACHE_SIZE = 64 #Max number of shared scenes of local files to keep (see frame_cache.py)
+FRAME_CACHE_SIZE = 256 #Max number of encoded frames of shared scenes to keep
+PAGE_CACHE_SIZE = 64 #Max number of translated websites to share between sessions
+HISTORY_SIZE = int(os.getenv("SUPERBRAIN_HISTORY_SIZE", 20)) #Max number of pages that every session can go back and forward to (see history.py)
+HISTORY_MEMORY = int(os.getenv("SUPERBRAIN_HISTORY_MEMORY", 1024)) #Max estimated memory (in KiB) of the pages that every session keeps in its history
+SCENE_BYTES_PER_LINE = 1024 #Rough memory use of a scene for every line of content that it has (measured with tracemalloc)
 
 #ASCII Art
 BLOP_LOGO_ASCII = """
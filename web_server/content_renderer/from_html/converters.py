@@ -1,4 +1,4 @@
-import cssutils, logging, sys
+import contextlib, cssutils, logging, sys
 from ..screen.interactive_elements import TextBox, Button
 sys.path.append("...")
 from const import HTML_COLOR_TO_TERMINAL_COLOR, HTML_COLOR_TO_TERMINAL_COLOR_BACKGROUND, TERMINAL_COLORS, TERMINAL_COLORS_BACKGROUND, TERMINAL_FONT_WEIGHT
@@ -9,9 +9,14 @@ from typing import List
 #Logging
 logger = logging.getLogger(__name__)
 
+def measure_nothing(step, *labels):
+    '''The timing callback that is used when none is given (see Translator). Measures nothing.'''
+    return contextlib.nullcontext()
+
 #Each converter should expose a converter()-class
 #which takes an input of the BeautifulSoup tag to convert.
 #The converter should then return an object that can be converted into a string.
+#Converters inherit from Converter to know the size of the screen that they are converting for.
 
 
 def html_color_to_terminal_color(html_color, is_foreground=True, previous=""):
@@ -126,7 +131,7 @@ def get_color_string_for(input, style=None):
         logger.debug(f"Parsed style string for {input}: {final_string}")
     return final_string #Return an empty string if no color string was found
 
-def parse_width_height(input, is_width=False, return_default_if_unconvertible=False):
+def parse_width_height(input, is_width=False, return_default_if_unconvertible=False, screen_width=DEFAULT_SCREEN_WIDTH, screen_height=DEFAULT_SCREEN_HEIGHT):
     '''Parses a width or height unit into a scale between 1 and 0.
     Supports multiple units such as percentage, px, rem, etc.
 
@@ -136,6 +141,10 @@ def parse_width_height(input, is_width=False, return_default_if_unconvertible=Fa
 
     :param return_default_if_unconvertible: Whether to return 1 as a scale if the value failed to convert.
     If False, None will be returned instead.
+
+    :param screen_width: The width of the screen that the content is converted for.
+
+    :param screen_height: The height of the screen that the content is converted for.
     '''
     logger.debug(f"Parsing width/height string {input}...")
     input = input.strip(";").strip() #Strip whitespace and line break if there
@@ -150,11 +159,11 @@ def parse_width_height(input, is_width=False, return_default_if_unconvertible=Fa
             return (input_number / 100) * 16
         elif input.endswith("vw") or input.endswith("vh"):
             input_number = int(input.strip("vw").strip("vh"))
-            return (input_number / 100) * (DEFAULT_SCREEN_WIDTH if is_width else DEFAULT_SCREEN_HEIGHT)
+            return (input_number / 100) * (screen_width if is_width else screen_height)
         elif input.endswith("px"):
             input_number = int(input.strip("px"))
             #NOTE: Let's assume that 1px is 1 character, since people wouldn't want to use px styling for a terminal interface anyways
-            return input_number / DEFAULT_SCREEN_WIDTH
+            return input_number / screen_width
         else:
             logger.debug("Unknown unit.")
             raise Exception(f"Unparseable: {input} (unknown unit)")
@@ -192,7 +201,24 @@ class ParsedTag:
     def __str__(self):
         return f"{self.original_tag} parsed into {len(self.parsed_tags)} subtags."
 
-class TextConverter:
+class Converter:
+    '''Base class for converters.'''
+    def __init__(self, screen_width=DEFAULT_SCREEN_WIDTH, screen_height=DEFAULT_SCREEN_HEIGHT, compact=False, measure=measure_nothing):
+        '''Initializes a converter.
+
+        :param screen_width: The width (in characters) that content can use on the screen.
+
+        :param screen_height: The height (in characters) of the screen.
+
+        :param compact: If True, interactive elements are created without borders or padding (see the compact render profile).
+
+        :param measure: The timing callback of the translation (see Translator), for the tags that the converter parses by itself.'''
+        self.screen_width = screen_width
+        self.screen_height = screen_height
+        self.compact = compact
+        self.measure = measure
+
+class TextConverter(Converter):
     '''Converter for any text tags.'''
     def converter(self, input):
         #Get raw text
@@ -200,7 +226,7 @@ class TextConverter:
         parsed_color_string = get_color_string_for(input)
         return f"{parsed_color_string}{raw_text}{TERMINAL_COLORS.RESET}" #Return pure text
 
-class InputConverter:
+class InputConverter(Converter):
     '''Converter for input elements.'''
     SUPPORTED_TYPES = ["text"] #Supported input types
     def converter(self, input):
@@ -220,11 +246,11 @@ class InputConverter:
                 if "width" in parsed_style:
                     width = parsed_style.width
             parsed_color_string = get_color_string_for(input) #Get color if set
-            return TextBox(width=width, initial_content=initial_content, color_string=parsed_color_string)
+            return TextBox(width=width, initial_content=initial_content, color_string=parsed_color_string, compact=self.compact)
         else:
             return None
 
-class ButtonConverter:
+class ButtonConverter(Converter):
     '''Converter for buttons.
     This also counts in inline "buttons" (using the definition that buttons are stuff
     that you can click), so therefore, <a> elements are also supported in this converter.'''
@@ -249,9 +275,9 @@ class ButtonConverter:
         color_string = get_color_string_for(input, parsed_style) #Get color string for element
         is_link_like = input.name == "a"
         logger.debug(f"Button is link-like: {is_link_like}")
-        return Button(width, button_text, event, color_string, is_link_like)
+        return Button(width, button_text, event, color_string, is_link_like, compact=self.compact)
 
-class HeadConverter:
+class HeadConverter(Converter):
     '''Converter for the header tag. Adds ANSI commands for title etc.'''
     SET_WINDOW_TITLE = TERMINAL_FONT_WEIGHT.BOLD_TEXT + ">>>{}<<<" + TERMINAL_FONT_WEIGHT.RESET #TODO: I want this to be an ANSI command: \x1b]2;{}\x07 but Windows doesn't like it?
     def converter(self, input):
@@ -263,7 +289,7 @@ class HeadConverter:
             logger.debug(f"Head content {input} does not have a title.")
         return output
 
-class FormConverter:
+class FormConverter(Converter):
     '''Converts forms.'''
     def converter(self, input):
         #The server can send data if the form has an attribute called "data-send-from-terminal" set to "true"
@@ -285,15 +311,15 @@ class FormConverter:
                 logger.debug(f"Button: {button}")
                 if button == None:
                     logger.debug("No button found. Creating fallback...")
-                    post_button = Button("Send", 25, attached_event=post_form_data_event)
+                    post_button = Button("Send", 25, attached_event=post_form_data_event, compact=self.compact)
                 else:
                     logger.debug("Found a button belonging to posting the form.")
-                    post_button = parse_tag(button).parsed_tags[0]
+                    post_button = parse_tag(button, screen_width=self.screen_width, screen_height=self.screen_height, compact=self.compact, measure=self.measure).parsed_tags[0]
                     post_button.attached_event = post_form_data_event #Attach data sending event
                 #Parse other elements in the form
                 logger.debug("Parsing other form elements...")
                 exclude = [button]
-                parsed_other_tags = parse_tags_in(input, exclude=exclude)
+                parsed_other_tags = parse_tags_in(input, exclude=exclude, screen_width=self.screen_width, screen_height=self.screen_height, compact=self.compact, measure=self.measure)
                 for parsed_other_tag in parsed_other_tags:
                     output.extend(parsed_other_tag.parsed_tags)
                 output.append(post_button) #Add sending button to output
@@ -303,9 +329,9 @@ class FormConverter:
                 logger.debug("Form is missing attributes for sending to an external server! (missing action and/or method)")
         else:
             logger.debug("Form is missing attributes for sending to an external server! (missing data attributes)")
-        return parse_tag(input, enforce_converter=TextConverter()) #Use fallback converter
+        return parse_tag(input, enforce_converter=TextConverter(self.screen_width, self.screen_height, self.compact), measure=self.measure) #Use fallback converter
 
-class ListConverter:
+class ListConverter(Converter):
     '''Converts lists.'''
     def converter(self, input):
         content = get_color_string_for(input)
@@ -314,7 +340,7 @@ class ListConverter:
             content += f"* {element.get_text()}\n"
         return content + TERMINAL_COLORS.RESET
 
-class HrConverter:
+class HrConverter(Converter):
     '''Converts horizontal rulers.'''
     def converter(self, input):
         #Check if element has style
@@ -322,11 +348,11 @@ class HrConverter:
         if style != None and "width" in style:
             logger.debug("Custom width defined for hr. Converting...")
             raw_width = style["width"]
-            width_scale = parse_width_height(raw_width, is_width=True, return_default_if_unconvertible=True)
+            width_scale = parse_width_height(raw_width, is_width=True, return_default_if_unconvertible=True, screen_width=self.screen_width, screen_height=self.screen_height)
         else:
             logger.debug("No custom width defined for hr. Using default value...")
             width_scale = 1
-        return get_color_string_for(input) + ("-"*round(DEFAULT_SCREEN_WIDTH*width_scale)) + TERMINAL_COLORS.RESET
+        return get_color_string_for(input) + ("-"*round(self.screen_width*width_scale)) + TERMINAL_COLORS.RESET
 
 TAG_CONVERTERS = {
     "p": TextConverter,
@@ -367,9 +393,21 @@ TAGS_LINE_BREAKS_AFTER = [ #Tags to add line breaks after (new row)
     "input",
 ]
 
-def parse_tag(tag, enforce_converter=None):
+def parse_tag(tag, enforce_converter=None, screen_width=DEFAULT_SCREEN_WIDTH, screen_height=DEFAULT_SCREEN_HEIGHT, compact=False, measure=measure_nothing):
     '''Forwards a tag for further parsing.
 
+    :param tag: The tag to parse.
+
+    :param enforce_converter: If not None, a converter to use instead of the one that is mapped to the tag.
+
+    :param screen_width: The width (in characters) that content can use on the screen.
+
+    :param screen_height: The height (in characters) of the screen.
+
+    :param compact: If True, interactive elements are created without borders or padding.
+
+    :param measure: The timing callback of the translation (see Translator). The converter of the tag is measured as the "convert" step.
+
     :returns: A list of the tag parsed into one or multiple elements'''
     # Get tag name (a, p, etc.)
     tag_name = tag.name
@@ -380,9 +418,10 @@ def parse_tag(tag, enforce_converter=None):
         if tag_name not in TAG_CONVERTERS:
             logger.debug("Using fallback converter for tag...")
             tag_name = "fallback"
-        tag_converter = TAG_CONVERTERS[tag_name]()
+        tag_converter = TAG_CONVERTERS[tag_name](screen_width, screen_height, compact, measure)
     #Execute converter function and return output
-    parsed = tag_converter.converter(tag)
+    with measure("convert", tag_name):
+        parsed = tag_converter.converter(tag)
     logger.debug(f"Tag {tag_name} parsed into: {parsed}")
     if type(parsed) != list:
         #If we get one element returned, check if the element has an id set and if so set it
@@ -393,14 +432,22 @@ def parse_tag(tag, enforce_converter=None):
     return ParsedTag(tag,parsed)
 
 
-def parse_tags_in(parent_tag, exclude=None, previous=None)->List[ParsedTag]:
+def parse_tags_in(parent_tag, exclude=None, previous=None, screen_width=DEFAULT_SCREEN_WIDTH, screen_height=DEFAULT_SCREEN_HEIGHT, compact=False, measure=measure_nothing)->List[ParsedTag]:
     '''Function to parse subtags in a parent tag.
 
     :param parent_tag: The parent to iterate over.
 
     :param exclude: Any tags to exclude
 
-    :param previous: Any previous tags to include in the final tags'''
+    :param previous: Any previous tags to include in the final tags
+
+    :param screen_width: The width (in characters) that content can use on the screen.
+
+    :param screen_height: The height (in characters) of the screen.
+
+    :param compact: If True, interactive elements are created without borders or padding.
+
+    :param measure: The timing callback of the translation (see Translator).'''
     if previous is None:
         previous = []
     if exclude is None:
@@ -417,17 +464,17 @@ def parse_tags_in(parent_tag, exclude=None, previous=None)->List[ParsedTag]:
             continue
         if number_of_children > 0 and tag.name not in HAS_INVIDIDUAL_PARSERS:
             logger.debug(f"Recursively parsing tag {tag}...")
-            parsed_subtags = parse_tags_in(tag) #Use recursion magic if subtags were found again
+            parsed_subtags = parse_tags_in(tag, screen_width=screen_width, screen_height=screen_height, compact=compact, measure=measure) #Use recursion magic if subtags were found again
             #Check if there is content within the parent tag that weren't covered by the recursive search, and if so, fix it
             for tag_child in tag_children:
                 tag_child.decompose()
             if len(tag.get_text().strip()) > 0:
                 logger.debug(f"Tag {tag} has text after decomposing.")
-                parsed_tags.append(parse_tag(tag))
+                parsed_tags.append(parse_tag(tag, screen_width=screen_width, screen_height=screen_height, compact=compact, measure=measure))
             parsed_tags.extend(parsed_subtags)
         else:
             logger.debug(f"Individually parsing tag {tag}")
-            parsed_subtags = parse_tag(tag)
+            parsed_subtags = parse_tag(tag, screen_width=screen_width, screen_height=screen_height, compact=compact, measure=measure)
             parsed_tags.append(parsed_subtags)
     logger.debug(f"Finished with {len(parsed_tags)} parsed tags: {[str(parsed_tag) for parsed_tag in parsed_tags]}.")
     return parsed_tags
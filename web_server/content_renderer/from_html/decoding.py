@@ -0,0 +1,174 @@
+'''decoding.py
+Decodes bytes (fetched documents and input from clients) to text.
+The encoding is found by trying the cheap and reliable methods first, in this order:
+1. A byte order mark (BOM)
+2. A declared charset (the Content-Type header or a <meta charset> tag)
+3. Strict UTF-8 (which also covers plain ASCII)
+Only if all of these fail is the encoding detected statistically, which is slow.'''
+import codecs, logging, re
+
+#Longer BOMs first since the UTF-32 LE BOM starts with the UTF-16 LE BOM
+BYTE_ORDER_MARKS = [
+    (codecs.BOM_UTF32_LE, "utf-32"),
+    (codecs.BOM_UTF32_BE, "utf-32"),
+    (codecs.BOM_UTF8, "utf-8-sig"),
+    (codecs.BOM_UTF16_LE, "utf-16"),
+    (codecs.BOM_UTF16_BE, "utf-16")
+]
+CONTENT_TYPE_CHARSET_REGEX = re.compile("charset\\s*=\\s*[\"']?([A-Za-z0-9._:-]+)", re.IGNORECASE)
+META_CHARSET_REGEX = re.compile(b"<meta[^>]+charset\\s*=\\s*[\"']?\\s*([A-Za-z0-9._:-]+)", re.IGNORECASE)
+META_SCAN_LENGTH = 1024 #Like browsers, only look for a <meta charset> in the start of a document
+FALLBACK_ENCODING = "utf-8" #Used (with replaced errors) if nothing else works
+
+#Where an encoding was found
+SOURCE_BOM = "bom"
+SOURCE_DECLARED = "declared"
+SOURCE_UTF8 = "utf-8"
+SOURCE_REMEMBERED = "remembered"
+SOURCE_DETECTED = "detected"
+SOURCE_FALLBACK = "fallback"
+
+logger = logging.getLogger(__name__)
+
+def normalize_encoding(encoding):
+    '''Returns the Python name of an encoding, or None if Python does not know about it.'''
+    if encoding is None:
+        return None
+    try:
+        return codecs.lookup(encoding).name
+    except LookupError:
+        logger.debug(f"Unknown encoding {encoding}.")
+        return None
+
+def get_bom_encoding(data:bytes):
+    '''Returns the encoding given by the byte order mark at the start of data, or None if there is none.'''
+    for byte_order_mark, encoding in BYTE_ORDER_MARKS:
+        if data.startswith(byte_order_mark):
+            return encoding
+    return None
+
+def get_declared_encoding(data:bytes, content_type:str=None):
+    '''Returns the encoding that is declared for a document, or None if there is none.
+
+    :param data: The document.
+
+    :param content_type: The Content-Type header that the document was sent with, if any. Takes priority over <meta charset>.'''
+    if content_type is not None:
+        match = CONTENT_TYPE_CHARSET_REGEX.search(content_type)
+        if match is not None and normalize_encoding(match.group(1)) is not None:
+            return normalize_encoding(match.group(1))
+    match = META_CHARSET_REGEX.search(data[:META_SCAN_LENGTH])
+    if match is not None:
+        return normalize_encoding(match.group(1).decode("ascii"))
+    return None
+
+def detect_encoding_statistically(data:bytes):
+    '''Guesses the encoding of data from its content. This is slow and should only be used when nothing else works.
+
+    :returns: The guessed encoding, or None if it could not be guessed.'''
+    from charset_normalizer import from_bytes #Imported here since it is only needed for odd content
+    best_match = from_bytes(data).best()
+    return normalize_encoding(best_match.encoding) if best_match is not None else None
+
+def try_decode(data:bytes, encoding):
+    '''Decodes data strictly with an encoding.
+
+    :returns: The decoded text, or None if data is not valid in the encoding.'''
+    try:
+        return data.decode(encoding)
+    except (UnicodeDecodeError, LookupError):
+        return None
+
+def decode(data:bytes, content_type:str=None, remembered_encoding:str=None, look_for_declaration:bool=True):
+    '''Decodes data to text.
+
+    :param data: The data to decode.
+
+    :param content_type: The Content-Type header that the data was sent with, if any.
+
+    :param remembered_encoding: An encoding that has been detected earlier (for example for the same client). Tried before statistical detection.
+
+    :param look_for_declaration: If False, data is not searched for a <meta charset> tag. Should be False for data that is not a document, like input from clients.
+
+    :returns: A tuple: (text, encoding, where the encoding was found (one of the SOURCE_* constants))'''
+    encoding = get_bom_encoding(data)
+    if encoding is not None:
+        return data.decode(encoding, errors="replace"), encoding, SOURCE_BOM
+    encoding = get_declared_encoding(data, content_type) if look_for_declaration or content_type is not None else None
+    if encoding is not None:
+        text = try_decode(data, encoding)
+        if text is not None:
+            return text, encoding, SOURCE_DECLARED
+        logger.debug(f"Data is not valid in its declared encoding {encoding}.")
+    text = try_decode(data, "utf-8")
+    if text is not None:
+        return text, "utf-8", SOURCE_UTF8
+    if remembered_encoding is not None:
+        text = try_decode(data, remembered_encoding)
+        if text is not None:
+            return text, remembered_encoding, SOURCE_REMEMBERED
+    encoding = detect_encoding_statistically(data)
+    if encoding is not None:
+        text = try_decode(data, encoding)
+        if text is not None:
+            logger.debug(f"Detected encoding {encoding} statistically.")
+            return text, encoding, SOURCE_DETECTED
+    logger.debug("Could not detect encoding. Decoding as UTF-8 with replaced errors.")
+    return data.decode(FALLBACK_ENCODING, errors="replace"), FALLBACK_ENCODING, SOURCE_FALLBACK
+
+class SessionDecoder:
+    '''Decodes everything that is related to one client session, and remembers encodings that had to be detected
+    statistically so that detection only has to be done once for a session.'''
+    def __init__(self):
+        self.input_encoding = None #Encoding of the input from the client, if it is not UTF-8
+        self.document_encoding = None #Encoding of the last document without declared encoding that was not UTF-8
+        #Input is decoded as UTF-8 incrementally, since a character might be split between two reads from the client
+        self.input_decoder = codecs.getincrementaldecoder("utf-8")()
+
+    def decode_input(self, data:bytes, final:bool=False):
+        '''Decodes input that has been received from the client. If the input ends with an unfinished UTF-8 character,
+        its bytes are kept and decoded together with the next input (or by flush_input()).
+
+        :param final: If True, the input is complete (like a line in line mode), so nothing is kept for the next input.
+
+        :returns: A tuple: (decoded data, encoding)'''
+        pending_data, _ = self.input_decoder.getstate()
+        if data.isascii() and len(pending_data) == 0: #By far the most common case. ASCII is valid in every encoding we care about
+            return data.decode("ascii"), self.input_encoding or "ascii"
+        if self.input_encoding is None: #The client has only sent UTF-8 so far
+            try:
+                return self.input_decoder.decode(data, final), "utf-8"
+            except UnicodeDecodeError:
+                self.input_decoder.reset()
+        return self.decode_input_encoding(pending_data + data)
+
+    def flush_input(self):
+        '''Decodes the bytes that decode_input() has kept, since no more of the character will come (for example because the
+        client has pressed a key that is not text). In another encoding than UTF-8, they might be a character of their own.
+
+        :returns: A tuple: (decoded data, encoding). The data is empty if nothing has been kept.'''
+        pending_data, _ = self.input_decoder.getstate()
+        if len(pending_data) == 0:
+            return "", self.input_encoding or "ascii"
+        self.input_decoder.reset()
+        return self.decode_input_encoding(pending_data)
+
+    def decode_input_encoding(self, data:bytes):
+        '''Decodes input that is not valid UTF-8 with the encoding of the client, detecting it if it is not known yet.'''
+        text, encoding, source = decode(data, remembered_encoding=self.input_encoding, look_for_declaration=False)
+        if source == SOURCE_DETECTED:
+            self.input_encoding = encoding
+        return text, encoding
+
+    def decode_document(self, data:bytes, content_type:str=None):
+        '''Decodes a document (like a web page) that has been loaded for the client.
+
+        :param data: The document.
+
+        :param content_type: The Content-Type header that the document was sent with, if any.
+
+        :returns: A tuple: (decoded document, encoding)'''
+        text, encoding, source = decode(data, content_type=content_type, remembered_encoding=self.document_encoding)
+        if source == SOURCE_DETECTED:
+            self.document_encoding = encoding
+        return text, encoding
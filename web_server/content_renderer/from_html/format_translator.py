@@ -2,24 +2,60 @@
 This package breaks a HTML-like text file down to a format in which it can be converted to
 a terminal interface.
 '''
-import logging
+import logging, re
 from bs4 import BeautifulSoup
 from .exceptions import *
 from ..screen.element import Row, Column
 from ..screen.scene import Scene
-from .const import DEFAULT_SCREEN_WIDTH
+from .const import DEFAULT_SCREEN_WIDTH, DEFAULT_SCREEN_HEIGHT
 from .converters import TAGS_LINE_BREAKS_AFTER, TAGS_LINE_BREAKS_BEFORE, parse_tag, parse_tags_in, \
-HAS_INVIDIDUAL_PARSERS
+HAS_INVIDIDUAL_PARSERS, measure_nothing
+
+#Matches <meta http-equiv="refresh" content="5"> tags, which pages use to opt in to being updated automatically
+META_REFRESH_REGEX = re.compile("<meta[^>]+http-equiv\\s*=\\s*[\"']?refresh[\"']?[^>]*content\\s*=\\s*[\"']?\\s*([0-9.]+)\\s*[\"'>]", re.IGNORECASE)
+
+def get_refresh_interval(html_content:str):
+    '''Returns how often (in seconds) a page wants to be refreshed according to its <meta http-equiv="refresh"> tag,
+    or 0 if it does not want to be refreshed. Refreshes that redirect to another URL are not supported.'''
+    match = META_REFRESH_REGEX.search(html_content)
+    if match is None:
+        return 0
+    try:
+        return float(match.group(1))
+    except ValueError:
+        return 0
 
 
 class Translator:
-    def __init__(self):
+    def __init__(self, measure=None):
+        '''Initializes a translator.
+
+        :param measure: A function that is called with the name of a step of the translation (and any labels of it) and returns a
+        context manager that the step runs in, for example to time it. The steps are "break_down" (break_down() as called by to_scene()),
+        "parse" (parsing the HTML) and "convert" (a tag converter, with the name of the tag as label). If None, nothing is measured.'''
         self.logger = logging.getLogger(__name__)
+        self.measure = measure if measure is not None else measure_nothing
+
+    def break_down(self, html_content, screen_width=None, screen_height=DEFAULT_SCREEN_HEIGHT, compact=False):
+        '''The main function that breaks down its input.
+
+        :param html_content: The content to break down.
 
-    def break_down(self, html_content):
-        '''The main function that breaks down its input.'''
+        :param screen_width: The width of the screen to break the content down for.
+        If None, the content is broken down for the default width.
+
+        :param screen_height: The height of the screen to break the content down for.
+
+        :param compact: If True, buttons and text boxes are broken down without borders or padding (see the compact render profile).'''
         self.logger.debug("Translating HTML file...")
-        soup = BeautifulSoup(html_content, "lxml")
+        if screen_width is None:
+            content_width = DEFAULT_SCREEN_WIDTH
+            row_kwargs = {}
+        else:
+            content_width = screen_width - 1 #Leave space for the scrollbar
+            row_kwargs = {"screen_width": screen_width, "screen_height": screen_height}
+        with self.measure("parse"):
+            soup = BeautifulSoup(html_content, "lxml")
         #Now, begin the translation.
         #Get head and body
         if soup.find("head"):
@@ -34,25 +70,25 @@ class Translator:
         columns = []
         #Parse head. The converter will return some magic ANSI escape codes.
         head_elements = []
-        head_elements.extend(parse_tag(head))
-        rows.append(Row(columns=[Column(elements=head_elements)]))
+        head_elements.extend(parse_tag(head, screen_width=content_width, screen_height=screen_height, compact=compact, measure=self.measure))
+        rows.append(Row(columns=[Column(elements=head_elements)], **row_kwargs))
         #Parse body
         current_row_content_length = 0
         excluded_tags = []
         self.logger.debug(f"Parsing tag body...")
-        parsed_body_tags = parse_tags_in(body, exclude=excluded_tags)
+        parsed_body_tags = parse_tags_in(body, exclude=excluded_tags, screen_width=content_width, screen_height=screen_height, compact=compact, measure=self.measure)
         self.logger.debug(f"Got {len(parsed_body_tags)} parsed tags back as a response.")
         for parsed_body_tag in parsed_body_tags: #for tag in body.findChildren(recursive=False):
             parsed_tags = parsed_body_tag.parsed_tags
             if parsed_body_tag.space_before:
                 self.logger.debug(f"Inserting new row before tag {parsed_body_tag.original_tag.name}...")
-                rows.append(Row(columns=columns))
+                rows.append(Row(columns=columns, **row_kwargs))
                 columns = []
             max_tag_row_content_length = max([max([len(row) for row in str(parsed_tag).split("\n")]) for parsed_tag in
                                               parsed_tags])  # Sorry about this... but I wanted to play around with oneliners
-            if current_row_content_length + max_tag_row_content_length > DEFAULT_SCREEN_WIDTH:  # Move to new row if needed
+            if current_row_content_length + max_tag_row_content_length > content_width:  # Move to new row if needed
                 self.logger.debug("Resetting current row (max content length reached)...")
-                rows.append(Row(columns=columns))
+                rows.append(Row(columns=columns, **row_kwargs))
                 columns = []
                 current_row_content_length = 0
             else:
@@ -61,16 +97,25 @@ class Translator:
             #Check if a new row should be inserted after the column
             if parsed_body_tag.space_after:
                 self.logger.debug(f"Inserting new row after tag {parsed_body_tag.original_tag.name}...")
-                rows.append(Row(columns=columns))
+                rows.append(Row(columns=columns, **row_kwargs))
                 columns = []
         #If any columns haven't been added to a row yet, do so
         if len(columns) > 0:
-            rows.append(Row(columns=columns))
+            rows.append(Row(columns=columns, **row_kwargs))
         self.logger.debug(f"{len(rows)} rows added.")
         return rows
 
     def to_scene(self, content:str, *args, **kwargs):
         '''Converts raw content by calling the break_down function and then returns
-        a Scene().'''
-        return Scene(rows=self.break_down(content), *args, **kwargs)
+        a Scene(). If a width and/or height is passed to the Scene(), the content is broken down for that size,
+        and if compact is passed as True, it is broken down without borders or padding.
+        If the content has a <meta http-equiv="refresh"> tag, the scene is set to be updated periodically.'''
+        with self.measure("break_down"):
+            if "width" in kwargs:
+                rows = self.break_down(content, kwargs["width"], kwargs.get("height", DEFAULT_SCREEN_HEIGHT), kwargs.get("compact", False))
+            else:
+                rows = self.break_down(content)
+        if "periodically_update_every" not in kwargs:
+            kwargs["periodically_update_every"] = get_refresh_interval(content)
+        return Scene(rows=rows, *args, **kwargs)
 
@@ -1,14 +1,22 @@
 '''sourceloader.py
 Loads an HTML-style source file from directory or from the web.'''
 import logging
-import os, requests, re, ntpath
+import os, re, ntpath, sys, time
 from typing import List
-from .format_translator import Translator
+from .decoding import SessionDecoder, decode
+sys.path.append(".")
+from const import FETCH_TIMEOUT
 
 IS_URL_REGEX = re.compile("https*:\/\/([A-Za-z].)+.[A-Za-z]+(:[0-9]{1,5})?(\/.+)*") #Regex to match URLs
 
+def fetch_with_requests(url, headers:dict):
+    '''Sends a GET request with the requests library. Used by source loaders that are not given a function to fetch with.'''
+    import requests #Imported here since it takes long to import (see startup.py)
+    return requests.get(url, headers=headers, timeout=FETCH_TIMEOUT)
+
 class SourceLoader():
-    def __init__(self, load_from_files:bool, load_from_urls:bool, trusted_directories:List[os.PathLike], trusted_urls:List[str], restrict_filepaths:bool=True, restrict_urls:bool=False):
+    def __init__(self, load_from_files:bool, load_from_urls:bool, trusted_directories:List[os.PathLike], trusted_urls:List[str], restrict_filepaths:bool=True, restrict_urls:bool=False,
+                 fetch=None, response_cache=None, record_event=None, on_fetch=None, measure=None):
         '''Initializes an HTML source loader.
 
         :param load_from_files: Whether to load sources from file storage or not.
@@ -22,6 +30,19 @@ class SourceLoader():
         :param restrict_filepaths: If True, the trusted_directories values will be applied for directories to trust.
 
         :param restrict_urls: If True, the trusted_urls values will be applied for URLs to trust.
+
+        :param fetch: A function that sends a GET request. It is called with the URL and a dictionary of headers, and returns
+        the response of the requests library. If None, requests.get() is used.
+
+        :param response_cache: A cache to get the responses of websites from (see HTTPCache in http_cache.py). If None, every load sends a request.
+
+        :param record_event: A function that is called with "source" and the URL and content (as keyword arguments) when a website
+        has been loaded, for example to record it in a trace. If None, nothing is recorded.
+
+        :param on_fetch: A function that is called with the source, the number of seconds that loading it took and whether it failed
+        after a source has been loaded, for example to measure loads. If None, nothing is done.
+
+        :param measure: The timing callback to translate content with (see Translator). If None, nothing is measured.
         '''
         self.load_from_files = load_from_files
         self.load_from_urls = load_from_urls
@@ -29,23 +50,40 @@ class SourceLoader():
         self.trusted_urls = trusted_urls
         self.restrict_filepaths = restrict_filepaths
         self.restrict_urls = restrict_urls
+        self.fetch = fetch if fetch is not None else fetch_with_requests
+        self.response_cache = response_cache
+        self.record_event = record_event if record_event is not None else lambda event_type, **data: None
+        self.on_fetch = on_fetch if on_fetch is not None else lambda source, seconds, failed: None
+        self.measure = measure
         self.logger = logging.getLogger(__name__)
 
-    def load_source_content(self, source_string):
+    def decode_content(self, content:bytes, content_type:str=None, decoder:SessionDecoder=None):
+        '''Decodes loaded content to text.
+
+        :param content: The loaded content.
+
+        :param content_type: The Content-Type header that the content was sent with, if any.
+
+        :param decoder: The decoder of the session that the content is loaded for, if any. Remembers detected encodings.'''
+        if decoder is not None:
+            text, encoding = decoder.decode_document(content, content_type)
+        else:
+            text, encoding, _ = decode(content, content_type)
+        self.logger.debug(f"Decoded content as {encoding}.")
+        return text
+
+    def load_source_content(self, source_string, decoder:SessionDecoder=None):
         '''Loads a source's content.
 
-        :param source_string: A source: This could be a file path or a URL.'''
+        :param source_string: A source: This could be a file path or a URL.
+
+        :param decoder: The decoder of the session that the content is loaded for, if any.'''
         self.logger.info(f"Loading content from: {source_string}...")
         if IS_URL_REGEX.fullmatch(source_string):
             self.logger.debug("Source is URL. Validating source...")
-            if self.load_from_urls and not (self.restrict_urls and source_string not in self.trusted_urls):
-                self.logger.info("Source URL is valid. Loading from it...")
-                try:
-                    return requests.get(source_string, headers={"User-Agent": "Python/SourceFileContentLoader"}).text
-                except Exception as e:
-                    self.logger.warning(f"Can not load source from {source_string} - Request to {source_string} failed. ({e})", exc_info=True)
-            else:
-                self.logger.warning(f"Can not load source from {source_string} - restricted by security settings.")
+            content = self.load_url_content(source_string, decoder)
+            self.record_event("source", source=source_string, content=content)
+            return content
         else:
             self.logger.debug("Source is file. Checking path validity...")
             if os.path.exists(source_string):
@@ -54,26 +92,90 @@ class SourceLoader():
                 directory_name = os.path.dirname(source_string)
                 if self.load_from_files and not (self.restrict_filepaths and directory_name not in self.trusted_directories):
                     self.logger.info("Source filepath is valid. Loading from it...")
+                    start_time = time.perf_counter()
+                    failed = False
                     try:
-                        return open(source_path, "r").read()
+                        with open(source_path, "rb") as source_file:
+                            return self.decode_content(source_file.read(), decoder=decoder)
                     except Exception as e:
+                        failed = True
                         self.logger.warning(f"Can not load from {source_string} - exception occurred ({e})", exc_info=True)
+                    finally:
+                        self.on_fetch(source_string, time.perf_counter() - start_time, failed)
                 else:
                     self.logger.warning(f"Can not load source from {source_string} - is restricted by security settings.")
             else:
                 self.logger.warning(f"Can not load {source_string} - path does not exist.")
         return
 
-    def load_source_into_scene(self, source):
+    def load_url_content(self, source_string, decoder:SessionDecoder=None):
+        '''Loads a source's content from a URL (see load_source_content()).
+
+        :returns: The content, or None if it could not be loaded.'''
+        if self.load_from_urls and not (self.restrict_urls and source_string not in self.trusted_urls):
+            self.logger.info("Source URL is valid. Loading from it...")
+            start_time = time.perf_counter()
+            failed = False
+            try:
+                if self.response_cache is not None:
+                    response = self.response_cache.get(source_string, self.request_url)
+                    content_type = response.content_type
+                else:
+                    response = self.request_url(source_string, {})
+                    content_type = response.headers.get("Content-Type")
+                failed = response.status_code >= 400
+                return self.decode_content(response.content, content_type, decoder)
+            except Exception as e:
+                failed = True
+                self.logger.warning(f"Can not load source from {source_string} - Request to {source_string} failed. ({e})", exc_info=True)
+            finally:
+                self.on_fetch(source_string, time.perf_counter() - start_time, failed)
+        else:
+            self.logger.warning(f"Can not load source from {source_string} - restricted by security settings.")
+
+    def request_url(self, url, headers:dict):
+        '''Sends a GET request to a URL.
+
+        :param url: The URL.
+
+        :param headers: Any extra headers to send, like the ones for a conditional GET.
+
+        :returns: The response of the requests library.'''
+        return self.fetch(url, {"User-Agent": "Python/SourceFileContentLoader", **headers})
+
+    def load_source_into_scene(self, source, decoder:SessionDecoder=None, **scene_kwargs):
         '''Executes load_source_content() and then tries to load that content
-        into a Scene()'''
+        into a Scene()
+
+        :param source: The source to load.
+
+        :param decoder: The decoder of the session that the source is loaded for, if any.
+
+        :param scene_kwargs: Any extra keyword arguments to pass on to the Scene().'''
         self.logger.debug(f"Loading {source} into a scene...")
-        content = self.load_source_content(source)
-        self.format_translator = Translator()
+        content = self.load_source_content(source, decoder)
         if content != None:
-            try:
-                return self.format_translator.to_scene(content, source=source)
-            except Exception as e:
-                self.logger.warning(f"Failed loading {source} into a scene - the exception {e} occurred.", exc_info=True)
+            return self.translate(content, source, **scene_kwargs)
         else:
-            self.logger.warning("Got None as content response.")
\ No newline at end of file
+            self.logger.warning("Got None as content response.")
+
+    def translate(self, content:str, source, **scene_kwargs):
+        '''Tries to load content that has already been loaded into a Scene().
+
+        :param content: The content.
+
+        :param source: The source that the content was loaded from.
+
+        :param scene_kwargs: Any extra keyword arguments to pass on to the Scene().
+
+        :returns: The scene, or None if the content could not be translated.'''
+        from .format_translator import Translator #Imported here since bs4 and cssutils take long to import (see startup.py)
+        self.format_translator = Translator(self.measure)
+        try:
+            return self.format_translator.to_scene(content, source=source, **scene_kwargs)
+        except Exception as e:
+            self.logger.warning(f"Failed loading {source} into a scene - the exception {e} occurred.", exc_info=True)
+
+    def is_url(self, source):
+        '''Returns True if a source is a URL, and False if it is a file path.'''
+        return IS_URL_REGEX.fullmatch(source) is not None
\ No newline at end of file
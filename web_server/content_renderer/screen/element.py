@@ -1,3 +1,4 @@
+import copy
 from typing import List
 
 class Justify:
@@ -7,6 +8,7 @@ class Justify:
     END = "end"
     
 class Column:
+    __slots__ = ("elements", "id_to_element", "row_string", "max_column_row_length")
     def __init__(self, elements:List):
         '''Inspired by the way HTML-websites have grids.
         Column elements will be placed in the same position vertically.
@@ -28,7 +30,17 @@ class Column:
             if hasattr(element, "id"): #Add to element ID mapping
                 self.id_to_element[element.id] = element
 
+    def copy_with_elements(self, element_copies):
+        '''Returns a copy of the column where some elements have been replaced with copies of them. Other elements are shared with this column.
+
+        :param element_copies: Mapping: id() of an element to its copy.'''
+        column = copy.copy(self)
+        column.elements = [element_copies.get(id(element), element) for element in self.elements]
+        column.id_to_element = {element_id: element_copies.get(id(element), element) for element_id, element in self.id_to_element.items()}
+        return column
+
 class Row:
+    __slots__ = ("columns", "screen_width", "screen_height", "justify_x", "justify_y", "scrollbar_width", "row_string", "max_column_row_length")
     def __init__(self, columns:List[Column], screen_width:int=80, screen_height:int=64, justify_x:Justify=None, justify_y:Justify=None, scrollbar_width=1):
         '''Inspired by the way HTML-websites have grids.
         Row elements will be placed in the same position vertically.
@@ -52,23 +64,33 @@ class Row:
         self.justify_y = justify_y
         self.scrollbar_width = scrollbar_width
 
+    def copy_with_elements(self, element_copies):
+        '''Returns a copy of the row where some elements have been replaced with copies of them (see Column.copy_with_elements()).
+        Columns without any of the elements are shared with this row.
+
+        :param element_copies: Mapping: id() of an element to its copy.'''
+        row = copy.copy(self)
+        row.columns = [column.copy_with_elements(element_copies) if any(id(element) in element_copies for element in column.elements) else column
+                       for column in self.columns]
+        return row
+
     def __str__(self):
-        #Generate row string
-        self.row_string = ""
-        after = []
+        #Generate row string. Rows can be shared between scenes of different sessions (see Scene.copy_for_session()),
+        #so the row is not changed until the string is done
+        row_string = ""
         all_column_rows = []
-        self.max_column_row_length = 0
+        max_column_row_length = 0
         # Determine spacing between elements
+        columns = self.columns
         if self.justify_x == Justify.CENTER:  # Add two blank columns
-            self.columns.insert(0, Column([""]))
-            self.columns.append(Column([""]))
+            columns = [Column([""])] + columns + [Column([""])]
         elif self.justify_x == Justify.END: #Add one blank column
-            self.columns.insert(0, Column([""]))
-        if len(self.columns) > 0:
-            width_per_element = round((self.screen_width-self.scrollbar_width) / len(self.columns))
+            columns = [Column([""])] + columns
+        if len(columns) > 0:
+            width_per_element = round((self.screen_width-self.scrollbar_width) / len(columns))
         else: #Prevent division by zero
             width_per_element = round(self.screen_width-self.scrollbar_width)
-        for column in self.columns:
+        for column in columns:
             column_rows = []
             for element in column.elements: #Find biggest element in the column
                 element_str = str(element)
@@ -99,11 +121,11 @@ class Row:
                     element_rows.extend(parsed_rows)
                 column_rows.extend(element_rows)
             #Check if max column length has been passed
-            if len(column_rows) > self.max_column_row_length:
-                self.max_column_row_length = len(column_rows)
+            if len(column_rows) > max_column_row_length:
+                max_column_row_length = len(column_rows)
             all_column_rows.append(column_rows)
         #Now, draw row content by iterating over the column content.
-        for row_number in range(1, self.max_column_row_length+1):
+        for row_number in range(1, max_column_row_length+1):
             for column_rows in all_column_rows:
                 #Check if column has a row for this row number, if not, fill with blank space
                 if len(column_rows) >= row_number:
@@ -114,7 +136,9 @@ class Row:
                         element_str += " "*(width_per_element - len(element_str))
                 else: #Add empty space if element does not have content for the current row
                     element_str = " "*width_per_element
-                self.row_string += element_str
-            self.row_string += "\n"
-        return self.row_string
+                row_string += element_str
+            row_string += "\n"
+        self.row_string = row_string
+        self.max_column_row_length = max_column_row_length
+        return row_string
             
@@ -2,10 +2,14 @@
 Interactive column elements for placing into a column.'''
 import string, logging, sys, re
 sys.path.append("...")
-from const import TERMINAL_COLORS, KEY_ENTER
+from const import TERMINAL_COLORS, KEY_ENTER, KEY_BACKSPACE, KEY_BACKSPACE_ALTERNATIVE
 from .event import Event
 from .rendering_helpers import true_length
 class InteractiveElement:
+    #The position of the element in its scene (parent_row_index etc.) is set by the scene, and an ID by the converters
+    __slots__ = ("is_active", "cursor_offset_from_first_character", "element_index_in_row", "element_index_on_screen",
+                 "parent_row_index", "parent_column_index", "element_index", "id")
+    logger = logging.getLogger(__name__)
     def __init__(self):
         self.is_active = False
         #When the interactive element is active, we want to move the cursor to it.
@@ -15,23 +19,26 @@ class InteractiveElement:
         #At which index in the screen the interactive element starts at
         self.element_index_in_row = None
         self.element_index_on_screen = None
-        self.logger = logging.getLogger(__name__)
 
 
 class TextBox(InteractiveElement):
-    def __init__(self, width, initial_content="", color_string=""):
+    __slots__ = ("content", "width", "color_string", "last_changed", "compact")
+    def __init__(self, width, initial_content="", color_string="", compact=False):
         '''Creates a basic text box.
 
         :param width: The width of the textbox.
 
         :param initial_content: If specified, the initial content to have in the textbox.
 
-        :param color_string: Terminal color data to add to the beginning of the textbox string.'''
+        :param color_string: Terminal color data to add to the beginning of the textbox string.
+
+        :param compact: If True, the textbox is rendered as a single line without borders.'''
         super().__init__()
         self.content = initial_content
         self.width = width
         self.color_string = color_string
         self.last_changed = 0
+        self.compact = compact
 
     def __str__(self):
         filled_out_content = self.content
@@ -41,6 +48,8 @@ class TextBox(InteractiveElement):
             filled_out_content = filled_out_content[-max_content_length:][:max_content_length-1]
         elif filled_out_content_length < max_content_length: #Add spacing
             filled_out_content = filled_out_content + " "*(self.width-filled_out_content_length-2)
+        if self.compact:
+            return f"{self.color_string}{'>' if self.is_active else '['}{filled_out_content}{'<' if self.is_active else ']'}{TERMINAL_COLORS.RESET}"
         border_character = "." if self.is_active else "-"
         #Render a final textbox
         return f"""{self.color_string}
@@ -51,18 +60,33 @@ class TextBox(InteractiveElement):
         """
 
     def on_keypress(self, key, decoded_key):
-        '''Handler for when a key is pressed'''
+        '''Handler for when a key is pressed. The key can be several keys that were typed in a row, like pasted text
+        (see Session.handle_keys()), in which backspaces remove the character before them.'''
         #If keypress is a letter key and I am focused, add input to textbox content
         self.logger.debug(f"Handling keypress for textbox (pressed keys: {key})...")
         if self.is_active:
-            self.logger.debug(f"Adding content to textbox: {key}.")
-            self.content += decoded_key
+            if decoded_key in [KEY_BACKSPACE, KEY_BACKSPACE_ALTERNATIVE]:
+                self.logger.debug("Removing last character from textbox.")
+                self.content = self.content[:-1]
+            elif decoded_key.isprintable():
+                self.logger.debug(f"Adding content to textbox: {key}.")
+                self.content += decoded_key
+            else:
+                self.logger.debug(f"Adding the printable characters of {key} to textbox.")
+                content = self.content
+                for character in decoded_key:
+                    if character in [KEY_BACKSPACE, KEY_BACKSPACE_ALTERNATIVE]:
+                        content = content[:-1]
+                    elif character.isprintable():
+                        content += character
+                self.content = content
         else:
             self.logger.debug(f"Content will not be added to textbox. (focused: {self.is_active})")
         return self
 
 class Button(InteractiveElement):
-    def __init__(self, width, text, attached_event:Event=None, color_string:str="", is_link_like=False):
+    __slots__ = ("width", "text", "attached_event", "color_string", "is_link_like", "compact")
+    def __init__(self, width, text, attached_event:Event=None, color_string:str="", is_link_like=False, compact=False):
         '''Initializes a button.
 
         :param width: Width of the button
@@ -73,12 +97,15 @@ class Button(InteractiveElement):
 
         :param color_string: Terminal color string for changing button color.
 
-        :param is_link_like: Whether the button is supposed to render as a link rather than as a button.'''
+        :param is_link_like: Whether the button is supposed to render as a link rather than as a button.
+
+        :param compact: If True, the button is rendered as a single line without borders.'''
         self.width = width
         self.text = text
         self.attached_event = attached_event
         self.color_string = color_string
         self.is_link_like = is_link_like
+        self.compact = compact
         super().__init__()
 
     def on_update(self):
@@ -98,6 +125,8 @@ class Button(InteractiveElement):
         filled_out_content = self.text
         if len(filled_out_content) > self.width-2: #Clip content if too large
             filled_out_content = filled_out_content[-self.width-2:]
+        if self.compact: #No spacing either
+            return f"{self.color_string}{'>' if self.is_active else '|'}{filled_out_content}|{TERMINAL_COLORS.RESET}"
         elif len(filled_out_content) < self.width-2: #Add spacing if too small
             filled_out_content += " "*(self.width-len(filled_out_content)-2)
         if not self.is_link_like:
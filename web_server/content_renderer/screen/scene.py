@@ -1,13 +1,15 @@
-import logging, requests, math, re, sys
+import logging, math, re, sys, copy
 from .element import Row
 from typing import List
-from .interactive_elements import InteractiveElement
+from .interactive_elements import InteractiveElement, TextBox
 sys.path.append("...")
-from const import NAVIGATE, ARROW_KEY_CODES, ARROW_KEYS_REVERSED, ARROW_KEYS_LEFT_RIGHT, TERMINAL_COLORS
+from const import NAVIGATE, ARROW_KEY_CODES, ARROW_KEYS_REVERSED, ARROW_KEYS_LEFT_RIGHT, TERMINAL_COLORS, FETCH_TIMEOUT
 from .event import Event
 from .rendering_helpers import true_length
 class Cursor:
     '''Represents a cursor on the screen. Default position is top right.'''
+    __slots__ = ("position_x", "position_y", "max_x", "max_y")
+    logger = logging.getLogger(__name__)
     def __init__(self, position_x=0, position_y=0, max_x=80, max_y=24):
         '''Initializes a cursor.
 
@@ -24,7 +26,6 @@ class Cursor:
         self.position_y = position_y
         self.max_x = max_x
         self.max_y = max_y
-        self.logger = logging.getLogger(__name__)
 
     def navigate_to(self, x, y):
         '''Returns the necessary key combinations for navigating to a certain coordinate from the cursor's current position'''
@@ -57,7 +58,11 @@ class Cursor:
 class Scene:
     '''A Scene represents the active scene on the screen.
     It contains rows which in turn contains columns which in turn contains elements.'''
-    def __init__(self, rows:List[Row], width=80, height=24, current_scroll_position=0, periodically_update_every=0.5, source=None, scrolling_speed=0.25):
+    __slots__ = ("rows", "width", "height", "total_content_height", "current_scroll_position", "cursor_string", "source",
+                 "current_row_string", "periodically_update_every", "force_reload", "defer_requests", "pending_requests",
+                 "prototype_key", "cursor", "scrolling_speed", "interactive_elements", "active_interactive_element_index", "compact")
+    logger = logging.getLogger(__name__)
+    def __init__(self, rows:List[Row], width=80, height=24, current_scroll_position=0, periodically_update_every=0, source=None, scrolling_speed=0.25, defer_requests=False, compact=False):
         '''Initializes a scene.
 
         :param elements: A list of rows that are on the screen.
@@ -68,23 +73,32 @@ class Scene:
 
         :param current_scroll_position: Row offset to apply for scrolling
 
-        :param periodically_update_every: How often to periodically update the screen.
+        :param periodically_update_every: How often (in seconds) to check the source for changes and update the screen.
+        0 means never. Pages opt in to this with a <meta http-equiv="refresh"> tag.
 
         :param source: The source URL or file that the screen content was loaded from.
 
         :param scrolling_speed: How fast to scroll the application per input - 0.5x means 1/2 of the total screen height
+
+        :param defer_requests: If True, form data will not be sent to external sources while handling an event.
+        Instead, it is added to pending_requests and sent when send_pending_requests() is called.
+
+        :param compact: Whether the rows were broken down without borders or padding (see the compact render profile).
         '''
         self.rows = rows
+        self.compact = compact
         self.width = width
         self.height = height
         self.total_content_height = 0
-        self.logger = logging.getLogger(__name__)
         self.current_scroll_position = current_scroll_position
         self.cursor_string = "" #Keycode buffer for what to write to move string
         self.source = source
+        self.prototype_key = None #Set if the scene is shared between sessions (see frame_cache.py). Shared scenes must never be changed
         self.current_row_string = self.render()
         self.periodically_update_every = periodically_update_every
         self.force_reload = False #Whether to force reload of the next reload. Used for event handling.
+        self.defer_requests = defer_requests
+        self.pending_requests = [] #Events for requests that have been deferred
         self.cursor = Cursor(position_y=height, max_x=width, max_y=height) #Initialize a cursor for the scene
         self.scrolling_speed = scrolling_speed
         #Iterate through interactive elements and try to find all elements that are interactive
@@ -114,6 +128,42 @@ class Scene:
                 column_index += 1
             row_index += 1
 
+    def copy_for_session(self):
+        '''Returns a copy of the scene that a session can change without changing this scene (see Session.ensure_own_scene()).
+        Only what changes when the user interacts with the scene is copied: the interactive elements and the rows and columns
+        that they are in. Everything else (like the text of the page) is shared with this scene.'''
+        scene = copy.copy(self)
+        element_copies = {id(element): copy.copy(element) for element in self.interactive_elements}
+        scene.rows = [row.copy_with_elements(element_copies) if any(id(element) in element_copies for column in row.columns for element in column.elements) else row
+                      for row in self.rows]
+        scene.interactive_elements = [element_copies[id(element)] for element in self.interactive_elements]
+        scene.pending_requests = list(self.pending_requests)
+        scene.cursor = copy.copy(self.cursor)
+        scene.prototype_key = None
+        return scene
+
+    def copy_state_from(self, other_scene):
+        '''Copies what the user has done in another scene (scroll position, active element and text typed into
+        text boxes) to this scene. Used when a scene is replaced with a newer version of the same page.
+
+        :param other_scene: The scene to copy from.'''
+        self.current_scroll_position = min(other_scene.current_scroll_position, self.total_content_height)
+        for element_id in other_scene.element_ids(): #Text boxes are matched by their IDs
+            try:
+                old_element, new_element = other_scene[element_id], self[element_id]
+            except KeyError:
+                continue
+            if isinstance(old_element, TextBox) and isinstance(new_element, TextBox):
+                new_element.content = old_element.content
+        if len(self.interactive_elements) > 0 and other_scene.active_interactive_element_index != self.active_interactive_element_index:
+            self.set_interactive_element(self.interactive_elements[self.active_interactive_element_index], False)
+            self.active_interactive_element_index = min(other_scene.active_interactive_element_index, len(self.interactive_elements)-1)
+            self.set_interactive_element(self.interactive_elements[self.active_interactive_element_index], True)
+        #The other scene might still be shown again (for example from the history), so its cursor is not shared
+        self.cursor.position_x = other_scene.cursor.position_x
+        self.cursor.position_y = other_scene.cursor.position_y
+        self.cursor_string = other_scene.cursor_string
+
     def update_element_at(self, row_index:int, column_index:int, element_index:int, new_element_data):
         '''Shortcut function to update an element at a certain position.
 
@@ -147,37 +197,42 @@ class Scene:
         return scrollbar_lines
 
     def render(self):
-        '''Renders the screen to characters.'''
-        self.scrollbar_lines = self.get_scrollbar_lines()
-        self.current_row_string = ""
+        '''Renders the screen to characters. The frame and the height of the content are remembered in the scene,
+        unless the scene is shared between sessions (see frame_cache.py): other threads might be rendering it at the same time.'''
+        frame, total_content_height = self.render_frame()
+        if self.prototype_key is None:
+            self.current_row_string = frame
+            self.total_content_height = total_content_height
+        return frame
+
+    def render_frame(self):
+        '''Renders the screen to characters without changing the scene.
+
+        :returns: The frame, and the height of the content (all rows, before scrolling and clipping).'''
+        scrollbar_lines = self.get_scrollbar_lines()
         all_individual_rows = []
         row_index = 0
         for row in self.rows:
             row_string = str(row)
             for individual_row in row_string.split("\n"):
-                final_row = ""
-                for character in individual_row:
-                    final_row += character
-                if len(self.scrollbar_lines)-1 >= row_index: #Add scrollbars if needed
-                    scrollbar_line = self.scrollbar_lines[row_index] #Get scrollbar content for this row TODO: Fix colors - scrollbar is being affected by colors of other elements
+                final_row = individual_row
+                if len(scrollbar_lines)-1 >= row_index: #Add scrollbars if needed
+                    scrollbar_line = scrollbar_lines[row_index] #Get scrollbar content for this row TODO: Fix colors - scrollbar is being affected by colors of other elements
                     if true_length(final_row)+len(scrollbar_line) < self.width:
                         final_row += " "*(self.width-len(scrollbar_line)-true_length(final_row))
                     #Add scrollbar line
                     final_row += scrollbar_line
                 all_individual_rows.append(final_row)
                 row_index += 1
-        self.total_content_height = len(all_individual_rows)
         self.logger.debug(f"Scrolling offset: {self.current_scroll_position}.")
         individual_rows = all_individual_rows[self.current_scroll_position:] #Apply scrolling offset right away
         #If the text is too tall for the current height, clip it
         if len(individual_rows) > self.height:
             individual_rows = individual_rows[:self.height]
-        #Join strings again and return
-        self.current_row_string = "\n".join(individual_rows)
-        #Add extra cursor moving characters
-        self.current_row_string += self.cursor_string
+        #Join strings again and add extra cursor moving characters
+        frame = "\n".join(individual_rows) + self.cursor_string
         self.logger.debug(f"Added cursor string (which has a length of {len(self.cursor_string)})")
-        return self.current_row_string
+        return frame, len(all_individual_rows)
 
     def set_interactive_element(self, element, active):
         '''Function for setting if an interactive element is active or not.
@@ -201,7 +256,9 @@ class Scene:
         self.cursor_string = ""
         if key in ARROW_KEYS_REVERSED:
             active_key_name = ARROW_KEYS_REVERSED[key]
-            if key in ARROW_KEYS_LEFT_RIGHT: #Left or right key - Change which element that is active
+            if key in ARROW_KEYS_LEFT_RIGHT and len(self.interactive_elements) == 0:
+                self.logger.debug(f"{active_key_name} was pressed, but there are no interactive elements to change between.")
+            elif key in ARROW_KEYS_LEFT_RIGHT: #Left or right key - Change which element that is active
                 self.logger.debug(f"{active_key_name} was pressed - changing currently active element index.")
                 # Bump active item
                 self.set_interactive_element(self.interactive_elements[self.active_interactive_element_index], False)
@@ -237,27 +294,35 @@ class Scene:
             #Move cursor since position on screen has changed in one way or another in this step
             self.logger.debug("Moving cursor between items.")
             self.cursor.move(active_key_name)
+        #The scene is traversed once per update, which can contain many typed keys (see Session.handle_keys()). The messages
+        #about every single element are only built if they are logged, since building them takes longer than the update itself
+        log_details = self.logger.isEnabledFor(logging.DEBUG)
+        handle_keypress = key is not None and key not in ARROW_KEY_CODES
+        if handle_keypress:
+            # Provide a decoded version of the key
+            if type(key) != str:
+                if encoding != None:
+                    decoded_key = key.decode(encoding=encoding)
+                else:
+                    decoded_key = key.decode()
+            else:
+                decoded_key = key
         row_index = 0
-        self.logger.debug(f"Iterating over row {self.rows}...")
+        if log_details:
+            self.logger.debug(f"Iterating over row {self.rows}...")
         for row in self.rows:
-            self.logger.debug(f"Iterating over columns {row.columns}...")
+            if log_details:
+                self.logger.debug(f"Iterating over columns {row.columns}...")
             column_index = 0
             for column in row.columns:
-                self.logger.debug(f"Iterating over elements {column.elements}...")
+                if log_details:
+                    self.logger.debug(f"Iterating over elements {column.elements}...")
                 element_index = 0
                 for element in column.elements:
                     #Check and execute handlers depending on what is happening
-                    self.logger.debug(f"{key} is arrow key: {key in ARROW_KEY_CODES} ({ARROW_KEY_CODES})")
-                    if key is not None and key not in ARROW_KEY_CODES and hasattr(element, "on_keypress"):
-                        self.logger.debug(f"Running keypress handler for {element}...")
-                        # Provide a decoded version of the key
-                        if type(key) != str:
-                            if encoding != None:
-                                decoded_key = key.decode(encoding=encoding)
-                            else:
-                                decoded_key = key.decode()
-                        else:
-                            decoded_key = key
+                    if handle_keypress and hasattr(element, "on_keypress"):
+                        if log_details:
+                            self.logger.debug(f"Running keypress handler for {element}...")
                         updated_element_data = element.on_keypress(key, decoded_key)
                         #Keypress handler might return a list of events. Check that
                         if type(updated_element_data) == tuple:
@@ -272,7 +337,8 @@ class Scene:
                             self.logger.debug("No event was raised from the handler.")
                             element = updated_element_data
                     elif hasattr(element, "on_update"):
-                        self.logger.debug(f"Running update handler for {element}...")
+                        if log_details:
+                            self.logger.debug(f"Running update handler for {element}...")
                         element = element.on_update()
 
                     #Make sure to move cursor to active element
@@ -297,8 +363,10 @@ class Scene:
                                 self.logger.debug("Cursor was moved to the wanted position.")
                             else:
                                 self.logger.debug(f"Cursor does not have to be moved (is already at wanted position X {wanted_cursor_position_x}, Y {wanted_cursor_position_y})")
-                    self.logger.debug(f"Got an updated element: {element}")
-                    self.update_element_at(row_index, column_index, element_index, element)
+                    if element is not column.elements[element_index]:
+                        if log_details:
+                            self.logger.debug(f"Got an updated element: {element}")
+                        self.update_element_at(row_index, column_index, element_index, element)
                     element_index += 1
                 column_index += 1
             row_index += 1
@@ -329,8 +397,10 @@ class Scene:
         '''Optimizes output for the terminal.'''
         terminal_lines = []
         rendered_content = self.render()
-        for line in rendered_content.split("\n"):
-            terminal_line = (line + "\r\n").encode()
+        lines = rendered_content.split("\n")
+        for line_index, line in enumerate(lines):
+            #No line break is added after the last line, since it would scroll the terminal if the scene fills it
+            terminal_line = (line + ("\r\n" if line_index < len(lines)-1 else "")).encode()
             terminal_lines.append(terminal_line)
         return terminal_lines
 
@@ -348,36 +418,68 @@ class Scene:
             self.logger.debug("Changing source...")
             self.source = event.data["source"]
         elif event.type == Event.SEND_INPUT_TO:
-            self.logger.debug("Sending input to an external source...")
-            #Get source element to get value from
-            request_data = {}
-            for source_element_id in event.data["source_ids"]:
-                #Get where to send it
-                send_to = event.data["send_to"]
-                try:
-                    source_element = self[source_element_id]
-                except KeyError:
-                    self.logger.warning(f"Requested input source element was not found. (available IDs: {self.element_ids()}, accessed: {source_element_id})")
-                    continue
-                #Get source element content. All inputs should have the content in a variable called "content"
-                source_element_content = source_element.content
-                self.logger.debug(f"Source element content: {source_element_content}. Adding...")
-                request_data[source_element_id] = source_element_content
-            #Sent requests will be POST requests with the parameters defined below (headers etc.)
-            try:
-                self.logger.debug(f"Sending request data to {send_to}...")
-                request = requests.post(send_to, data=request_data,
-                                        headers={"User-Agent": "Python/SceneServer",
-                                                 "Content-Type": "application/x-www-form-urlencoded"},
-                                        allow_redirects=True)
-                self.logger.debug(f"Request finished with {request.status_code}, text {request.text}")
-                if not request.ok:
-                    self.logger.warning(f"Request sent to {send_to} might have failed (status code is not ok).")
-                if request.url != self.source:
-                    self.logger.debug("Updating request source to new URL...")
-                    self.source = request.url
-                self.force_reload = True #Force reload of source in case the content has updated.
-            except Exception as e:
-                self.logger.warning(f"Could not send request to external URL {send_to} (the exception {e} occurred).", exc_info=True)
+            if self.defer_requests:
+                self.logger.debug("Deferring sending of input to an external source...")
+                self.pending_requests.append(event)
+            else:
+                self.send_input(event)
         else:
-            self.logger.warning("Scene handled an event it could not understand.")
\ No newline at end of file
+            self.logger.warning("Scene handled an event it could not understand.")
+
+    def send_pending_requests(self, post=None, record_event=None):
+        '''Sends any requests that have been deferred (see the defer_requests parameter).
+
+        :param post: The function to send the requests with (see send_input()).
+
+        :param record_event: A function to call for every sent request (see send_input()).'''
+        while len(self.pending_requests) > 0:
+            self.send_input(self.pending_requests.pop(0), post, record_event)
+
+    def send_input(self, event:Event, post=None, record_event=None):
+        '''Sends input of elements to an external source as described by an Event.SEND_INPUT_TO event.
+
+        :param event: The event.
+
+        :param post: A function that sends a POST request and returns the response, with the same arguments as requests.post().
+        If None, requests.post() is used.
+
+        :param record_event: A function that is called with "post" and what happened (as keyword arguments) when the request
+        is done, for example to record it in a trace. If None, nothing is recorded.'''
+        self.logger.debug("Sending input to an external source...")
+        if post is None:
+            import requests #Imported here since it takes long to import
+            post = lambda url, **kwargs: requests.post(url, timeout=FETCH_TIMEOUT, **kwargs)
+        if record_event is None:
+            record_event = lambda event_type, **data: None
+        #Get source element to get value from
+        request_data = {}
+        for source_element_id in event.data["source_ids"]:
+            #Get where to send it
+            send_to = event.data["send_to"]
+            try:
+                source_element = self[source_element_id]
+            except KeyError:
+                self.logger.warning(f"Requested input source element was not found. (available IDs: {self.element_ids()}, accessed: {source_element_id})")
+                continue
+            #Get source element content. All inputs should have the content in a variable called "content"
+            source_element_content = source_element.content
+            self.logger.debug(f"Source element content: {source_element_content}. Adding...")
+            request_data[source_element_id] = source_element_content
+        #Sent requests will be POST requests with the parameters defined below (headers etc.)
+        try:
+            self.logger.debug(f"Sending request data to {send_to}...")
+            request = post(send_to, data=request_data,
+                           headers={"User-Agent": "Python/SceneServer",
+                                    "Content-Type": "application/x-www-form-urlencoded"},
+                           allow_redirects=True)
+            self.logger.debug(f"Request finished with {request.status_code}, text {request.text}")
+            record_event("post", send_to=event.data.get("send_to"), url=request.url, status_code=request.status_code)
+            if not request.ok:
+                self.logger.warning(f"Request sent to {send_to} might have failed (status code is not ok).")
+            if request.url != self.source:
+                self.logger.debug("Updating request source to new URL...")
+                self.source = request.url
+            self.force_reload = True #Force reload of source in case the content has updated.
+        except Exception as e:
+            record_event("post", send_to=event.data.get("send_to"), error=str(e))
+            self.logger.warning(f"Could not send request to external URL {send_to} (the exception {e} occurred).", exc_info=True)
@@ -0,0 +1,209 @@
+'''frame_cache.py
+Process-wide caches that let sessions share the work of showing the same page:
+* Prototype scenes: local files (like the start page and the loading and error screens) are parsed once for every screen size
+and the scene is then shared between sessions until a session changes it (see Session.ensure_own_scene()).
+* Shared pages: websites are still fetched by every session, but sessions that get the same content for the same screen size
+share the translated scene (and its frames) in the same way.
+* Encoded frames: the output for drawing a shared scene is rendered and encoded once, so that showing it to a new session
+only costs a copy of the bytes.'''
+import collections, hashlib, logging, os, sys, threading
+sys.path.append(".")
+from const import *
+from frame_output import FrameDiffer, filter_styles
+from metrics import CACHE_HITS, CACHE_MISSES
+from translation_pool import TranslationError, translate
+
+logger = logging.getLogger(__name__)
+
+class LRUCache:
+    '''A thread-safe cache that forgets the least recently used entry when it is full.'''
+    def __init__(self, name, max_entries):
+        '''Initializes a cache.
+
+        :param name: The name of the cache. Used for metrics.
+
+        :param max_entries: Max number of entries in the cache.'''
+        self.name = name
+        self.max_entries = max_entries
+        self.entries = collections.OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        '''Returns the entry for a key, or None if it is not in the cache.'''
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None:
+                self.entries.move_to_end(key)
+        if entry is None:
+            CACHE_MISSES.inc(self.name)
+        else:
+            CACHE_HITS.inc(self.name)
+        return entry
+
+    def put(self, key, entry):
+        '''Adds an entry to the cache.'''
+        with self.lock:
+            self.entries[key] = entry
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+class CachedFrame:
+    '''A rendered frame of a shared scene, with the output needed to draw it on an empty screen.'''
+    def __init__(self, frame:str, cursor_string:str):
+        '''Creates a cached frame.
+
+        :param frame: The frame, as rendered by Scene.render()
+
+        :param cursor_string: The cursor moving characters of the scene.'''
+        self.frame = frame
+        self.cursor_string = cursor_string
+        differ = FrameDiffer(differential=False)
+        self.full_output = differ.diff(frame, cursor_string).encode()
+        self.styled_lines = differ.last_lines #What a FrameDiffer remembers after drawing the frame
+
+class PrototypeScene:
+    '''A scene that is shared between sessions, and what it was loaded from.'''
+    def __init__(self, scene, file_signature, content_hash):
+        self.scene = scene
+        self.file_signature = file_signature #Modification time and size of the file when it was loaded
+        self.content_hash = content_hash
+
+class PendingTranslation:
+    '''A translation of a shared page that other sessions can wait for (see get_shared_scene()).'''
+    def __init__(self):
+        self.done = threading.Event()
+        self.scene = None
+        self.exception = None #The TranslationError, if the translation failed because of one
+
+scene_cache = LRUCache("prototype_scenes", SCENE_CACHE_SIZE)
+page_cache = LRUCache("shared_pages", PAGE_CACHE_SIZE)
+frame_cache = LRUCache("frames", FRAME_CACHE_SIZE)
+pending_translations = {} #Key in page_cache -> PendingTranslation for the shared pages that are being translated
+pending_translations_lock = threading.Lock()
+
+def get_file_signature(path):
+    '''Returns something that changes when a file changes (its modification time and size), without reading it.'''
+    file_stat = os.stat(path)
+    return file_stat.st_mtime_ns, file_stat.st_size
+
+def get_prototype_scene(source_loader, source, width, height, **scene_kwargs):
+    '''Returns a scene of a local file that is shared between sessions. The scene is loaded again if the file has changed.
+    The returned scene must never be changed, since other sessions are showing it.
+
+    :param source_loader: The SourceLoader to load the file with.
+
+    :param source: The path of the file.
+
+    :param width: The width of the screen to load the scene for.
+
+    :param height: The height of the screen to load the scene for.
+
+    :param scene_kwargs: Any extra keyword arguments to pass on to the Scene().
+
+    :returns: The scene, or None if it could not be loaded.'''
+    key = (source, width, height, tuple(sorted(scene_kwargs.items())))
+    try:
+        file_signature = get_file_signature(source)
+    except OSError:
+        file_signature = None
+    prototype = scene_cache.get(key)
+    if prototype is not None and prototype.file_signature == file_signature:
+        return prototype.scene
+    content = source_loader.load_source_content(source)
+    if content is None:
+        return None
+    content_hash = get_content_hash(content)
+    scene = source_loader.translate(content, source, width=width, height=height, **scene_kwargs)
+    if scene is None:
+        return None
+    scene.prototype_key = (source, content_hash, width, height, scene.compact)
+    scene_cache.put(key, PrototypeScene(scene, file_signature, content_hash))
+    logger.debug(f"Loaded prototype scene of {source} for {width}x{height}.")
+    return scene
+
+def get_content_hash(content:str):
+    return hashlib.blake2b(content.encode(errors="replace"), digest_size=16).hexdigest()
+
+def get_shared_scene(source_loader, source, content, width, height, raise_translation_errors=False, **scene_kwargs):
+    '''Returns a scene of content that has been loaded from a source (like a website), shared with other sessions that
+    have loaded the same content for the same screen size. The returned scene must never be changed, since other sessions might be showing it.
+    Sessions that need the same page at the same time (like when a watched page has been refreshed) wait for one translation of it.
+
+    :param source_loader: The SourceLoader to translate the content with.
+
+    :param source: The source that the content was loaded from.
+
+    :param content: The content.
+
+    :param width: The width of the screen to translate the content for.
+
+    :param height: The height of the screen to translate the content for.
+
+    :param raise_translation_errors: If True, a TranslationError (the translation pool is full or the page took too long) is raised
+    instead of returning None (see translation_pool.translate()).
+
+    :param scene_kwargs: Any extra keyword arguments to pass on to the Scene().
+
+    :returns: The scene, or None if the content could not be translated.'''
+    content_hash = get_content_hash(content)
+    key = (source, content_hash, width, height, tuple(sorted(scene_kwargs.items())))
+    scene = page_cache.get(key)
+    if scene is not None:
+        return scene
+    with pending_translations_lock:
+        pending_translation = pending_translations.get(key)
+        leading = pending_translation is None
+        if leading:
+            pending_translation = pending_translations[key] = PendingTranslation()
+    if not leading:
+        pending_translation.done.wait()
+        if pending_translation.exception is not None and raise_translation_errors:
+            raise pending_translation.exception
+        return pending_translation.scene
+    try:
+        try:
+            scene = translate(source_loader, content, source, raise_translation_errors=True, width=width, height=height, **scene_kwargs) #In the translation pool
+        except TranslationError as e:
+            pending_translation.exception = e
+            if raise_translation_errors:
+                raise
+            logger.warning(f"Failed translating {source} (the error {e} occurred).")
+            return None
+        if scene is None:
+            return None
+        scene.prototype_key = (source, content_hash, width, height, scene.compact)
+        #The scene has been rendered when it was translated, so the first frame does not have to be rendered again
+        frame_cache.put(get_frame_key(scene, RENDER_PROFILE_COLOR), CachedFrame(scene.current_row_string, scene.cursor_string))
+        page_cache.put(key, scene)
+        pending_translation.scene = scene
+        return scene
+    finally:
+        with pending_translations_lock:
+            del pending_translations[key]
+        pending_translation.done.set()
+
+def get_scene_hash(scene):
+    '''Returns a hash of what a scene shows (the text and styles of all of its rows).'''
+    return get_content_hash("\n".join(str(row) for row in scene.rows))
+
+def get_frame_key(scene, render_profile):
+    '''Returns the key of the current frame of a shared scene in the frame cache.'''
+    return scene.prototype_key + (scene.current_scroll_position, scene.active_interactive_element_index, render_profile)
+
+def get_cached_frame(scene, render_profile=RENDER_PROFILE_COLOR):
+    '''Returns the rendered frame of a shared scene (see get_prototype_scene()), rendering it if it has not been rendered before.
+
+    :param scene: The scene.
+
+    :param render_profile: The render profile to render the frame for (see render_profiles.py)'''
+    key = get_frame_key(scene, render_profile)
+    cached_frame = frame_cache.get(key)
+    if cached_frame is None:
+        if render_profile != RENDER_PROFILE_COLOR: #The scene is only rendered once for all profiles
+            frame = filter_styles(get_cached_frame(scene).frame, render_profile)
+        else:
+            frame, _ = scene.render_frame() #Does not change the scene, since other sessions might be rendering it at the same time
+        cached_frame = CachedFrame(frame, scene.cursor_string)
+        frame_cache.put(key, cached_frame)
+    return cached_frame
@@ -0,0 +1,315 @@
+'''frame_output.py
+Creates the output that is written to a client for every frame.
+Instead of clearing the screen and redrawing everything for every keystroke, only the lines that
+have changed since the last frame that was sent are redrawn, using cursor addressing.
+Every frame is collected in one reusable buffer per session and is then sent with a single call.
+For clients that support MCCP2, the output is compressed with one zlib stream that is kept for the whole session.
+Terminal styles that the render profile of a client does not use (see render_profiles.py) are removed before the output is created.'''
+import re, sys, zlib
+sys.path.append(".")
+from const import CLEAR_SCREEN, NAVIGATE, TERMINAL_COLORS, FRAME_BUFFER_SIZE, RENDER_PROFILE_COLOR, RENDER_PROFILE_MONOCHROME
+from metrics import RENDER_SECONDS, FRAME_BYTES, SENT_BYTES
+
+ERASE_TO_END_OF_LINE = "\x1b[K"
+ERASE_BELOW = "\x1b[J"
+SAVE_CURSOR = "\x1b7"
+RESTORE_CURSOR = "\x1b8"
+REVERSE_VIDEO = "\x1b[7m"
+SGR_REGEX = re.compile("\x1b\\[[0-9;]*m") #Matches color and font weight codes
+SGR_RESET_CODES = [TERMINAL_COLORS.RESET, "\x1b[m"]
+SGR_EXTENDED_COLOR_PARAMETERS = ["38", "48"] #Followed by "5;<color>" or "2;<red>;<green>;<blue>"
+
+def is_color_parameter(parameter:str):
+    '''Returns True if an SGR parameter sets the text or background color.'''
+    return parameter.isdigit() and (30 <= int(parameter) <= 49 or 90 <= int(parameter) <= 107)
+
+def remove_colors(style_code_match):
+    '''Returns a style code (matched by SGR_REGEX) without the parameters that set colors. Resets and font weights are kept.'''
+    style_code = style_code_match.group()
+    if style_code in SGR_RESET_CODES:
+        return style_code
+    parameters = style_code[2:-1].split(";")
+    kept_parameters = []
+    i = 0
+    while i < len(parameters):
+        parameter = parameters[i]
+        if parameter in SGR_EXTENDED_COLOR_PARAMETERS:
+            i += 3 if parameters[i+1:i+2] == ["5"] else 5
+            continue
+        if not is_color_parameter(parameter):
+            kept_parameters.append(parameter)
+        i += 1
+    return f"\x1b[{';'.join(kept_parameters)}m" if len(kept_parameters) > 0 else ""
+
+def filter_styles(frame:str, render_profile:str):
+    '''Removes the terminal styles that a render profile does not use from a rendered frame.
+
+    :param frame: The frame, as rendered by Scene.render()
+
+    :param render_profile: The render profile (see render_profiles.py)'''
+    if render_profile == RENDER_PROFILE_COLOR:
+        return frame
+    elif render_profile == RENDER_PROFILE_MONOCHROME:
+        return SGR_REGEX.sub(remove_colors, frame)
+    return SGR_REGEX.sub("", frame)
+
+def get_line_styles(lines):
+    '''Terminal styles (colors, font weights etc.) are not reset between lines. When a line is redrawn
+    on its own, the styles that were active at the start of it have to be added again.
+
+    :param lines: Lines of a frame.
+
+    :returns: A list of the style codes that are active at the start of every line, plus the
+    style codes that are active after the last line.'''
+    line_styles = []
+    active_style = ""
+    for line in lines:
+        line_styles.append(active_style)
+        for style_code in SGR_REGEX.findall(line):
+            if style_code in SGR_RESET_CODES:
+                active_style = ""
+            else:
+                active_style += style_code
+    line_styles.append(active_style)
+    return line_styles
+
+class FrameDiffer:
+    '''Keeps the last frame that was sent to a client and creates the output needed to get
+    from that frame to a new frame.'''
+    def __init__(self, differential=True):
+        '''Initializes a frame differ.
+
+        :param differential: If True, only changed lines are redrawn. If False, the whole screen is redrawn for every frame.'''
+        self.differential = differential
+        self.uses_styles = True #False if frames never have terminal styles in them, so that redrawn lines do not have to reset them
+        self.last_lines = None #The lines of the last frame, including the styles that were active at the start of every line
+
+    @property
+    def needs_full_redraw(self):
+        '''True if the next frame redraws the whole screen.'''
+        return not self.differential or self.last_lines is None
+
+    def reset(self):
+        '''Forgets the last frame, so that the next frame redraws the whole screen.
+        Should be called if the client's screen might have changed in some other way, for example when it is resized.'''
+        self.last_lines = None
+
+    def invalidate_line(self, line_index):
+        '''Makes the next frame redraw a line, for example because something else has been drawn over it.'''
+        if self.last_lines is None:
+            return
+        self.last_lines = list(self.last_lines) #The lines might be shared with a cached frame
+        if line_index >= len(self.last_lines): #Also erase the line if the next frame is shorter
+            self.last_lines.extend([None] * (line_index + 1 - len(self.last_lines)))
+        self.last_lines[line_index] = None
+
+    def diff(self, frame:str, cursor_string:str=""):
+        '''Creates the output to draw a new frame.
+
+        :param frame: The new frame, as rendered by Scene.render()
+
+        :param cursor_string: Any cursor moving characters that should be sent after the frame.
+        If the frame ends with these, they are removed from it before comparing.
+
+        :returns: The output to send to the client as a string.'''
+        if len(cursor_string) > 0 and frame.endswith(cursor_string):
+            frame = frame[:-len(cursor_string)]
+        lines = frame.split("\n")
+        line_styles = get_line_styles(lines)
+        styled_lines = [line_styles[i] + line for i, line in enumerate(lines)]
+        if not self.differential or self.last_lines is None:
+            output = CLEAR_SCREEN + "\r\n".join(lines)
+        else:
+            output = ""
+            reset = TERMINAL_COLORS.RESET if self.uses_styles else ""
+            for line_index, styled_line in enumerate(styled_lines):
+                if line_index < len(self.last_lines) and self.last_lines[line_index] == styled_line:
+                    continue
+                line = lines[line_index]
+                if line_styles[line_index+1] == "": #Trailing whitespace can be erased instead of sent if no style is active after the line
+                    line = line.rstrip(" ")
+                output += NAVIGATE.TO_COORDINATE.format(line_index+1, 1) + reset + line_styles[line_index] + line + reset + ERASE_TO_END_OF_LINE
+            if len(self.last_lines) > len(lines): #Remove lines that are not in the new frame
+                output += NAVIGATE.TO_COORDINATE.format(len(lines)+1, 1) + ERASE_BELOW
+        self.last_lines = styled_lines
+        return output + cursor_string
+
+class FrameBuffer:
+    '''A preallocated buffer that the output for a frame is collected in before it is sent.
+    The buffer is reused between frames and only grows when a frame is bigger than the buffer.'''
+    def __init__(self, size=FRAME_BUFFER_SIZE):
+        '''Initializes a frame buffer.
+
+        :param size: The initial size of the buffer in bytes.'''
+        self.buffer = bytearray(size)
+        self.length = 0 #How much of the buffer that is used
+
+    def write(self, data:bytes):
+        '''Adds data to the end of the buffer.'''
+        end = self.length + len(data)
+        if end > len(self.buffer): #Grow the buffer to at least double its size
+            self.buffer.extend(bytes(max(end - len(self.buffer), len(self.buffer))))
+        self.buffer[self.length:end] = data
+        self.length = end
+
+    def view(self):
+        '''Returns a memoryview of the used part of the buffer. The view has to be released before the buffer is written to again.'''
+        return memoryview(self.buffer)[:self.length]
+
+    def clear(self):
+        '''Empties the buffer without freeing its memory.'''
+        self.length = 0
+
+    def consume(self, size):
+        '''Removes data from the start of the buffer, for example after it has been sent.
+
+        :param size: Number of bytes to remove.'''
+        remaining = self.length - size
+        self.buffer[:remaining] = self.buffer[size:self.length]
+        self.length = remaining
+
+class FrameWriter:
+    '''Renders frames into a FrameBuffer and sends them to a client.'''
+    def __init__(self, differ:FrameDiffer):
+        '''Initializes a frame writer.
+
+        :param differ: The frame differ that is used to create the output for every frame.'''
+        self.differ = differ
+        self.render_profile = RENDER_PROFILE_COLOR #Which terminal styles frames are sent with (see render_profiles.py)
+        self.buffer = FrameBuffer()
+        self.compressor = None #The zlib stream that output is compressed with, if the client has accepted compression
+        self.needs_flush = False #True if data has been compressed since the last flush
+        self.sent_bytes = 0 #Total number of bytes sent (after compression)
+
+    @property
+    def compressing(self):
+        '''True if output is compressed before it is sent.'''
+        return self.compressor is not None
+
+    def start_compression(self, level):
+        '''Compresses everything that is written from now on. The client has to be told about this
+        (see OPTION_MCCP2 in telnet.py) right before.
+
+        :param level: The zlib compression level (1-9).'''
+        self.compressor = zlib.compressobj(level)
+
+    def stop_compression(self):
+        '''Ends the compressed stream. Everything that is written after this is sent uncompressed.'''
+        if self.compressor is not None:
+            self.buffer.write(self.compressor.flush(zlib.Z_FINISH))
+            self.compressor = None
+
+    def set_render_profile(self, render_profile):
+        '''Changes which terminal styles frames are sent with. The next frame redraws the whole screen.
+
+        :param render_profile: The render profile (see render_profiles.py)'''
+        self.render_profile = render_profile
+        self.differ.uses_styles = render_profile in [RENDER_PROFILE_COLOR, RENDER_PROFILE_MONOCHROME]
+        self.differ.reset()
+
+    def write(self, data:bytes):
+        '''Adds raw data (like Telnet negotiation) to be sent before the next frame.'''
+        if len(data) == 0:
+            return
+        if self.compressor is not None:
+            data = self.compressor.compress(data)
+            self.needs_flush = True
+        self.buffer.write(data)
+
+    def write_frame(self, scene):
+        '''Renders a scene once and adds the output needed to draw it.
+        Scenes that are shared between sessions are only rendered once for all sessions (see frame_cache.py).
+
+        :param scene: The scene to draw.
+
+        :returns: The output written for the frame (before compression).'''
+        if scene.prototype_key is not None:
+            from frame_cache import get_cached_frame #Imported here since frame_cache.py imports this module
+            cached_frame = get_cached_frame(scene, self.render_profile)
+            if self.differ.needs_full_redraw: #Copy the encoded frame as it is
+                self.differ.last_lines = cached_frame.styled_lines
+                data = cached_frame.full_output
+            else:
+                data = self.differ.diff(cached_frame.frame, cached_frame.cursor_string).encode()
+        else:
+            with RENDER_SECONDS.time():
+                frame = filter_styles(scene.render(), self.render_profile)
+            data = self.differ.diff(frame, scene.cursor_string).encode()
+        FRAME_BYTES.observe(len(data))
+        self.write(data)
+        return data
+
+    def write_status_line(self, text, row):
+        '''Draws a line of text over the current frame without rendering it again, for example to animate a loading indicator.
+        The line is redrawn with the next frame.
+
+        :param text: The text to draw. It has to fit on one line.
+
+        :param row: The row (starting at 1) to draw the text on.'''
+        self.write((NAVIGATE.TO_COORDINATE.format(row, 1) + TERMINAL_COLORS.RESET + text + ERASE_TO_END_OF_LINE).encode())
+        self.differ.invalidate_line(row - 1)
+
+    def write_overlay(self, lines, screen_width):
+        '''Draws lines in a box in the top right corner, over the current frame (and next to the scrollbar).
+        The cursor is put back where it was. The lines under the box are redrawn with the next frame.
+
+        :param lines: The lines to draw.
+
+        :param screen_width: The width of the client's screen.'''
+        box_width = min(max(len(line) for line in lines) + 2, screen_width - 1)
+        column = max(screen_width - box_width, 1)
+        output = SAVE_CURSOR
+        for line_index, line in enumerate(lines):
+            output += NAVIGATE.TO_COORDINATE.format(line_index + 1, column) + REVERSE_VIDEO + (" " + line).ljust(box_width)[:box_width] + TERMINAL_COLORS.RESET
+            self.differ.invalidate_line(line_index)
+        self.write((output + RESTORE_CURSOR).encode())
+
+    def flush(self):
+        '''Makes sure that everything that has been written can be decompressed by the client
+        without waiting for more data. Does nothing if output is not compressed.'''
+        if self.compressor is not None and self.needs_flush: #Flushing without new data would still send an empty block
+            self.buffer.write(self.compressor.flush(zlib.Z_SYNC_FLUSH))
+            self.needs_flush = False
+
+    def send(self, client_socket):
+        '''Sends everything that has been written to a socket with a single call and empties the buffer.
+
+        :returns: The number of bytes that were sent.'''
+        self.flush()
+        with self.buffer.view() as view:
+            client_socket.sendall(view)
+            sent_bytes = len(view)
+        self.buffer.clear()
+        SENT_BYTES.inc(amount=sent_bytes)
+        self.sent_bytes += sent_bytes
+        return sent_bytes
+
+    def get_pending_bytes(self):
+        '''Returns the number of bytes that have been written but not sent yet (after compressing anything that is left to compress).'''
+        self.flush()
+        return self.buffer.length
+
+    def send_available(self, client_socket):
+        '''Sends as much of what has been written as the socket takes with one call, and keeps the rest to send later.
+        Should only be called when the socket is writable, so that it does not block.
+
+        :returns: The number of bytes that were sent.'''
+        self.flush()
+        if self.buffer.length == 0:
+            return 0
+        with self.buffer.view() as view:
+            sent_bytes = client_socket.send(view)
+        self.buffer.consume(sent_bytes)
+        SENT_BYTES.inc(amount=sent_bytes)
+        self.sent_bytes += sent_bytes
+        return sent_bytes
+
+    def pop(self):
+        '''Returns everything that has been written as bytes and empties the buffer.
+        Used when the data is not sent right away, like with asyncio transports which might keep the data until the client can receive it.'''
+        self.flush()
+        data = bytes(self.buffer.view())
+        self.buffer.clear()
+        SENT_BYTES.inc(amount=len(data))
+        self.sent_bytes += len(data)
+        return data
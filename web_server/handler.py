@@ -1,91 +1,192 @@
-import socketserver, logging, socket, sys
-
-import chardet
-
-from content_renderer.from_html.format_translator import Translator
-from charset_normalizer import from_bytes
+import socketserver, logging, socket, sys, time, select
 sys.path.append(".")
 from const import *
-from content_renderer.from_html.sourceloader import SourceLoader
+from session import Session, SlowClientError
+from admission import configure_keepalive, configure_send_buffer
 
 
 class RequestHandler(socketserver.StreamRequestHandler):
     '''Handles a request that has been received by a client'''
     logger = logging.getLogger(__name__)
-    translator = Translator()
-    source_loader = SourceLoader(
-        load_from_files=True,
-        load_from_urls=True,
-        trusted_directories=[HTML_CONTENT_DIRECTORY, WEBSITE_INDEX_HANDLER_DIRECTORY], #Only trust paths that are in the working directory
-        trusted_urls=[] #Trust all
-    )
-
-    #Open a scene for reading
-    START_FILE = os.path.join(WEBSITE_INDEX_HANDLER_DIRECTORY, "website_index_out.html")
-    ERROR_INFO_FILE = os.path.join(HTML_CONTENT_DIRECTORY, "error_occurred.html") #File to print from in case of an error
-    LOADING_FILE = os.path.join(HTML_CONTENT_DIRECTORY, "loading.html") #File to print from when content is loading
-    ROOT_ERROR_FILE = os.path.join(HTML_CONTENT_DIRECTORY, "root_error.html") #File to print from in case of an internal error
-    #Load some scenes that are used when the server is processing stuff or have other things to tell the user
-    loading_screen_scene = source_loader.load_source_into_scene(LOADING_FILE)
-    error_screen_scene = source_loader.load_source_into_scene(ERROR_INFO_FILE)
-    root_error_scene = source_loader.load_source_into_scene(ROOT_ERROR_FILE)
+
+    def setup(self):
+        super().setup()
+        #Every frame is sent with one call, so it should be sent right away instead of waiting for more data
+        self.request.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        configure_keepalive(self.request)
+        configure_send_buffer(self.request)
+
+    def wait_for_negotiation(self, session:Session):
+        '''Waits (at most NEGOTIATION_TIMEOUT seconds) for the client to answer Telnet negotiation,
+        so that the first frame can be drawn with the right size.'''
+        deadline = time.monotonic() + NEGOTIATION_TIMEOUT
+        try:
+            while session.negotiating and time.monotonic() < deadline:
+                self.request.settimeout(deadline - time.monotonic())
+                data = self.request.recv(READ_SIZE)
+                if data == b"":
+                    break
+                session.receive(data)
+                session.write_telnet_data()
+                session.frame_writer.send(self.request)
+        except socket.timeout:
+            RequestHandler.logger.info("Client did not finish Telnet negotiation in time.")
+        finally:
+            self.request.settimeout(session.get_timeout())
+
+    def poll(self, timeout, wait_for_writable=False):
+        '''Waits until the client has sent something, the session is woken up or (if wait_for_writable) the client socket can take more output.
+
+        :param timeout: Max number of seconds to wait, or None to wait forever.
+
+        :returns: A tuple: (file descriptors that are readable, True if the client socket is writable)'''
+        if hasattr(select, "poll"): #Not limited to file descriptors below 1024 like select()
+            self.poller.modify(self.request, select.POLLIN | (select.POLLOUT if wait_for_writable else 0))
+            events = self.poller.poll(None if timeout is None else timeout * 1000)
+            readable = [file_descriptor for file_descriptor, event in events if event & ~select.POLLOUT]
+            writable = any(event & select.POLLOUT for _, event in events)
+        else:
+            readable_sockets, writable_sockets, _ = select.select([self.request, self.wake_reader], [self.request] if wait_for_writable else [], [], timeout)
+            readable = [ready_socket.fileno() for ready_socket in readable_sockets]
+            writable = len(writable_sockets) > 0
+        return readable, writable
+
+    def wait_for_input(self, timeout, session:Session):
+        '''Waits until the client has sent something or the session is woken up (for example by the refresher or a finished load).
+        Output that the client could not receive right away is sent while waiting, as the client catches up.
+
+        :param timeout: Max number of seconds to wait, or None to wait forever.
+
+        :returns: The received data, or None if the session was woken up, the timeout passed or a frame that was deferred
+        (see Session.defer_frame()) can be drawn now.'''
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            sending = session.frame_writer.get_pending_bytes() > 0
+            readable, writable = self.poll(None if deadline is None else max(deadline - time.monotonic(), 0), sending)
+            if writable:
+                self.send_output(session)
+                if session.frame_deferred and session.frame_writer.get_pending_bytes() == 0:
+                    return None
+                if len(readable) == 0:
+                    continue
+            if len(readable) == 0:
+                return None
+            if self.wake_reader.fileno() in readable:
+                self.wake_reader.recv(READ_SIZE) #Empty the wakeup socket
+                return None
+            return self.request.recv(INPUT_BURST_SIZE)
+
+    def is_writable(self):
+        '''Returns True if the client socket can take more output right now.'''
+        if hasattr(select, "poll"):
+            return len(self.write_poller.poll(0)) > 0
+        return len(select.select([], [self.request], [], 0)[1]) > 0
+
+    def send_output(self, session:Session):
+        '''Sends as much of the session's output as the client can receive right now, without blocking.
+        The rest is sent by wait_for_input() as the client catches up.'''
+        while session.frame_writer.get_pending_bytes() > 0 and self.is_writable():
+            if session.frame_writer.send_available(self.request) == 0:
+                break
+        session.check_pending_output(session.frame_writer.get_pending_bytes())
+
+    def draw_frame(self, session:Session, scene=None):
+        '''Draws a frame of a scene and sends it, unless the client has not received the last frame yet (see Session.defer_frame()).
+
+        :param scene: The scene to draw. If None, the current scene of the session is drawn.'''
+        if session.frame_writer.get_pending_bytes() > 0:
+            session.defer_frame()
+        else:
+            session.write_frame(scene)
+        self.send_output(session)
+
+    def wake(self):
+        '''Wakes up the thread of the session if it is waiting for input. Can be called from any thread.'''
+        try:
+            self.wake_writer.send(b"\0")
+        except OSError: #The session has ended or has already been woken up enough
+            pass
 
     def handle(self):
         RequestHandler.logger.info("Received a request from a client!")
+        session = Session(self.client_address)
+        #A socket pair that other threads can write to, to wake up the session while it is waiting for input
+        self.wake_reader, self.wake_writer = socket.socketpair()
+        self.wake_writer.setblocking(False)
+        if hasattr(select, "poll"):
+            self.poller = select.poll()
+            self.poller.register(self.request, select.POLLIN)
+            self.poller.register(self.wake_reader, select.POLLIN)
+            self.write_poller = select.poll()
+            self.write_poller.register(self.request, select.POLLOUT)
+        session.wake = self.wake
+        try:
+            self.run_session(session)
+        finally:
+            session.close()
+            self.wake_reader.close()
+            self.wake_writer.close()
+
+    def run_load(self, session:Session):
+        '''Shows the loading screen while the session loads a page in the background. Input is still read while loading,
+        so that the user can cancel the load.'''
+        self.draw_frame(session, session.get_loading_scene())
+        session.start_load()
+        while session.load_in_progress and not session.closed:
+            timeout = LOADING_ANIMATION_INTERVAL if LOADING_ANIMATION_INTERVAL > 0 else LOAD_TIMEOUT or None
+            data = self.wait_for_input(session.get_wait_timeout(timeout), session)
+            if data == b"": #Connection was closed by the client
+                session.closed = True
+                break
+            if data is not None:
+                session.receive_while_loading(data)
+            else:
+                session.handle_held_keys()
+            session.update_load()
+            if session.load_in_progress and session.frame_deferred:
+                self.draw_frame(session, session.get_loading_scene())
+            elif session.load_in_progress and LOADING_ANIMATION_INTERVAL > 0 and session.frame_writer.get_pending_bytes() == 0:
+                session.write_loading_status()
+                self.send_output(session)
+
+    def run_session(self, session:Session):
+        '''Runs a session until the client disconnects.'''
+        session.start()
+        session.write_telnet_data()
+        session.frame_writer.send(self.request)
+        self.wait_for_negotiation(session)
         #Load the start file
-        self.scene = RequestHandler.source_loader.load_source_into_scene(RequestHandler.START_FILE)
-        if self.scene == None:
-            RequestHandler.logger.critical("Failed to load start file! An error will be returned.")
-            self.scene = RequestHandler.root_error_scene
-            self.current_loaded_source = RequestHandler.ROOT_ERROR_FILE
-        else:
-            self.current_loaded_source = RequestHandler.START_FILE
+        session.load_start_scene()
 
         #Wait for client input
-        while True: #Run until further notice
+        while not session.closed: #Run until further notice
             try:
-                self.logger.info("Clearing screen...")
-                self.wfile.write(CLEAR_SCREEN.encode()) #Clear the screen
-                if self.current_loaded_source != self.scene.source or self.scene.force_reload:
-                    self.logger.info("Updating scene to new source.")
-                    #Show loading screen
-                    self.wfile.writelines(RequestHandler.loading_screen_scene.get_terminal_lines())
-                    try:
-                        self.logger.info(f"Loading source from {self.scene.source}")
-                        self.scene = RequestHandler.source_loader.load_source_into_scene(self.scene.source)
-                        if self.scene == None:
-                            raise Exception("Scene failed to be loaded.")
-                        self.current_loaded_source = self.scene.source
-                        self.logger.info("New scene loaded.")
-                    except Exception as e:
-                        self.logger.warning(f"Failed to load new file (the error {e} occurred). Displaying error...", exc_info=True)
-                        self.scene = RequestHandler.error_screen_scene
-                        self.current_loaded_source = RequestHandler.ERROR_INFO_FILE
+                if session.is_loading():
+                    self.run_load(session)
                     continue
-                image = self.scene.get_terminal_lines()
-                self.logger.debug(f"New image: {image}")
-                self.logger.info("Redrawing image...")
-                self.wfile.writelines(self.scene.get_terminal_lines())
-                #Wait for client input or image change
-                encoded_data = self.rfile.readline().strip()
-                data_encoding = chardet.detect(encoded_data)["encoding"]
-                received_data = encoded_data.decode(data_encoding) if data_encoding != None else encoded_data.decode()
-                RequestHandler.logger.info(f"Received data: {received_data} (length {len(received_data)}, encoding: {data_encoding}) (unencoded: {encoded_data}).")
-                if received_data == "":  # Translate to enter key
-                    RequestHandler.logger.info("Translated empty data to enter key.")
-                    encoded_data = KEY_ENTER
-                if KEY_COMBINATION_CTRL_C in received_data: #Change source on Ctrl+C
-                    RequestHandler.logger.info("Found Ctrl+C. Resetting scene...")
-                    self.scene.source = RequestHandler.START_FILE #Reset source to the original landing page.
+                if session.needs_blocking_work():
+                    session.do_blocking_work()
                     continue
-                if KEY_ESCAPE == received_data or KEY_COMBINATION_CTRL_Q in received_data: #Close connection on escape or Ctrl + Q
-                    RequestHandler.logger.info("Received escape key. Closing connection....")
+                self.logger.info("Redrawing image...")
+                self.draw_frame(session)
+                #Wait for client input or image change. The socket times out when the session does
+                self.request.settimeout(session.get_timeout())
+                data = self.wait_for_input(session.get_wait_timeout(session.get_timeout()), session)
+                if data is None:
+                    if session.get_timeout_reason() is not None:
+                        raise socket.timeout()
+                    session.handle_held_keys()
+                    continue #Woken up because there is something new to draw (or a held back escape key has been handled)
+                if data == b"": #Connection was closed by the client
+                    RequestHandler.logger.info("Client disconnected.")
                     break
-                if len(encoded_data.split()) != 0: #Split encoded data if we can
-                   encoded_data = encoded_data.split()
-                for received_key in encoded_data:
-                    #Update image according to client input
-                    self.scene.update(received_key, encoding=data_encoding)
+                session.receive(data)
+            except socket.timeout:
+                RequestHandler.logger.info(f"Closing session. {session.get_timeout_reason() or 'Sending to the client timed out.'}")
+                break
+            except SlowClientError as e:
+                RequestHandler.logger.info(f"Closing session. {e}")
+                break
             except socket.error:
                 RequestHandler.logger.info("Client disconnected.")
                 break
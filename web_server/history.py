@@ -0,0 +1,116 @@
+'''history.py
+The back/forward history of a session. Clients press Ctrl+B to go back to the page that they were on before and Ctrl+F to
+go forward again. Recent pages are kept as scenes (with what the user has done in them, like the scroll position and typed text),
+so that going back and forward is instant and does not fetch or translate anything. To bound the memory that this takes,
+the scenes of the least recently visited pages are forgotten when the history grows too large. Going back to such a page
+loads it again, and only the scroll position is restored.'''
+import itertools, logging, sys
+sys.path.append(".")
+from const import *
+
+logger = logging.getLogger(__name__)
+
+def estimate_scene_size(scene):
+    '''Returns a rough estimate of the memory (in bytes) that a scene takes up, based on how many lines of content it has.'''
+    return scene.total_content_height * SCENE_BYTES_PER_LINE
+
+class HistoryEntry:
+    '''A page in the history.'''
+    __slots__ = ("source", "scene", "scroll_position", "last_visit")
+    def __init__(self, source, scene, last_visit):
+        '''Creates a history entry.
+
+        :param source: The source of the page.
+
+        :param scene: The scene that the page was shown with.
+
+        :param last_visit: When the page was last visited (see History.visit_counter).'''
+        self.source = source
+        self.scene = scene
+        self.scroll_position = scene.current_scroll_position
+        self.last_visit = last_visit
+
+    @property
+    def size(self):
+        '''The estimated memory that the scene of the entry takes up, or 0 if it has been forgotten.'''
+        return estimate_scene_size(self.scene) if self.scene is not None else 0
+
+class History:
+    '''The pages that a session can go back and forward to.'''
+    def __init__(self, max_entries=HISTORY_SIZE, max_size=HISTORY_MEMORY*1024):
+        '''Initializes an empty history.
+
+        :param max_entries: Max number of pages to remember, back and forward together.
+
+        :param max_size: Max estimated memory (in bytes) of the scenes to keep. The scenes of the least recently visited pages are forgotten above this.'''
+        self.max_entries = max_entries
+        self.max_size = max_size
+        self.back_entries = [] #The page that was visited last is at the end
+        self.forward_entries = [] #The page that is next when going forward is at the end
+        self.visit_counter = itertools.count()
+
+    def create_entry(self, source, scene):
+        return HistoryEntry(source, scene, next(self.visit_counter))
+
+    def add(self, source, scene, keep_scene=True):
+        '''Remembers the page that the session is leaving for a new page. The pages that could be gone forward to are forgotten.
+
+        :param source: The source of the page that is left.
+
+        :param scene: The scene of the page that is left.
+
+        :param keep_scene: If False, only the source and the scroll position are remembered, and the page is loaded again when it is gone back to.'''
+        entry = self.create_entry(source, scene)
+        if not keep_scene:
+            entry.scene = None
+        self.back_entries.append(entry)
+        self.forward_entries.clear()
+        self.trim()
+
+    def go_back(self, source, scene):
+        '''Goes back to the previous page.
+
+        :param source: The source of the current page. If None, the current page is not remembered (for example if it is an error page).
+
+        :param scene: The scene of the current page.
+
+        :returns: The entry of the previous page, or None if there is none.'''
+        return self.move(self.back_entries, self.forward_entries, source, scene)
+
+    def go_forward(self, source, scene):
+        '''Goes forward to the page that was gone back from (see go_back()).
+
+        :returns: The entry of the next page, or None if there is none.'''
+        return self.move(self.forward_entries, self.back_entries, source, scene)
+
+    def move(self, from_entries, to_entries, source, scene):
+        '''Takes the last entry of one list and puts the current page at the end of the other.'''
+        if len(from_entries) == 0:
+            return None
+        entry = from_entries.pop()
+        if source is not None:
+            to_entries.append(self.create_entry(source, scene))
+        entry.last_visit = next(self.visit_counter)
+        self.trim()
+        return entry
+
+    def trim(self):
+        '''Forgets the pages that are furthest away when there are too many of them, and then the scenes of the least recently
+        visited pages until the scenes take up less than max_size.'''
+        while len(self.back_entries) + len(self.forward_entries) > self.max_entries:
+            if len(self.back_entries) >= len(self.forward_entries):
+                self.back_entries.pop(0)
+            else:
+                self.forward_entries.pop(0)
+        entries = self.back_entries + self.forward_entries
+        total_size = sum(entry.size for entry in entries)
+        if total_size <= self.max_size:
+            return
+        for entry in sorted(entries, key=lambda entry: entry.last_visit):
+            if entry.scene is None:
+                continue
+            total_size -= entry.size
+            logger.debug(f"Forgetting the scene of {entry.source} to save memory.")
+            entry.scene = None
+            if total_size <= self.max_size:
+                return
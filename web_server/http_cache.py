@@ -0,0 +1,294 @@
+'''http_cache.py
+A cache of website responses that is shared by all sessions, so that many clients on the same page do not all fetch it again.
+Responses are kept as they were received (before they are decoded) and are cached as the website says in its headers:
+* Cache-Control s-maxage or max-age (or Expires) say for how long a response is fresh. Fresh responses are used without any request.
+* A response that is not fresh anymore is revalidated with a conditional GET (If-None-Match/If-Modified-Since) if it has an ETag
+or Last-Modified header. If the website answers 304 Not Modified, the cached response is used and is fresh again.
+* With Cache-Control stale-while-revalidate, a response that has just expired is used right away and revalidated in the background.
+* Responses with no-store, private or Vary: * are not cached, and ones with no-cache are revalidated every time they are used.
+The cache is bounded by the size of the responses in it. The least recently used responses are forgotten first.
+Sessions that need the same URL from a website at the same time (like when a page that many clients watch is refreshed) share one request.'''
+import collections, email.utils, logging, sys, threading, time
+sys.path.append(".")
+from const import *
+from metrics import HTTP_CACHE_BYTES, HTTP_CACHE_LOOKUPS, HTTP_COALESCED_FETCHES
+
+logger = logging.getLogger(__name__)
+
+def parse_cache_control(header:str):
+    '''Parses a Cache-Control header.
+
+    :returns: A dictionary of the directives (in lower case) and their values (None for directives without a value).'''
+    directives = {}
+    for directive in (header or "").split(","):
+        name, _, value = directive.partition("=")
+        name = name.strip().lower()
+        if name != "":
+            directives[name] = value.strip().strip("\"") if value != "" else None
+    return directives
+
+def parse_seconds(value):
+    '''Parses the number of seconds in a header or directive, or returns None if it is not a valid number.'''
+    try:
+        return max(int(value), 0)
+    except (TypeError, ValueError):
+        return None
+
+def parse_http_date(value):
+    '''Parses a date in a header (like Expires), or returns None if it is not a valid date.'''
+    try:
+        return email.utils.parsedate_to_datetime(value).timestamp()
+    except (TypeError, ValueError, IndexError):
+        return None
+
+def get_freshness_lifetime(headers, directives):
+    '''Returns for how many seconds a response is fresh after it has been received, as said by its headers.
+
+    :param headers: The headers of the response.
+
+    :param directives: The parsed Cache-Control header of the response.'''
+    if "no-cache" in directives:
+        return 0
+    lifetime = parse_seconds(directives.get("s-maxage")) #For shared caches, like this one
+    if lifetime is None:
+        lifetime = parse_seconds(directives.get("max-age"))
+    if lifetime is None and "Expires" in headers:
+        expires = parse_http_date(headers["Expires"]) #An invalid date means that the response has already expired
+        date = parse_http_date(headers.get("Date")) or time.time()
+        lifetime = max(expires - date, 0) if expires is not None else 0
+    age = parse_seconds(headers.get("Age")) or 0 #How long the response had already been in other caches
+    return max((lifetime or 0) - age, 0)
+
+class CachedResponse:
+    '''A response from a website, as it is kept in the cache.'''
+    __slots__ = ("status_code", "content", "content_type", "etag", "last_modified", "freshness_lifetime", "stale_lifetime", "stored_at")
+    def __init__(self, status_code, content:bytes, content_type, etag=None, last_modified=None, freshness_lifetime=0, stale_lifetime=0):
+        '''Creates a cached response.
+
+        :param status_code: The HTTP status code of the response.
+
+        :param content: The body of the response.
+
+        :param content_type: The Content-Type header of the response, if any.
+
+        :param etag: The ETag header of the response, if any.
+
+        :param last_modified: The Last-Modified header of the response, if any.
+
+        :param freshness_lifetime: For how many seconds the response is fresh (see get_freshness_lifetime()).
+
+        :param stale_lifetime: For how many seconds after it has expired the response can be used while it is revalidated (stale-while-revalidate).'''
+        self.status_code = status_code
+        self.content = content
+        self.content_type = content_type
+        self.etag = etag
+        self.last_modified = last_modified
+        self.freshness_lifetime = freshness_lifetime
+        self.stale_lifetime = stale_lifetime
+        self.stored_at = time.monotonic()
+
+    @staticmethod
+    def from_response(response):
+        '''Creates a cached response from a response of the requests library.'''
+        headers = response.headers
+        directives = parse_cache_control(headers.get("Cache-Control"))
+        stale_lifetime = 0
+        if "must-revalidate" not in directives and "proxy-revalidate" not in directives:
+            stale_lifetime = parse_seconds(directives.get("stale-while-revalidate")) or 0
+        return CachedResponse(response.status_code, response.content, headers.get("Content-Type"), headers.get("ETag"),
+                              headers.get("Last-Modified"), get_freshness_lifetime(headers, directives), stale_lifetime)
+
+    @staticmethod
+    def is_storable(response):
+        '''Returns True if a response of the requests library may be kept in a cache that is shared between users.'''
+        directives = parse_cache_control(response.headers.get("Cache-Control"))
+        return response.status_code == 200 and "no-store" not in directives and "private" not in directives \
+            and response.headers.get("Vary", "").strip() != "*"
+
+    @property
+    def size(self):
+        return len(self.content)
+
+    @property
+    def has_validators(self):
+        '''True if the response can be revalidated with a conditional GET.'''
+        return self.etag is not None or self.last_modified is not None
+
+    @property
+    def useful(self):
+        '''True if keeping the response can save a request or a download.'''
+        return self.freshness_lifetime > 0 or self.has_validators
+
+    def is_fresh(self, now):
+        return now - self.stored_at < self.freshness_lifetime
+
+    def can_use_stale(self, now):
+        '''True if the response has expired, but may still be used while it is revalidated in the background.'''
+        return now - self.stored_at < self.freshness_lifetime + self.stale_lifetime
+
+    def get_validation_headers(self):
+        '''Returns the headers for a conditional GET that revalidates the response.'''
+        headers = {}
+        if self.etag is not None:
+            headers["If-None-Match"] = self.etag
+        if self.last_modified is not None:
+            headers["If-Modified-Since"] = self.last_modified
+        return headers
+
+    def refresh(self, response):
+        '''Makes the response fresh again after a website has answered a conditional GET with 304 Not Modified.
+
+        :param response: The 304 response of the requests library. Its headers replace the cached ones (if it has them).'''
+        if "Cache-Control" in response.headers or "Expires" in response.headers:
+            refreshed = CachedResponse.from_response(response)
+            self.freshness_lifetime = refreshed.freshness_lifetime
+            self.stale_lifetime = refreshed.stale_lifetime
+        self.etag = response.headers.get("ETag", self.etag)
+        self.last_modified = response.headers.get("Last-Modified", self.last_modified)
+        self.stored_at = time.monotonic()
+
+class InFlightFetch:
+    '''A request to a website that other sessions can wait for (see HTTPCache.fetch_once()).'''
+    def __init__(self):
+        self.done = threading.Event()
+        self.response = None
+        self.exception = None
+
+    def wait(self):
+        '''Waits for the request to finish.
+
+        :returns: The response, as a CachedResponse.
+
+        :raises Exception: The exception of the request, if it failed.'''
+        self.done.wait()
+        if self.exception is not None:
+            raise self.exception
+        return self.response
+
+class HTTPCache:
+    '''A thread-safe cache of website responses, bounded by their size.'''
+    def __init__(self, max_size=HTTP_CACHE_SIZE*1024):
+        '''Initializes an empty cache.
+
+        :param max_size: Max size (in bytes) of the responses to keep. 0 turns the cache off.'''
+        self.max_size = max_size
+        self.size = 0
+        self.entries = collections.OrderedDict() #URL -> CachedResponse, the least recently used first
+        self.revalidating = set() #URLs that are being revalidated in the background
+        self.in_flight_fetches = {} #URL -> InFlightFetch for the URLs that are being fetched (see fetch_once())
+        self.lock = threading.Lock()
+
+    def get(self, url, request):
+        '''Gets the response for a URL from the cache, or from the website if it is not in the cache or has to be revalidated.
+        Sessions that need the same URL from the website at the same time share one request (see fetch_once()).
+
+        :param url: The URL.
+
+        :param request: A function that sends a GET request. It is called with the URL and a dictionary of extra headers,
+        and returns the response of the requests library. Its exceptions are raised by get().
+
+        :returns: The response, as a CachedResponse (also if it has not been cached).'''
+        if self.max_size > 0:
+            now = time.monotonic()
+            with self.lock:
+                cached_response = self.entries.get(url)
+                if cached_response is not None:
+                    self.entries.move_to_end(url)
+            if cached_response is not None:
+                if cached_response.is_fresh(now):
+                    HTTP_CACHE_LOOKUPS.inc("hit")
+                    return cached_response
+                if cached_response.can_use_stale(now):
+                    HTTP_CACHE_LOOKUPS.inc("stale")
+                    self.revalidate_in_background(url, cached_response, request)
+                    return cached_response
+        return self.fetch_once(url, request)
+
+    def fetch_once(self, url, request):
+        '''Fetches a URL from the website (see fetch()). If the URL is already being fetched, the response of that request
+        is waited for and used instead of sending another one, so that many sessions loading the same page at once only
+        send one request (single-flight). If that request fails, its exception is raised for every session that waited for it.'''
+        with self.lock:
+            in_flight_fetch = self.in_flight_fetches.get(url)
+            leading = in_flight_fetch is None
+            if leading:
+                in_flight_fetch = self.in_flight_fetches[url] = InFlightFetch()
+        if not leading:
+            HTTP_COALESCED_FETCHES.inc()
+            return in_flight_fetch.wait()
+        try:
+            in_flight_fetch.response = self.fetch(url, request)
+            return in_flight_fetch.response
+        except Exception as e:
+            in_flight_fetch.exception = e
+            raise
+        finally:
+            with self.lock:
+                del self.in_flight_fetches[url]
+            in_flight_fetch.done.set()
+
+    def fetch(self, url, request):
+        '''Fetches a URL from the website, with a conditional GET if a cached response can be revalidated.'''
+        if self.max_size <= 0:
+            return CachedResponse.from_response(request(url, {}))
+        with self.lock:
+            cached_response = self.entries.get(url)
+        if cached_response is not None:
+            if cached_response.is_fresh(time.monotonic()): #Fetched by another session right before
+                HTTP_CACHE_LOOKUPS.inc("hit")
+                return cached_response
+            if cached_response.has_validators:
+                return self.revalidate(url, cached_response, request)
+        HTTP_CACHE_LOOKUPS.inc("miss")
+        return self.store(url, request(url, {}))
+
+    def revalidate(self, url, cached_response:CachedResponse, request):
+        '''Asks the website if a cached response has changed with a conditional GET.
+
+        :returns: The cached response if it has not changed, or else the new response.'''
+        response = request(url, cached_response.get_validation_headers())
+        if response.status_code == 304:
+            HTTP_CACHE_LOOKUPS.inc("revalidated")
+            cached_response.refresh(response)
+            return cached_response
+        HTTP_CACHE_LOOKUPS.inc("modified")
+        return self.store(url, response)
+
+    def revalidate_in_background(self, url, cached_response:CachedResponse, request):
+        '''Revalidates a cached response on a background thread, unless it is already being revalidated.'''
+        with self.lock:
+            if url in self.revalidating:
+                return
+            self.revalidating.add(url)
+        def run():
+            try:
+                self.revalidate(url, cached_response, request)
+            except Exception as e:
+                logger.warning(f"Failed to revalidate {url} in the background (the exception {e} occurred).")
+            finally:
+                with self.lock:
+                    self.revalidating.discard(url)
+        threading.Thread(target=run, name="superbrain-revalidate", daemon=True).start()
+
+    def store(self, url, response):
+        '''Puts a response of the requests library in the cache (or removes the old one if the response can not be cached).
+
+        :returns: The response, as a CachedResponse.'''
+        cached_response = CachedResponse.from_response(response)
+        storable = CachedResponse.is_storable(response) and cached_response.useful and cached_response.size <= self.max_size
+        with self.lock:
+            old_response = self.entries.pop(url, None)
+            if old_response is not None:
+                self.size -= old_response.size
+            if storable:
+                self.entries[url] = cached_response
+                self.size += cached_response.size
+                while self.size > self.max_size:
+                    _, forgotten_response = self.entries.popitem(last=False)
+                    self.size -= forgotten_response.size
+            HTTP_CACHE_BYTES.set(value=self.size)
+        if storable:
+            logger.debug(f"Cached {url} ({cached_response.size} bytes, fresh for {cached_response.freshness_lifetime} seconds).")
+        return cached_response
+
+response_cache = HTTPCache() #Shared by all sessions
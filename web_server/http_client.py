@@ -0,0 +1,114 @@
+'''http_client.py
+The HTTP client that is shared by everything that talks to websites: loading pages (see sourceloader.py) and sending form data
+(see scene.py). It is a single requests.Session, so connections to a host are kept alive in a pool and reused by the next request,
+instead of paying for the TCP and TLS handshakes on every click. Every request has connect and read timeouts, accepts gzip and
+deflate and is retried as configured if connecting fails or the website is temporarily unavailable.
+The session is shared by all users, so it never keeps cookies.
+To not overwhelm small websites, at most SUPERBRAIN_MAX_REQUESTS_PER_ORIGIN requests are sent to the same origin at the same time.
+Other requests to it wait for a free slot.'''
+import contextlib, logging, sys, threading, time
+from urllib.parse import urlparse
+sys.path.append(".")
+from const import *
+from metrics import ORIGIN_WAIT_SECONDS
+
+logger = logging.getLogger(__name__)
+_session = None
+_session_lock = threading.Lock()
+
+class OriginBusyError(Exception):
+    '''Raised when a request has waited too long for a free slot of its origin (see OriginLimiter).'''
+
+class OriginLimiter:
+    '''Limits how many requests are sent to the same origin (scheme, host and port) at the same time.'''
+    def __init__(self, max_requests=MAX_REQUESTS_PER_ORIGIN, timeout=ORIGIN_WAIT_TIMEOUT):
+        '''Initializes an origin limiter.
+
+        :param max_requests: Max number of requests to one origin at the same time. 0 means no limit.
+
+        :param timeout: Max seconds to wait for a free slot.'''
+        self.max_requests = max_requests
+        self.timeout = timeout
+        self.active_requests = {} #Origin -> number of requests that are being sent to it. Origins without requests are left out
+        self.condition = threading.Condition()
+
+    @contextlib.contextmanager
+    def slot(self, url):
+        '''Waits for a free slot of the origin of a URL and holds it while the code in the context manager runs.
+
+        :raises OriginBusyError: If no slot has become free within the timeout.'''
+        if self.max_requests <= 0:
+            yield
+            return
+        parsed_url = urlparse(url)
+        origin = f"{parsed_url.scheme}://{parsed_url.netloc}"
+        start_time = time.perf_counter()
+        with self.condition:
+            if not self.condition.wait_for(lambda: self.active_requests.get(origin, 0) < self.max_requests, self.timeout):
+                raise OriginBusyError(f"{origin} already has {self.max_requests} requests running, and none finished within {self.timeout} seconds.")
+            self.active_requests[origin] = self.active_requests.get(origin, 0) + 1
+        ORIGIN_WAIT_SECONDS.observe(time.perf_counter() - start_time)
+        try:
+            yield
+        finally:
+            with self.condition:
+                self.active_requests[origin] -= 1
+                if self.active_requests[origin] == 0:
+                    del self.active_requests[origin]
+                self.condition.notify_all()
+
+origin_limiter = OriginLimiter()
+
+def create_session():
+    '''Creates the requests.Session with the configured connection pools and retry policy.'''
+    import requests #Imported here since it takes long to import (see startup.py)
+    from http.cookiejar import DefaultCookiePolicy
+    from requests.adapters import HTTPAdapter
+    from urllib3.util.retry import Retry
+    session = requests.Session()
+    session.cookies.set_policy(DefaultCookiePolicy(allowed_domains=[])) #Cookies from one user's page must not be sent for another user
+    session.headers["Accept-Encoding"] = "gzip, deflate"
+    retry = Retry(
+        total=FETCH_RETRIES,
+        backoff_factor=FETCH_RETRY_BACKOFF,
+        status_forcelist=FETCH_RETRY_STATUS_CODES,
+        allowed_methods=Retry.DEFAULT_ALLOWED_METHODS, #Form data (POST) is only sent again if the connection failed before it was sent
+        raise_on_status=False, #Give back the last response when the retries run out
+        respect_retry_after_header=False #A long Retry-After would hold up the load until it times out
+    )
+    adapter = HTTPAdapter(pool_connections=HTTP_POOL_HOSTS, pool_maxsize=HTTP_POOL_SIZE, max_retries=retry)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    logger.debug(f"Created HTTP client with pools for {HTTP_POOL_HOSTS} hosts of {HTTP_POOL_SIZE} connections each.")
+    return session
+
+def get_session():
+    '''Returns the requests.Session that is shared by all sessions of the process. It is created on first use,
+    so that worker processes (see supervisor.py) do not share connections with each other.'''
+    global _session
+    with _session_lock:
+        if _session is None:
+            _session = create_session()
+        return _session
+
+def get(url, headers:dict=None, **kwargs):
+    '''Sends a GET request with the shared client.
+
+    :param url: The URL.
+
+    :param headers: Any headers to send.
+
+    :param kwargs: Any extra keyword arguments to pass on to requests.Session.get().
+
+    :returns: The response of the requests library.
+
+    :raises OriginBusyError: If the origin of the URL has too many requests running (see OriginLimiter).'''
+    kwargs.setdefault("timeout", FETCH_TIMEOUT)
+    with origin_limiter.slot(url):
+        return get_session().get(url, headers=headers, **kwargs)
+
+def post(url, **kwargs):
+    '''Sends a POST request with the shared client. Takes the same arguments as get().'''
+    kwargs.setdefault("timeout", FETCH_TIMEOUT)
+    with origin_limiter.slot(url):
+        return get_session().post(url, **kwargs)
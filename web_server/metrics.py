@@ -0,0 +1,238 @@
+'''metrics.py
+Collects metrics (counters, gauges and histograms) about the superbrain and exposes them in the Prometheus text format,
+either on a local HTTP port or in a file. Recording a value only takes a lock and an addition,
+so metrics can be kept enabled in production.'''
+import bisect, contextlib, http.server, logging, os, sys, threading, time
+sys.path.append(".")
+from const import *
+
+logger = logging.getLogger(__name__)
+REGISTRY = [] #All metrics, in the order that they were created
+COLLECTORS = [] #Functions that are called to update metrics right before they are exposed
+#Buckets (in seconds) for timing histograms, from 0.5 ms to 30 seconds
+TIME_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+#Buckets (in bytes) for size histograms
+BYTE_BUCKETS = (64, 256, 1024, 4096, 16384, 65536, 262144)
+
+def format_labels(label_names, label_values):
+    '''Formats labels as they are written in the Prometheus text format, for example {origin="example.com"}'''
+    if len(label_names) == 0:
+        return ""
+    formatted_labels = []
+    for label_name, label_value in zip(label_names, label_values):
+        label_value = str(label_value).replace("\\", "\\\\").replace("\n", "\\n").replace("\"", "\\\"")
+        formatted_labels.append(f"{label_name}=\"{label_value}\"")
+    return "{" + ",".join(formatted_labels) + "}"
+
+class Metric:
+    '''Base class for metrics. A metric has one value for every combination of label values that has been used.'''
+    type_name = None
+
+    def __init__(self, name, description, label_names=()):
+        '''Initializes a metric and adds it to the registry.
+
+        :param name: The name of the metric, for example superbrain_fetch_errors_total
+
+        :param description: What the metric measures.
+
+        :param label_names: Names of the labels of the metric, if any. Values for them are given when the metric is updated.'''
+        self.name = name
+        self.description = description
+        self.label_names = tuple(label_names)
+        self.values = {} #Label values -> value
+        if len(self.label_names) == 0 and self.type_name != "histogram": #Show metrics without labels as 0 instead of leaving them out
+            self.values[()] = 0
+        self.lock = threading.Lock()
+        REGISTRY.append(self)
+
+    def expose_values(self):
+        '''Returns the lines for the values of the metric in the Prometheus text format.'''
+        with self.lock:
+            return [f"{self.name}{format_labels(self.label_names, label_values)} {value}" for label_values, value in self.values.items()]
+
+    def expose(self):
+        '''Returns the metric in the Prometheus text format.'''
+        return [f"# HELP {self.name} {self.description}", f"# TYPE {self.name} {self.type_name}"] + self.expose_values()
+
+class Counter(Metric):
+    '''A value that only goes up, like the number of errors.'''
+    type_name = "counter"
+
+    def inc(self, *label_values, amount=1):
+        '''Increases the counter.
+
+        :param label_values: Values for the labels of the counter.
+
+        :param amount: How much to increase the counter by.'''
+        if not METRICS_ENABLED:
+            return
+        with self.lock:
+            self.values[label_values] = self.values.get(label_values, 0) + amount
+
+    def set_total(self, *label_values, total):
+        '''Sets the value of the counter. Only for values that are counted somewhere else (like the hits of a functools.lru_cache)
+        and are copied by a collector.'''
+        with self.lock:
+            self.values[label_values] = total
+
+class Gauge(Metric):
+    '''A value that can go up and down, like the number of active sessions.'''
+    type_name = "gauge"
+
+    def inc(self, *label_values, amount=1):
+        '''Increases the gauge.'''
+        if not METRICS_ENABLED:
+            return
+        with self.lock:
+            self.values[label_values] = self.values.get(label_values, 0) + amount
+
+    def dec(self, *label_values, amount=1):
+        '''Decreases the gauge.'''
+        self.inc(*label_values, amount=-amount)
+
+    def set(self, *label_values, value):
+        '''Sets the gauge to a value.'''
+        with self.lock:
+            self.values[label_values] = value
+
+class Histogram(Metric):
+    '''Counts observed values (like how long something took) in buckets, so that percentiles can be calculated.'''
+    type_name = "histogram"
+
+    def __init__(self, name, description, label_names=(), buckets=TIME_BUCKETS):
+        '''Initializes a histogram.
+
+        :param buckets: Upper bounds of the buckets, in ascending order. A bucket for all values (+Inf) is added automatically.'''
+        super().__init__(name, description, label_names)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, *label_values):
+        '''Adds an observed value.
+
+        :param value: The value.
+
+        :param label_values: Values for the labels of the histogram.'''
+        if not METRICS_ENABLED:
+            return
+        bucket_index = bisect.bisect_left(self.buckets, value)
+        with self.lock:
+            if label_values not in self.values:
+                self.values[label_values] = [[0] * (len(self.buckets) + 1), 0, 0] #Count in every bucket, sum, count
+            histogram = self.values[label_values]
+            histogram[0][bucket_index] += 1
+            histogram[1] += value
+            histogram[2] += 1
+
+    @contextlib.contextmanager
+    def time(self, *label_values):
+        '''Context manager that observes the number of seconds that the code in it takes.'''
+        start_time = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start_time, *label_values)
+
+    def expose_values(self):
+        lines = []
+        with self.lock:
+            for label_values, (bucket_counts, value_sum, value_count) in self.values.items():
+                cumulative_count = 0
+                for bucket, bucket_count in zip(self.buckets + ("+Inf",), bucket_counts):
+                    cumulative_count += bucket_count
+                    lines.append(f"{self.name}_bucket{format_labels(self.label_names + ('le',), label_values + (bucket,))} {cumulative_count}")
+                lines.append(f"{self.name}_sum{format_labels(self.label_names, label_values)} {value_sum}")
+                lines.append(f"{self.name}_count{format_labels(self.label_names, label_values)} {value_count}")
+        return lines
+
+def register_collector(function):
+    '''Registers a function that is called right before metrics are exposed, for example to copy values
+    that are counted somewhere else into a metric.'''
+    COLLECTORS.append(function)
+
+def expose():
+    '''Returns all metrics in the Prometheus text format.'''
+    for collector in COLLECTORS:
+        try:
+            collector()
+        except Exception as e:
+            logger.warning(f"Metrics collector {collector} failed (the error {e} occurred).")
+    lines = []
+    for metric in REGISTRY:
+        lines.extend(metric.expose())
+    return "\n".join(lines) + "\n"
+
+class MetricsRequestHandler(http.server.BaseHTTPRequestHandler):
+    '''Serves the metrics over HTTP.'''
+    def do_GET(self):
+        if self.path not in ["/", "/metrics"]:
+            self.send_error(404)
+            return
+        body = expose().encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        logger.debug(f"Metrics request: {format % args}")
+
+def write_metrics_file(path):
+    '''Writes all metrics to a file. The file is replaced at once, so it is never read half-written.'''
+    temporary_path = path + ".tmp"
+    with open(temporary_path, "w") as metrics_file:
+        metrics_file.write(expose())
+    os.replace(temporary_path, path)
+
+def run_metrics_file_writer(path):
+    '''Writes the metrics to a file every METRICS_FILE_INTERVAL seconds. Runs forever.'''
+    while True:
+        try:
+            write_metrics_file(path)
+        except OSError as e:
+            logger.warning(f"Failed to write metrics to {path} (the error {e} occurred).")
+        time.sleep(METRICS_FILE_INTERVAL)
+
+def start_exporter(worker_index=None):
+    '''Starts exposing the metrics on METRICS_PORT and/or in METRICS_FILE (if they are set), in the background.
+
+    :param worker_index: The index of the worker process if there are several workers (see supervisor.py).
+    Every worker has its own metrics, which are exposed on METRICS_PORT + the index and in METRICS_FILE with the index added to it.'''
+    if not METRICS_ENABLED:
+        return
+    if METRICS_PORT > 0:
+        port = METRICS_PORT + (worker_index or 0)
+        try:
+            metrics_server = http.server.ThreadingHTTPServer((METRICS_HOST, port), MetricsRequestHandler)
+            metrics_server.daemon_threads = True
+            threading.Thread(target=metrics_server.serve_forever, name="superbrain-metrics", daemon=True).start()
+            logger.info(f"Exposing metrics on http://{METRICS_HOST}:{port}/metrics")
+        except OSError as e:
+            logger.warning(f"Failed to expose metrics on port {port} (the error {e} occurred).")
+    if METRICS_FILE != "":
+        path = METRICS_FILE if worker_index is None else f"{METRICS_FILE}.{worker_index}"
+        threading.Thread(target=run_metrics_file_writer, args=(path,), name="superbrain-metrics-file", daemon=True).start()
+        logger.info(f"Writing metrics to {path}")
+
+#Metrics of the superbrain
+FETCH_SECONDS = Histogram("superbrain_fetch_seconds", "Time to load the content of a source.", ["kind"])
+FETCH_ERRORS = Counter("superbrain_fetch_errors_total", "Sources that failed to load, by origin.", ["origin"])
+HTTP_CACHE_LOOKUPS = Counter("superbrain_http_cache_lookups_total", "Websites that were looked up in the HTTP response cache, by result (hit, stale, revalidated, modified or miss).", ["result"])
+HTTP_CACHE_BYTES = Gauge("superbrain_http_cache_bytes", "Size of the responses in the HTTP response cache.")
+HTTP_COALESCED_FETCHES = Counter("superbrain_http_coalesced_fetches_total", "Fetches of websites that used the response of the same request that was already being sent for another session.")
+ORIGIN_WAIT_SECONDS = Histogram("superbrain_origin_wait_seconds", "Time that requests to websites waited for a free slot of their origin (see SUPERBRAIN_MAX_REQUESTS_PER_ORIGIN).")
+TRANSLATIONS = Counter("superbrain_translations_total", "Jobs run in the translation pool, by result (done, failed, rejected or timed_out).", ["result"])
+TRANSLATION_JOBS = Gauge("superbrain_translation_jobs", "Jobs that are waiting for or running in the translation pool.")
+BREAK_DOWN_SECONDS = Histogram("superbrain_break_down_seconds", "Time to parse and convert a page with Translator.break_down().")
+RENDER_SECONDS = Histogram("superbrain_render_seconds", "Time to render a scene with Scene.render().")
+FRAME_BYTES = Histogram("superbrain_frame_bytes", "Bytes written for every frame (before compression).", buckets=BYTE_BUCKETS)
+SENT_BYTES = Counter("superbrain_sent_bytes_total", "Bytes sent to clients (after compression).")
+SKIPPED_FRAMES = Counter("superbrain_skipped_frames_total", "Frames that were not drawn because the client had not received the previous frame yet.")
+RENDER_PROFILE_CHANGES = Counter("superbrain_render_profile_changes_total", "Sessions that were switched to a render profile, by profile and reason (terminal_type or slow_link).", ["profile", "reason"])
+SLOW_CLIENTS = Counter("superbrain_slow_clients_total", "Sessions that were closed because the client did not receive its output.")
+KEYSTROKE_LATENCY_SECONDS = Histogram("superbrain_keystroke_latency_seconds", "Time from receiving input from a client to having the next frame ready.")
+ACTIVE_SESSIONS = Gauge("superbrain_active_sessions", "Number of sessions that are active.")
+REJECTED_SESSIONS = Counter("superbrain_rejected_sessions_total", "Clients that were rejected because of the session limits.")
+PAGE_LOADS = Counter("superbrain_page_loads_total", "Pages that sessions have loaded, by result (loaded, failed, cancelled, timed_out or from_history for pages shown from the history without loading them).", ["result"])
+CACHE_HITS = Counter("superbrain_cache_hits_total", "Lookups that were found in a cache.", ["cache"])
+CACHE_MISSES = Counter("superbrain_cache_misses_total", "Lookups that were not found in a cache.", ["cache"])
@@ -0,0 +1,219 @@
+'''profiling.py
+Profiling of single sessions, for finding out why a page is slow without turning on debug logging for the whole server.
+Operators (clients from PROFILING_CLIENTS, if SUPERBRAIN_PROFILING is on) can press Ctrl+P to show an overlay with timings
+for the current page (fetch, parse, convert per tag type, layout, render and bytes sent), and Ctrl+O to dump a cProfile
+profile of the last frames of their session to disk. The profile can be read with pstats or turned into a flamegraph
+with tools like flameprof or snakeviz.'''
+import collections, contextlib, cProfile, logging, os, sys, threading, time
+sys.path.append(".")
+from const import *
+from metrics import BREAK_DOWN_SECONDS
+
+logger = logging.getLogger(__name__)
+_active = threading.local() #The page timings that are being collected on the current thread, if any
+
+class PageTimings:
+    '''How long the different steps of loading a page took.'''
+    def __init__(self, source):
+        self.source = source
+        self.fetch_seconds = 0
+        self.parse_seconds = 0 #Parsing the HTML with BeautifulSoup
+        self.convert_seconds = collections.Counter() #Tag name -> seconds spent in its converter (see TAG_CONVERTERS)
+        self.layout_seconds = 0 #Everything else that it takes to turn the page into a scene (rows, columns and the scene itself)
+        self.total_seconds = 0
+        self.converting = [] #[start time, time spent in nested converters] for every converter that is running
+
+    @property
+    def total_convert_seconds(self):
+        return sum(self.convert_seconds.values())
+
+    def start_converting(self):
+        '''Called when a tag converter starts.'''
+        self.converting.append([time.perf_counter(), 0])
+
+    def stop_converting(self, tag_name):
+        '''Called when a tag converter is done. Converters can convert child tags (like forms do), and that time
+        is only counted for the child tags.'''
+        start_time, nested_seconds = self.converting.pop()
+        elapsed_time = time.perf_counter() - start_time
+        self.convert_seconds[tag_name] += elapsed_time - nested_seconds
+        if len(self.converting) > 0:
+            self.converting[-1][1] += elapsed_time
+
+def get_active_timings():
+    '''Returns the page timings that are being collected on the current thread, or None if nothing is being collected.'''
+    return getattr(_active, "timings", None) if PROFILING_ENABLED else None
+
+@contextlib.contextmanager
+def collect_timings(timings:PageTimings):
+    '''Collects timings for loading a page while the code in the context manager runs (on the same thread).'''
+    _active.timings = timings
+    start_time = time.perf_counter()
+    try:
+        yield timings
+    finally:
+        timings.total_seconds = time.perf_counter() - start_time
+        timings.layout_seconds = max(timings.total_seconds - timings.fetch_seconds - timings.parse_seconds - timings.total_convert_seconds, 0)
+        _active.timings = None
+
+@contextlib.contextmanager
+def measure_translation_step(step, *labels):
+    '''Measures a step of translating a page (see Translator) for the metrics, and for the page timings that are being collected
+    on the current thread if there are any.
+
+    :param step: "break_down", "parse" or "convert".
+
+    :param labels: The name of the tag for "convert".'''
+    timings = get_active_timings()
+    if step == "convert" and timings is not None:
+        timings.start_converting()
+    start_time = time.perf_counter()
+    try:
+        yield
+    finally:
+        if step == "break_down":
+            BREAK_DOWN_SECONDS.observe(time.perf_counter() - start_time)
+        elif step == "parse" and timings is not None:
+            timings.parse_seconds += time.perf_counter() - start_time
+        elif step == "convert" and timings is not None:
+            timings.stop_converting(labels[0])
+
+def is_profiling_allowed(client_address):
+    '''Returns True if a client is allowed to profile its session.'''
+    if not PROFILING_ENABLED:
+        return False
+    return "*" in PROFILING_CLIENTS or (client_address is not None and client_address[0] in PROFILING_CLIENTS)
+
+def format_duration(seconds):
+    return f"{seconds * 1000:.1f} ms"
+
+class SessionProfiler:
+    '''Keeps the timings of a session's current page and, while the overlay is shown, a cProfile profile of its last frames.'''
+    def __init__(self, session_name, max_frames=PROFILE_FRAMES):
+        '''Initializes a profiler.
+
+        :param session_name: Used in the file names of dumped profiles.
+
+        :param max_frames: Number of frames to keep profiles of.'''
+        self.session_name = session_name
+        self.overlay_shown = False
+        self.page_timings = None #Timings of the current page
+        self.load_timings = None #Timings of the page that was loaded last, which becomes the current page when the load is done
+        self.render_seconds = 0 #Time to render (and diff) the last frame
+        self.frame_bytes = 0 #Bytes written for the last frame, before compression
+        self.frame_profiles = collections.deque(maxlen=max_frames) #Profiles of the last frames
+        self.frame_profile = None #The profile of the frame that is being handled
+        self.lock = threading.Lock() #Profiles of loads are added from other threads
+        self.last_dump_path = None
+
+    def toggle_overlay(self):
+        '''Shows or hides the overlay. Frames are only profiled while it is shown.'''
+        self.overlay_shown = not self.overlay_shown
+        logger.info(f"Profiling overlay {'shown' if self.overlay_shown else 'hidden'} for session {self.session_name}.")
+
+    def start_frame(self):
+        '''Starts profiling the work for the next frame (handling input and rendering), if the overlay is shown.'''
+        if not self.overlay_shown or self.frame_profile is not None:
+            return
+        self.frame_profile = cProfile.Profile()
+        try:
+            self.frame_profile.enable()
+        except ValueError: #Another profiler is active on this thread
+            self.frame_profile = None
+
+    def end_frame(self, render_seconds, frame_bytes):
+        '''Stops profiling the current frame and records how long it took to render.
+
+        :param render_seconds: Time to render the frame.
+
+        :param frame_bytes: Bytes written for the frame.'''
+        self.render_seconds = render_seconds
+        self.frame_bytes = frame_bytes
+        if self.frame_profile is not None:
+            self.frame_profile.disable()
+            self.add_profile(self.frame_profile)
+            self.frame_profile = None
+
+    def stop(self):
+        '''Stops profiling the current frame without keeping the profile. Called when the session ends.'''
+        if self.frame_profile is not None:
+            self.frame_profile.disable()
+            self.frame_profile = None
+
+    @contextlib.contextmanager
+    def profile_load(self, source):
+        '''Collects the timings of loading a page (and a profile of it, if the overlay is shown) while the code in it runs.'''
+        timings = PageTimings(source)
+        load_profile = cProfile.Profile() if self.overlay_shown else None
+        if load_profile is not None:
+            load_profile.enable()
+        try:
+            with collect_timings(timings):
+                yield timings
+        finally:
+            if load_profile is not None:
+                load_profile.disable()
+                self.add_profile(load_profile)
+            self.load_timings = timings
+
+    def add_profile(self, profile:cProfile.Profile):
+        with self.lock:
+            self.frame_profiles.append(profile)
+
+    def finish_load(self):
+        '''Makes the timings of the page that was loaded last the timings of the current page.'''
+        if self.load_timings is not None:
+            self.page_timings = self.load_timings
+            self.load_timings = None
+
+    def get_overlay_lines(self, sent_bytes):
+        '''Returns the lines of the overlay.
+
+        :param sent_bytes: Total number of bytes sent to the client (after compression).'''
+        lines = ["PROFILE (Ctrl+P hides)"]
+        timings = self.page_timings
+        if timings is None:
+            lines.append("page: cached or not loaded")
+        else:
+            lines.append(f"fetch    {format_duration(timings.fetch_seconds)}")
+            lines.append(f"parse    {format_duration(timings.parse_seconds)}")
+            lines.append(f"convert  {format_duration(timings.total_convert_seconds)}")
+            for tag_name, seconds in timings.convert_seconds.most_common(3):
+                lines.append(f"  <{tag_name}> {format_duration(seconds)}")
+            lines.append(f"layout   {format_duration(timings.layout_seconds)}")
+        lines.append(f"render   {format_duration(self.render_seconds)}")
+        lines.append(f"frame    {self.frame_bytes} B")
+        lines.append(f"sent     {sent_bytes} B total")
+        lines.append(f"Ctrl+O dumps {len(self.frame_profiles)} frames")
+        if self.last_dump_path is not None:
+            lines.append(f"dumped {os.path.basename(self.last_dump_path)}")
+        return lines
+
+    def dump(self):
+        '''Writes the profiles of the last frames to a file in PROFILE_DIRECTORY (in the pstats format), together with a text summary.
+
+        :returns: The path of the profile, or None if there was nothing to dump.'''
+        with self.lock:
+            profiles = list(self.frame_profiles)
+        if len(profiles) == 0:
+            logger.info("No frames have been profiled yet. Show the overlay to start profiling.")
+            return None
+        import pstats #Imported here since it is only needed for dumps and takes a while to import (see startup.py)
+        os.makedirs(PROFILE_DIRECTORY, exist_ok=True)
+        path = os.path.join(PROFILE_DIRECTORY, f"session-{self.session_name}-{time.strftime('%Y%m%d-%H%M%S')}.prof")
+        stats = pstats.Stats(profiles[0])
+        for profile in profiles[1:]:
+            stats.add(profile)
+        stats.dump_stats(path)
+        with open(path + ".txt", "w") as summary_file:
+            timings = self.page_timings
+            if timings is not None:
+                summary_file.write(f"Page: {timings.source}\n")
+                summary_file.write(f"fetch: {format_duration(timings.fetch_seconds)}, parse: {format_duration(timings.parse_seconds)}, convert: {format_duration(timings.total_convert_seconds)}, layout: {format_duration(timings.layout_seconds)}\n")
+                for tag_name, seconds in timings.convert_seconds.most_common():
+                    summary_file.write(f"convert <{tag_name}>: {format_duration(seconds)}\n")
+            summary_file.write(f"Profiled frames: {len(profiles)}\n\n")
+            pstats.Stats(path, stream=summary_file).sort_stats("cumulative").print_stats(40)
+        logger.info(f"Dumped a profile of {len(profiles)} frames to {path}.")
+        self.last_dump_path = path
+        return path
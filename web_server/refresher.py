@@ -0,0 +1,180 @@
+'''refresher.py
+Updates pages that have opted in to being refreshed (with a <meta http-equiv="refresh" content="<seconds>"> tag)
+while sessions are watching them. One scheduler thread is shared by all sessions, and every watched source is only
+fetched once per interval no matter how many sessions that are watching it. Sessions are only told about a new
+version of a page if its translated content has actually changed.'''
+import hashlib, heapq, itertools, logging, sys, threading, time, weakref
+sys.path.append(".")
+from const import *
+from metrics import Counter
+
+REFRESH_CHECKS = Counter("superbrain_refresh_checks_total", "Checks of watched sources for changes, by result.", ["result"])
+
+logger = logging.getLogger(__name__)
+
+def get_content_hash(content:str):
+    '''Returns a hash of some content.'''
+    return hashlib.blake2b(content.encode(errors="replace"), digest_size=16).digest()
+
+class WatchedSource:
+    '''A source that one or more sessions are watching.'''
+    def __init__(self, source):
+        self.source = source
+        self.sessions = weakref.WeakSet() #Sessions that are watching the source. Sessions that are gone are removed automatically
+        self.intervals = weakref.WeakKeyDictionary() #Session -> how often it wants the source to be refreshed
+        self.content_hash = None #Hash of the raw content the last time the source was checked (or when a session loaded it)
+        self.translated_hash = None #Hash of the translated content the last time the source was checked (or when a session loaded it)
+        self.loaded_content = None #Content that a session has loaded, which translated_hash has not been worked out for yet
+        self.sessions_to_update = weakref.WeakSet() #Sessions that could not apply the last version yet (see Refresher.update_later())
+        self.checking = False #True while the source is being checked
+
+    @property
+    def interval(self):
+        '''How often to check the source: the shortest interval that any session watching it wants, but not shorter than MIN_REFRESH_INTERVAL.'''
+        return max(min(self.intervals.values(), default=MIN_REFRESH_INTERVAL), MIN_REFRESH_INTERVAL)
+
+class Refresher:
+    '''Checks watched sources for changes on a shared schedule and notifies the sessions that watch them.'''
+    def __init__(self, load_content, get_translated_hash, executor):
+        '''Initializes the refresher.
+
+        :param load_content: A function that loads the content of a source as a string (or returns None if it fails).
+
+        :param get_translated_hash: A function that translates content (given the source and the content) and returns a hash
+        of the result, or None if it could not be translated. Used to find out if a change to the content is visible to the user.
+
+        :param executor: The executor to load and translate sources in, so that the scheduler thread never blocks.'''
+        self.load_content = load_content
+        self.get_translated_hash = get_translated_hash
+        self.executor = executor
+        self.watched_sources = {} #Source -> WatchedSource
+        self.watched_source_of_session = weakref.WeakKeyDictionary() #Session -> the source that it is watching
+        self.schedule = [] #Heap of (when to check, tiebreaker, source)
+        self.tiebreaker = itertools.count()
+        self.condition = threading.Condition()
+        self.thread = None
+
+    def watch(self, session, source, interval, content=None):
+        '''Starts watching a source for a session. Any source that the session was watching before is unwatched.
+        When the source changes, session.on_source_refreshed(source, content) is called (from another thread).
+
+        :param session: The session.
+
+        :param source: The source to watch.
+
+        :param interval: How often (in seconds) the session wants the source to be checked.
+
+        :param content: The content that the session has loaded from the source, if known. If the source is not being watched yet,
+        checks compare against it, so that sessions are only notified once the source has changed since it was loaded.'''
+        with self.condition:
+            self.unwatch(session)
+            if source not in self.watched_sources:
+                self.watched_sources[source] = WatchedSource(source)
+                self.schedule_check(source, interval)
+            watched_source = self.watched_sources[source]
+            if content is not None and watched_source.content_hash is None:
+                #The translated hash is only worked out (in check()) once the content has changed, since that takes a translation
+                watched_source.content_hash = get_content_hash(content)
+                watched_source.loaded_content = content
+            watched_source.sessions.add(session)
+            watched_source.intervals[session] = interval
+            self.watched_source_of_session[session] = source
+            if self.thread is None:
+                self.thread = threading.Thread(target=self.run, name="superbrain-refresher", daemon=True)
+                self.thread.start()
+
+    def unwatch(self, session):
+        '''Stops watching the source that a session is watching, if any.'''
+        with self.condition:
+            source = self.watched_source_of_session.pop(session, None)
+            if source is not None and source in self.watched_sources:
+                self.watched_sources[source].sessions.discard(session)
+                self.watched_sources[source].intervals.pop(session, None)
+
+    def update_later(self, session, source):
+        '''Notifies a session about the current version of a source again on the next check, even if the source has not changed
+        by then. Used when the session could not apply the version it was notified about, for example because the translation pool was full.
+
+        :param session: The session.
+
+        :param source: The source that the session was notified about. Nothing is done if the session is not watching it anymore.'''
+        with self.condition:
+            if self.watched_source_of_session.get(session) == source and source in self.watched_sources:
+                self.watched_sources[source].sessions_to_update.add(session)
+
+    def schedule_check(self, source, delay):
+        '''Schedules a check of a source. Has to be called with the condition held.'''
+        heapq.heappush(self.schedule, (time.monotonic() + max(delay, MIN_REFRESH_INTERVAL), next(self.tiebreaker), source))
+        self.condition.notify()
+
+    def run(self):
+        '''Runs the scheduler. Waits until the next source is due and hands it over to the executor.'''
+        with self.condition:
+            while True:
+                if len(self.schedule) == 0:
+                    self.condition.wait()
+                    continue
+                check_time, _, source = self.schedule[0]
+                now = time.monotonic()
+                if check_time > now:
+                    self.condition.wait(check_time - now)
+                    continue
+                heapq.heappop(self.schedule)
+                watched_source = self.watched_sources.get(source)
+                if watched_source is None:
+                    continue
+                if len(watched_source.sessions) == 0: #Nobody is watching anymore
+                    del self.watched_sources[source]
+                    continue
+                if not watched_source.checking:
+                    watched_source.checking = True
+                    self.executor.submit(self.check, watched_source)
+                self.schedule_check(source, watched_source.interval)
+
+    def check(self, watched_source:WatchedSource):
+        '''Checks if a watched source has changed and notifies the sessions watching it if it has.'''
+        try:
+            content = self.load_content(watched_source.source)
+            if content is None:
+                REFRESH_CHECKS.inc("failed")
+                return
+            content_hash = get_content_hash(content)
+            if content_hash == watched_source.content_hash: #Nothing changed, so there is no need to translate it
+                REFRESH_CHECKS.inc("unchanged")
+                self.notify(watched_source, content, watched_source.sessions_to_update)
+                return
+            if watched_source.loaded_content is not None:
+                watched_source.translated_hash = self.get_translated_hash(watched_source.source, watched_source.loaded_content)
+                watched_source.loaded_content = None
+            translated_hash = self.get_translated_hash(watched_source.source, content)
+            if translated_hash is None: #The content hash is kept, so the next check tries again
+                REFRESH_CHECKS.inc("failed")
+                return
+            watched_source.content_hash = content_hash
+            if translated_hash == watched_source.translated_hash:
+                REFRESH_CHECKS.inc("unchanged")
+                self.notify(watched_source, content, watched_source.sessions_to_update)
+                return
+            watched_source.translated_hash = translated_hash
+            REFRESH_CHECKS.inc("changed")
+            logger.debug(f"{watched_source.source} has changed. Notifying {len(watched_source.sessions)} sessions...")
+            self.notify(watched_source, content, watched_source.sessions)
+        except Exception as e:
+            REFRESH_CHECKS.inc("failed")
+            logger.warning(f"Failed to check {watched_source.source} for changes (the error {e} occurred).", exc_info=True)
+        finally:
+            watched_source.checking = False
+
+    def notify(self, watched_source:WatchedSource, content, sessions):
+        '''Tells sessions watching a source about its current content.
+
+        :param watched_source: The watched source.
+
+        :param content: The current content of the source.
+
+        :param sessions: The sessions to notify (a set of the watched source).'''
+        with self.condition:
+            sessions = [session for session in sessions if session in watched_source.sessions]
+            watched_source.sessions_to_update.clear()
+        for session in sessions:
+            session.on_source_refreshed(watched_source.source, content)
@@ -0,0 +1,84 @@
+'''render_profiles.py
+Render profiles decide how much of a page is sent to a client: everything (color), no colors (monochrome), no terminal styles
+at all (plain) or no styles and buttons and text boxes without borders (compact). Terminals that can not show colors, or clients
+on slow connections, get a smaller profile so that they are not sent escape codes and borders that they have no use for.
+With SUPERBRAIN_RENDER_PROFILE set to "auto", the profile of every client is picked from the terminal type that it sends
+(Telnet TERMINAL-TYPE, RFC 1091) and is made smaller when frames have to be skipped because the client can not keep up.'''
+import collections, logging, sys, time
+sys.path.append(".")
+from const import *
+
+logger = logging.getLogger(__name__)
+
+#Terminal types (matched by their start) and the profile that fits them. Other terminal types get colors
+TERMINAL_TYPE_PROFILES = [
+    ("dumb", RENDER_PROFILE_PLAIN),
+    ("unknown", RENDER_PROFILE_PLAIN),
+    ("network-virtual-terminal", RENDER_PROFILE_PLAIN),
+    ("vt52", RENDER_PROFILE_PLAIN),
+    ("vt100", RENDER_PROFILE_MONOCHROME),
+    ("vt102", RENDER_PROFILE_MONOCHROME),
+    ("vt220", RENDER_PROFILE_MONOCHROME),
+    ("vt320", RENDER_PROFILE_MONOCHROME)
+]
+MONOCHROME_TERMINAL_TYPE_SUFFIXES = ["-mono", "-m"] #Like "xterm-mono"
+
+def get_configured_profile():
+    '''Returns the render profile that is set for all clients with SUPERBRAIN_RENDER_PROFILE, or None if a profile is picked for every client.'''
+    if RENDER_PROFILE in RENDER_PROFILES:
+        return RENDER_PROFILE
+    if RENDER_PROFILE != "auto":
+        logger.warning(f"Unknown render profile {RENDER_PROFILE}. Picking a profile for every client instead. (valid profiles: {', '.join(RENDER_PROFILES)})")
+    return None
+
+CONFIGURED_PROFILE = get_configured_profile()
+
+def get_profile_for_terminal_type(terminal_type:str):
+    '''Returns the render profile that fits a terminal type that a client has sent.
+
+    :param terminal_type: The terminal type, like "xterm-256color" or "vt100".'''
+    terminal_type = terminal_type.lower()
+    if any(terminal_type.endswith(suffix) for suffix in MONOCHROME_TERMINAL_TYPE_SUFFIXES):
+        return RENDER_PROFILE_MONOCHROME
+    for terminal_type_start, profile in TERMINAL_TYPE_PROFILES:
+        if terminal_type.startswith(terminal_type_start):
+            return profile
+    return RENDER_PROFILE_COLOR
+
+def get_smaller_profile(profile):
+    '''Returns the render profile with the next smaller output, or None if the profile is the smallest one.'''
+    profile_index = RENDER_PROFILES.index(profile)
+    return RENDER_PROFILES[profile_index+1] if profile_index+1 < len(RENDER_PROFILES) else None
+
+def is_compact(profile):
+    '''Returns True if pages are broken down without borders or padding for a render profile.'''
+    return profile == RENDER_PROFILE_COMPACT
+
+class SlowLinkDetector:
+    '''Finds out if a client's connection is too slow for the output that it gets, from how often frames are skipped for it.
+    Frames are skipped when the client has not received the last frame yet (see Session.defer_frame()), which is what a
+    too slow connection leads to. The bytes per second are not measured, since small frames fit in the socket buffers
+    and look fast on any connection.'''
+    def __init__(self, max_skipped_frames=SLOW_LINK_FRAMES, window=SLOW_LINK_WINDOW):
+        '''Initializes a detector.
+
+        :param max_skipped_frames: Number of skipped frames within the window that makes a connection slow. 0 means never.
+
+        :param window: The window in seconds.'''
+        self.max_skipped_frames = max_skipped_frames
+        self.window = window
+        self.skipped_frame_times = collections.deque(maxlen=max(max_skipped_frames, 1))
+
+    def add_skipped_frame(self):
+        '''Remembers that a frame has been skipped for the client.
+
+        :returns: True if the connection is too slow. The skipped frames are then forgotten, so that the next
+        max_skipped_frames skipped frames are counted from scratch.'''
+        if self.max_skipped_frames <= 0:
+            return False
+        now = time.monotonic()
+        self.skipped_frame_times.append(now)
+        if len(self.skipped_frame_times) == self.max_skipped_frames and now - self.skipped_frame_times[0] <= self.window:
+            self.skipped_frame_times.clear()
+            return True
+        return False
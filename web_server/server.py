@@ -1,6 +1,7 @@
-import socketserver, logging, os
-from const import SUPERBRAIN_LOGO_ASCII, LOGGING_LEVEL_STR_TO_LEVEL
-from handler import RequestHandler
+import startup #First, so that the startup report measures from the start
+import socketserver, logging, os, signal, socket, sys
+from const import SUPERBRAIN_LOGO_ASCII, LOGGING_LEVEL_STR_TO_LEVEL, SERVER_MODE, SERVER_MODE_ASYNCIO, SERVER_MODE_THREADED, \
+WORKERS
 logger = logging.getLogger(__name__)
 #Determine global logging level
 if not os.getenv("SUPERBRAIN_LOG_LEVEL") in LOGGING_LEVEL_STR_TO_LEVEL:
@@ -13,6 +14,86 @@ class ThreadedTCPServer(socketserver.ThreadingMixIn, socketserver.TCPServer):
     '''Threaded server using documentation from https://docs.python.org/3/library/socketserver.html'''
     daemon_threads = True
 
+    def __init__(self, *args, reuse_port=False, heartbeat=None, **kwargs):
+        '''Initializes the server. Takes the same arguments as socketserver.TCPServer, and:
+
+        :param reuse_port: If True, SO_REUSEPORT is set so that several processes can listen on the same port.
+
+        :param heartbeat: A function that is called regularly while the server is running, if any.'''
+        from admission import AdmissionController
+        self.admission = AdmissionController()
+        self.admitted_requests = {} #Client socket -> IP address, for the admitted clients whose sessions have not been released yet
+        self.reuse_port = reuse_port
+        self.heartbeat = heartbeat
+        super().__init__(*args, **kwargs)
+
+    def server_bind(self):
+        if self.reuse_port:
+            self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+        super().server_bind()
+
+    def service_actions(self):
+        #Called by serve_forever() about every half second
+        if self.heartbeat is not None:
+            self.heartbeat()
+
+    def verify_request(self, request, client_address):
+        '''Only lets a client through if the session limits allow it. Rejected clients get a busy message.
+        The session is released by shutdown_request().'''
+        if self.admission.try_admit(client_address[0]):
+            self.admitted_requests[request] = client_address[0]
+            return True
+        from session import Session
+        #This runs on the thread that accepts all clients, so the message is only sent as far as it fits in the socket buffer right away
+        try:
+            request.setblocking(False)
+            request.send(Session.get_busy_frame())
+        except OSError:
+            pass
+        return False
+
+    def shutdown_request(self, request):
+        '''Closes the connection of a client and releases its session if it was admitted. socketserver calls this for every client:
+        when its session has ended, but also when its thread could not be started or its handler failed before it was set up.'''
+        ip = self.admitted_requests.pop(request, None)
+        if ip is not None:
+            self.admission.release(ip)
+        super().shutdown_request(request)
+
+def stop_on_signal(signal_number, frame):
+    '''Stops the server when SIGTERM is received, like Ctrl+C does, so that it can clean up (see run_server()).'''
+    logger.info(f"Received signal {signal_number}. Stopping...")
+    sys.exit(0)
+
+def run_server(host, port, reuse_port=False, heartbeat=None):
+    '''Runs the server in the configured server mode until it is stopped.
+
+    :param host: The host to run the server on.
+
+    :param port: The port to run the server on.
+
+    :param reuse_port: If True, several processes can run the server on the same port (see supervisor.py)
+
+    :param heartbeat: A function that is called regularly while the server is running, if any.'''
+    signal.signal(signal.SIGTERM, stop_on_signal)
+    try:
+        if SERVER_MODE == SERVER_MODE_ASYNCIO:
+            with startup.report.measure("import async_server"):
+                from async_server import AsyncTelnetServer
+            AsyncTelnetServer(host, port, reuse_port=reuse_port, heartbeat=heartbeat, on_listening=startup.start_prewarm).run()
+        else:
+            if SERVER_MODE != SERVER_MODE_THREADED:
+                logger.warning(f"Unknown server mode {SERVER_MODE}. Using the threaded server...")
+            with startup.report.measure("import handler"):
+                from handler import RequestHandler
+            with ThreadedTCPServer((host, port), RequestHandler, reuse_port=reuse_port, heartbeat=heartbeat) as server:
+                logger.info(f"Running Telnet server on {host}:{port} until close...")
+                startup.start_prewarm() #The heavy modules and the static scenes are loaded while clients can already connect
+                server.serve_forever()
+    finally:
+        from translation_pool import shutdown_translation_pool
+        shutdown_translation_pool() #Its worker processes would otherwise be left to the interpreter's exit
+
 if __name__ == "__main__":
     #Get server information
     SERVER_HOST = os.environ["TELNET_SERVER_HOST"]
@@ -21,6 +102,12 @@ if __name__ == "__main__":
     {SUPERBRAIN_LOGO_ASCII}
     Ohoy, my lovely friends! This is the superbrain octopus! My lovely ship is about to sail ashore out to the internet...
     """)
-    with ThreadedTCPServer((SERVER_HOST, SERVER_PORT), RequestHandler) as server:
-        logger.info(f"Running Telnet server on {SERVER_HOST}:{SERVER_PORT} until close...")
-        server.serve_forever()
\ No newline at end of file
+    if WORKERS > 1 and hasattr(os, "fork") and hasattr(socket, "SO_REUSEPORT"):
+        from supervisor import Supervisor
+        Supervisor(run_server, SERVER_HOST, SERVER_PORT, WORKERS).run()
+    else:
+        if WORKERS > 1:
+            logger.warning("Multiple workers are not supported on this platform. Running a single server...")
+        from metrics import start_exporter
+        start_exporter()
+        run_server(SERVER_HOST, SERVER_PORT)
@@ -0,0 +1,756 @@
+'''session.py
+Contains the logic for a single client session of the superbrain, independent of how the client is connected.
+Both the threaded server (see handler.py) and the asyncio server (see async_server.py) run their sessions through this.'''
+import logging, os, sys, time, threading, contextlib
+from urllib.parse import urlparse
+from concurrent.futures import ThreadPoolExecutor
+sys.path.append(".")
+from const import *
+import http_client
+from http_cache import response_cache
+from content_renderer.from_html.sourceloader import SourceLoader
+from telnet import TelnetConnection
+from frame_output import FrameDiffer, FrameWriter
+from content_renderer.from_html.decoding import SessionDecoder
+from metrics import FETCH_ERRORS, FETCH_SECONDS, KEYSTROKE_LATENCY_SECONDS, PAGE_LOADS, SKIPPED_FRAMES, SLOW_CLIENTS, RENDER_PROFILE_CHANGES
+from frame_cache import get_prototype_scene, get_shared_scene, get_cached_frame, get_scene_hash
+from refresher import Refresher
+from profiling import SessionProfiler, get_active_timings, is_profiling_allowed, measure_translation_step
+from tracing import TraceRecorder, record_loads, record as record_trace_event
+from history import History
+from translation_pool import TranslationError
+from render_profiles import CONFIGURED_PROFILE, SlowLinkDetector, get_profile_for_terminal_type, get_smaller_profile, is_compact
+
+_blocking_executor = None
+
+class SlowClientError(Exception):
+    '''Raised when a client has not received so much of its output that its session has to be closed (see MAX_PENDING_OUTPUT).'''
+
+def get_blocking_executor():
+    '''Returns the executor that is shared for blocking work (fetching and translating pages, posting forms).
+    The executor is created on first use and is bounded by SUPERBRAIN_BLOCKING_WORKERS workers.'''
+    global _blocking_executor
+    if _blocking_executor is None:
+        _blocking_executor = ThreadPoolExecutor(max_workers=BLOCKING_WORKERS, thread_name_prefix="superbrain-blocking")
+    return _blocking_executor
+
+_refresher = None
+_refresher_lock = threading.Lock()
+
+def get_refresher():
+    '''Returns the refresher that is shared by all sessions to update pages that have opted in to being refreshed.
+    The refresher is created on first use.'''
+    global _refresher
+    with _refresher_lock:
+        if _refresher is None:
+            _refresher = Refresher(Session.source_loader.load_source_content, get_translated_hash, get_blocking_executor())
+        return _refresher
+
+def get_translated_hash(source, content:str):
+    '''Translates content for the default screen size and returns a hash of the result (or None if it could not be translated).
+    Used by the refresher to only update sessions when a change to a page is visible. The page is translated as a shared page
+    (see frame_cache.py), so the sessions with the default screen size that apply it do not have to translate it again.'''
+    scene = get_shared_scene(Session.source_loader, source, content, DEFAULT_CLIENT_WIDTH, DEFAULT_CLIENT_HEIGHT, defer_requests=True,
+                             compact=is_compact(CONFIGURED_PROFILE or RENDER_PROFILE_COLOR))
+    return get_scene_hash(scene) if scene is not None else None
+
+def record_fetch(source, seconds, failed):
+    '''Adds a load of a source to the metrics and to the page timings that are being collected on the current thread, if any
+    (see SourceLoader).'''
+    origin = urlparse(source).netloc
+    FETCH_SECONDS.observe(seconds, "url" if origin != "" else "file")
+    if failed:
+        FETCH_ERRORS.inc(origin if origin != "" else "file")
+    timings = get_active_timings()
+    if timings is not None:
+        timings.fetch_seconds += seconds
+
+class Session:
+    '''Represents a session of a client that is connected to the superbrain.
+    The session holds the current scene and handles input, but does not read or write anything by itself.
+    Everything that blocks (loading sources and sending form data) is done in do_blocking_work() so
+    that the server running the session can decide where to run it.'''
+    logger = logging.getLogger(__name__)
+    source_loader = SourceLoader(
+        load_from_files=True,
+        load_from_urls=True,
+        trusted_directories=[HTML_CONTENT_DIRECTORY, WEBSITE_INDEX_HANDLER_DIRECTORY], #Only trust paths that are in the working directory
+        trusted_urls=[], #Trust all
+        fetch=http_client.get,
+        response_cache=response_cache, #Shared by all sessions (see http_cache.py)
+        record_event=record_trace_event,
+        on_fetch=record_fetch,
+        measure=measure_translation_step
+    )
+    post_form = http_client.post #Sends form data to websites (see Scene.send_pending_requests())
+
+    #Open a scene for reading
+    START_FILE = START_PAGE
+    ERROR_INFO_FILE = os.path.join(HTML_CONTENT_DIRECTORY, "error_occurred.html") #File to print from in case of an error
+    LOADING_FILE = os.path.join(HTML_CONTENT_DIRECTORY, "loading.html") #File to print from when content is loading
+    ROOT_ERROR_FILE = os.path.join(HTML_CONTENT_DIRECTORY, "root_error.html") #File to print from in case of an internal error
+    BUSY_FILE = os.path.join(HTML_CONTENT_DIRECTORY, "busy.html") #File to print from when the server does not accept more clients
+    busy_frame = None #The rendered busy frame (see build_busy_frame())
+
+    @staticmethod
+    def get_static_scene(source, width=DEFAULT_CLIENT_WIDTH, height=DEFAULT_CLIENT_HEIGHT, compact=False):
+        '''Gets a scene of a local file, for example one that is used when the server is processing stuff or has other things to tell the user.
+        These scenes are loaded once for every screen size (and again if the file changes) and are then shared between sessions,
+        so they must not be changed (see ensure_own_scene()).
+
+        :param source: The source of the scene, for example LOADING_FILE.
+
+        :param width: The width of the screen to load the scene for.
+
+        :param height: The height of the screen to load the scene for.
+
+        :param compact: Whether to load the scene without borders or padding (see the compact render profile).'''
+        return get_prototype_scene(Session.source_loader, source, width, height, defer_requests=True, compact=compact)
+
+    @staticmethod
+    def build_busy_frame():
+        '''Renders the frame that is sent to clients that are rejected because the server is busy. Called once by the prewarm
+        (see startup.py), so that rejecting a client never has to load a page, even when the server is under load.'''
+        if Session.busy_frame is None:
+            Session.busy_frame = get_cached_frame(Session.get_static_scene(Session.BUSY_FILE, DEFAULT_CLIENT_WIDTH, DEFAULT_CLIENT_HEIGHT)).full_output + b"\r\n"
+        return Session.busy_frame
+
+    @staticmethod
+    def get_busy_frame():
+        '''Returns the frame that is sent to clients that are rejected because the server is busy, as bytes.
+        Until the prewarm has rendered it (see build_busy_frame()), a plain busy message is returned instead.'''
+        return Session.busy_frame if Session.busy_frame is not None else BUSY_MESSAGE.encode()
+
+    def __init__(self, client_address=None):
+        '''Initializes a session.
+
+        :param client_address: The address of the connected client, if known. Only used for logging.'''
+        self.client_address = client_address
+        self.scene = None
+        self.current_loaded_source = None
+        self.requested_source = None #Set when the session itself (and not the scene) wants to change source
+        self.closed = False #Set to True when the client wants to close the connection
+        self.telnet = TelnetConnection(DEFAULT_CLIENT_WIDTH, DEFAULT_CLIENT_HEIGHT, offer_compression=MCCP_ENABLED)
+        self.line_buffer = bytearray() #Data received in line mode that has not been ended by a line break yet
+        self.held_keys_deadline = None #When to handle the keys that the Telnet connection has held back (see split_keys())
+        self.frame_writer = FrameWriter(FrameDiffer(DIFFERENTIAL_UPDATES))
+        self.decoder = SessionDecoder() #Remembers the encodings of the client's input and of loaded pages
+        self.start_time = time.monotonic()
+        self.last_input_time = self.start_time
+        self.unanswered_input_time = None #When input was received that has not been answered with a frame yet (for metrics)
+        self.refreshed_content = None #(source, content) of a newer version of the current page, set by the refresher
+        self.wake = None #Function that the server running the session sets to be woken up when the session has something new to draw
+        self.load_future = None #The page that is being loaded in the background, if any (see start_load())
+        self.load_start_time = None
+        self.frame_deferred = False #True if a frame has not been drawn because the client was behind (see defer_frame())
+        self.history = History() #The pages that the client can go back and forward to (see history.py)
+        self.history_entry = None #The page from the history that is being loaded again, because its scene has been forgotten
+        #Lets operators see timings and dump profiles of the session (see profiling.py)
+        self.profiler = SessionProfiler(f"{client_address[0]}-{client_address[1]}" if client_address else str(id(self))) if is_profiling_allowed(client_address) else None
+        self.trace = TraceRecorder.open_for_session(client_address) #Records the session to replay it (see tracing.py), if enabled
+        #Which terminal styles and borders the client gets (see render_profiles.py). Picked from the client's terminal type
+        #and connection unless a profile is configured for all clients
+        self.render_profile = RENDER_PROFILE_COLOR
+        self.slow_link_detector = SlowLinkDetector() if CONFIGURED_PROFILE is None else None
+        if CONFIGURED_PROFILE is not None:
+            self.set_render_profile(CONFIGURED_PROFILE)
+
+    @property
+    def width(self):
+        '''The width of the client's screen.'''
+        return self.telnet.width
+
+    @property
+    def height(self):
+        '''The height of the client's screen.'''
+        return self.telnet.height
+
+    @property
+    def compact_layout(self):
+        '''True if pages are broken down without borders or padding for the client (see the compact render profile).'''
+        return is_compact(self.render_profile)
+
+    @property
+    def negotiating(self):
+        '''True if the session is waiting for the client to answer Telnet negotiation.'''
+        return self.telnet.negotiating
+
+    def start(self):
+        '''Starts negotiating Telnet options with the client. The data to send for this is written by write_telnet_data().'''
+        self.telnet.start_negotiation()
+        if self.trace is not None:
+            self.trace.record("start", start_file=Session.START_FILE, differential_updates=DIFFERENTIAL_UPDATES, mccp_enabled=MCCP_ENABLED)
+
+    def write_telnet_data(self):
+        '''Writes any Telnet data (like answers to negotiation) that should be sent to the client to the session's frame writer.
+        Starts or stops compressing the output if the client has asked for it.'''
+        self.frame_writer.write(self.telnet.data_to_send())
+        if self.telnet.compressing and not self.frame_writer.compressing:
+            Session.logger.info(f"Compressing output for client {self.client_address}.")
+            self.frame_writer.start_compression(MCCP_COMPRESSION_LEVEL)
+            self.frame_writer.write(self.telnet.data_to_send()) #Anything after the start of compression
+        elif not self.telnet.compressing and self.frame_writer.compressing:
+            Session.logger.info(f"Client {self.client_address} stopped compression.")
+            self.frame_writer.stop_compression()
+
+    def load_scene(self, source):
+        '''Loads a source into a scene that fits the client's screen. Blocks while the source is being loaded.
+
+        :param source: The source to load.
+
+        :returns: The scene (or None if it could not be loaded) and the content it was translated from (None for local files).'''
+        if not Session.source_loader.is_url(source): #Local files are shared between sessions
+            return Session.get_static_scene(source, self.width, self.height, self.compact_layout), None
+        content = Session.source_loader.load_source_content(source, self.decoder)
+        if content is None:
+            Session.logger.warning(f"Got no content from {source}.")
+            return None, None
+        #Sessions that get the same content share the scene until they interact with it
+        return get_shared_scene(Session.source_loader, source, content, self.width, self.height, defer_requests=True, compact=self.compact_layout), content
+
+    def ensure_own_scene(self):
+        '''Makes sure that the current scene belongs to this session only, so that it can be changed.
+        Scenes that are shared between sessions (see load_scene()) are copied the first time that they are changed.'''
+        if self.scene.prototype_key is not None:
+            self.scene = self.scene.copy_for_session()
+
+    def update_scene(self, key, encoding=None):
+        '''Updates the current scene with a key that has been received from the client (see Scene.update())'''
+        self.ensure_own_scene()
+        self.scene.update(key, encoding=encoding)
+
+    def write_frame(self, scene=None):
+        '''Writes any Telnet data and the output needed to show a scene to the session's frame writer.
+        Only the parts of the screen that have changed since the last frame are included.
+
+        :param scene: The scene to show. If None, the current scene of the session is shown.'''
+        if scene is None:
+            scene = self.scene
+        self.write_telnet_data()
+        self.frame_deferred = False
+        start_time = time.perf_counter()
+        frame_output = self.frame_writer.write_frame(scene)
+        if self.profiler is not None:
+            self.profiler.end_frame(time.perf_counter() - start_time, len(frame_output))
+            if self.profiler.overlay_shown:
+                self.frame_writer.write_overlay(self.profiler.get_overlay_lines(self.frame_writer.sent_bytes), self.width)
+        if self.unanswered_input_time is not None:
+            KEYSTROKE_LATENCY_SECONDS.observe(time.perf_counter() - self.unanswered_input_time)
+            self.unanswered_input_time = None
+        if self.trace is not None:
+            self.trace.record_frame(frame_output)
+
+    def defer_frame(self):
+        '''Called instead of write_frame() when the client has not received the output of the last frame yet.
+        The server draws a frame again once the client has caught up, and only the newest one, so that clients on slow
+        connections skip frames instead of getting more and more behind. Telnet data is still written.'''
+        self.write_telnet_data()
+        self.frame_deferred = True
+        SKIPPED_FRAMES.inc()
+        if self.slow_link_detector is not None and self.slow_link_detector.add_skipped_frame(): #Send less for every frame
+            smaller_profile = get_smaller_profile(self.render_profile)
+            if smaller_profile is not None:
+                self.set_render_profile(smaller_profile, "slow_link")
+
+    def set_render_profile(self, render_profile, reason=None):
+        '''Changes the render profile of the session (see render_profiles.py). The whole screen is redrawn with the next frame,
+        and the current page is broken down again if buttons and text boxes get or lose their borders.
+
+        :param render_profile: The render profile.
+
+        :param reason: Why the profile is changed (terminal_type or slow_link), or None if it is configured.'''
+        if render_profile == self.render_profile:
+            return
+        layout_changed = is_compact(render_profile) != self.compact_layout
+        self.render_profile = render_profile
+        self.frame_writer.set_render_profile(render_profile)
+        if reason is not None:
+            Session.logger.info(f"Changed the render profile of client {self.client_address} to {render_profile} ({reason}).")
+            RENDER_PROFILE_CHANGES.inc(render_profile, reason)
+        if layout_changed and self.current_loaded_source != None and not self.load_in_progress: #Otherwise, the loaded page is broken down again when it is done
+            self.requested_source = self.current_loaded_source
+
+    def check_pending_output(self, pending_bytes):
+        '''Raises SlowClientError if the client is so far behind that the session has to be closed.
+
+        :param pending_bytes: Number of bytes of output that the client has not received yet.'''
+        if MAX_PENDING_OUTPUT > 0 and pending_bytes > MAX_PENDING_OUTPUT:
+            SLOW_CLIENTS.inc()
+            raise SlowClientError(f"The client has not received {pending_bytes} bytes of output.")
+
+    def get_loading_scene(self):
+        '''Returns the scene that is shown while the session is loading something.'''
+        return Session.get_static_scene(Session.LOADING_FILE, self.width, self.height, self.compact_layout)
+
+    def load_start_scene(self):
+        '''Loads the start file into the session. Blocks while the file is being loaded.'''
+        if self.trace is not None: #Everything received before this was Telnet negotiation
+            self.trace.record("ready", width=self.width, height=self.height)
+        with self.profile_load(Session.START_FILE), record_loads(self.trace):
+            self.scene, content = self.load_scene(Session.START_FILE)
+        if self.profiler is not None:
+            self.profiler.finish_load()
+        if self.scene == None:
+            Session.logger.critical("Failed to load start file! An error will be returned.")
+            self.scene = Session.get_static_scene(Session.ROOT_ERROR_FILE, self.width, self.height, self.compact_layout)
+            self.current_loaded_source = Session.ROOT_ERROR_FILE
+        else:
+            self.current_loaded_source = Session.START_FILE
+        self.update_refresh_watch(content)
+
+    def get_timeout(self):
+        '''Returns the max number of seconds to wait for input from the client before the session has to be closed
+        (because of the idle timeout or the max session lifetime), or None if the session never times out.'''
+        now = time.monotonic()
+        timeouts = []
+        if IDLE_TIMEOUT > 0:
+            timeouts.append(self.last_input_time + IDLE_TIMEOUT - now)
+        if MAX_SESSION_LIFETIME > 0:
+            timeouts.append(self.start_time + MAX_SESSION_LIFETIME - now)
+        return max(min(timeouts), 0.01) if len(timeouts) > 0 else None #A timeout of 0 would make sockets non-blocking instead
+
+    def get_timeout_reason(self):
+        '''Returns why the session has timed out (as a string to log), or None if it has not.'''
+        now = time.monotonic()
+        if MAX_SESSION_LIFETIME > 0 and now - self.start_time >= MAX_SESSION_LIFETIME:
+            return f"The session has been open for longer than {MAX_SESSION_LIFETIME} seconds."
+        if IDLE_TIMEOUT > 0 and now - self.last_input_time >= IDLE_TIMEOUT:
+            return f"The client has not sent anything for {IDLE_TIMEOUT} seconds."
+        return None
+
+    def needs_blocking_work(self):
+        '''Returns True if the session has to call do_blocking_work() before the next frame can be drawn.'''
+        return self.is_loading() or self.refreshed_content != None
+
+    def is_loading(self):
+        '''Returns True if the session has to load something (or send form data) before the next frame can be drawn,
+        which means that the loading screen should be shown.'''
+        return self.load_future != None or self.requested_source != None or self.current_loaded_source != self.scene.source or self.scene.force_reload or len(self.scene.pending_requests) > 0
+
+    @property
+    def load_in_progress(self):
+        '''True if a page is being loaded in the background (see start_load()).'''
+        return self.load_future != None
+
+    def on_source_refreshed(self, source, content):
+        '''Called by the refresher (from another thread) when a page that the session is watching has changed.
+
+        :param source: The source of the page.
+
+        :param content: The new content of the page.'''
+        self.refreshed_content = (source, content)
+        if self.wake is not None:
+            self.wake()
+
+    def update_refresh_watch(self, content=None):
+        '''Starts watching the current page for changes if it has opted in to being refreshed, or stops watching otherwise.
+
+        :param content: The content that the current page has just been loaded from, if known (see Refresher.watch()).'''
+        if self.scene.periodically_update_every > 0 and not self.closed:
+            get_refresher().watch(self, self.current_loaded_source, self.scene.periodically_update_every, content)
+        elif _refresher is not None:
+            _refresher.unwatch(self)
+
+    def close(self):
+        '''Cleans up after the session when the client has disconnected.'''
+        self.closed = True
+        self.cancel_load()
+        if self.profiler is not None:
+            self.profiler.stop()
+        if self.trace is not None:
+            self.trace.close()
+        if _refresher is not None:
+            _refresher.unwatch(self)
+
+    def apply_refreshed_content(self):
+        '''Replaces the current scene with a newer version of the same page, keeping what the user has done in it.'''
+        source, content = self.refreshed_content
+        self.refreshed_content = None
+        if source != self.current_loaded_source: #The user has moved on to another page
+            return
+        if self.trace is not None:
+            self.trace.record("refresh", source=source, content=content)
+        #Every session watching the page gets the new version at once, so they share its translation (see get_shared_scene())
+        try:
+            scene = get_shared_scene(Session.source_loader, source, content, self.width, self.height, raise_translation_errors=True,
+                                     defer_requests=True, compact=self.compact_layout)
+        except TranslationError as e: #Like when the pool is full because many pages are refreshed at once
+            Session.logger.info(f"Could not translate refreshed content of {source} yet (the error {e} occurred). Trying again on the next check.")
+            get_refresher().update_later(self, source)
+            return
+        if scene is None:
+            Session.logger.warning(f"Failed to translate refreshed content of {source}.")
+            return
+        scene = scene.copy_for_session()
+        scene.copy_state_from(self.scene)
+        self.scene = scene
+        Session.logger.debug(f"Updated scene with refreshed content of {source}.")
+
+    def do_blocking_work(self):
+        '''Does the work that has to be done before the next frame can be drawn (see needs_blocking_work()), other than loading pages
+        (see start_load()). Right now, that is updating the current page with a refreshed version of it.
+        This blocks for a short while (to translate the page) and should not be run on a thread that serves many sessions.'''
+        if self.refreshed_content != None and not self.is_loading():
+            self.apply_refreshed_content()
+
+    def start_load(self):
+        '''Starts sending any pending form data and loading the source that the session has changed to in the blocking executor.
+        The load does not change the session, so the session can keep handling input (see receive_while_loading()) and can stop
+        waiting for the load at any time. update_load() has to be called regularly (and when the session is woken up) until it is done.'''
+        self.refreshed_content = None #Whatever is loaded next is newer
+        Session.logger.info("Updating scene to new source.")
+        self.add_to_history(self.requested_source if self.requested_source != None else self.scene.source)
+        self.load_start_time = time.monotonic()
+        self.load_future = get_blocking_executor().submit(self.load, self.scene, self.requested_source)
+        self.requested_source = None
+        wake = self.wake
+        if wake is not None:
+            self.load_future.add_done_callback(lambda future: wake())
+
+    def add_to_history(self, next_source):
+        '''Adds the current page to the history when the session is changing to another page (see history.py). Nothing is added
+        when the same page is loaded again (for example for a new screen size), or when the session is going through the history.
+
+        :param next_source: The source that the session is changing to.'''
+        if self.history_entry is not None or not self.is_page_in_history():
+            return
+        if self.scene.source == Session.LOADING_FILE: #A load has been cancelled. The page was added when that load started
+            return
+        sending_form_data = len(self.scene.pending_requests) > 0
+        if next_source == self.current_loaded_source and not sending_form_data:
+            return
+        #A scene that form data is sent from is changed while the data is sent, so it is loaded again when it is gone back to
+        self.history.add(self.current_loaded_source, self.scene, keep_scene=not sending_form_data)
+
+    def is_page_in_history(self):
+        '''Returns True if the current page can be added to the history. Error and loading screens are left out.'''
+        return self.current_loaded_source not in [None, Session.LOADING_FILE, Session.ERROR_INFO_FILE, Session.ROOT_ERROR_FILE]
+
+    def go_through_history(self, key):
+        '''Goes back (Ctrl+B) or forward (Ctrl+F) in the history. Pages that are still in the history are shown right away,
+        and other pages are loaded again.
+
+        :param key: The key that was pressed.'''
+        source = self.current_loaded_source if self.is_page_in_history() else None
+        if key == KEY_COMBINATION_CTRL_B:
+            entry = self.history.go_back(source, self.scene)
+        else:
+            entry = self.history.go_forward(source, self.scene)
+        if entry is None:
+            Session.logger.debug("There is no page to go to in the history.")
+            return
+        if entry.scene is not None and (entry.scene.width, entry.scene.height, entry.scene.compact) == (self.width, self.height, self.compact_layout):
+            Session.logger.info(f"Showing {entry.source} from the history.")
+            scene = entry.scene
+            if scene.prototype_key is None: #The scene might have been changed when it was left, for example by following a link
+                scene.source = entry.source
+                scene.force_reload = False
+            self.scene = scene
+            self.current_loaded_source = entry.source
+            if self.profiler is not None:
+                self.profiler.page_timings = None
+            PAGE_LOADS.inc("from_history")
+            self.update_refresh_watch()
+        else: #The scene has been forgotten or is for another screen size or render profile
+            Session.logger.info(f"Loading {entry.source} from the history again.")
+            self.history_entry = entry
+            self.requested_source = entry.source
+
+    def load(self, scene, requested_source):
+        '''Sends the pending form data of a scene and loads the next source. Runs in the blocking executor and blocks.
+        Does not change the session, since the session might have stopped waiting for it.
+
+        :param scene: The scene that the session is leaving. It must not be shared with other sessions, since sending form data changes it.
+
+        :param requested_source: The source that the session wants to change to, or None to load the source of the scene.
+
+        :returns: The loaded scene (or None if it could not be loaded) and the content it was loaded from (see load_scene()).'''
+        with record_loads(self.trace):
+            if len(scene.pending_requests) > 0:
+                scene.send_pending_requests(Session.post_form, record_trace_event)
+            source = requested_source if requested_source != None else scene.source
+            Session.logger.info(f"Loading source from {source}")
+            with self.profile_load(source):
+                return self.load_scene(source)
+
+    def profile_load(self, source):
+        '''Returns a context manager that collects timings for loading a source if the session is being profiled.'''
+        return self.profiler.profile_load(source) if self.profiler is not None else contextlib.nullcontext()
+
+    def update_load(self):
+        '''Finishes the load in progress if it is done, or gives up on it if it has taken longer than LOAD_TIMEOUT seconds.'''
+        if self.load_future == None:
+            return
+        if self.load_future.done():
+            self.finish_load()
+        elif LOAD_TIMEOUT > 0 and time.monotonic() - self.load_start_time >= LOAD_TIMEOUT:
+            Session.logger.warning(f"Loading took longer than {LOAD_TIMEOUT} seconds. Displaying error...")
+            PAGE_LOADS.inc("timed_out")
+            self.load_future.cancel() #Does nothing if it has already started. It is then left to finish on its own
+            self.load_future = None
+            self.history_entry = None
+            self.show_error()
+
+    def finish_load(self):
+        '''Shows the page that has been loaded in the background, or an error if it failed.'''
+        load_future = self.load_future
+        self.load_future = None
+        history_entry, self.history_entry = self.history_entry, None
+        try:
+            scene, content = load_future.result()
+            if scene == None:
+                raise Exception("Scene failed to be loaded.")
+            self.scene = scene
+            self.current_loaded_source = self.scene.source
+            if history_entry is not None and history_entry.scroll_position > 0: #Scroll to where the user was on the page
+                self.ensure_own_scene()
+                self.scene.current_scroll_position = min(history_entry.scroll_position, self.scene.total_content_height)
+            if self.profiler is not None:
+                self.profiler.finish_load()
+            PAGE_LOADS.inc("loaded")
+            Session.logger.info("New scene loaded.")
+            self.update_refresh_watch(content)
+            if self.scene.compact != self.compact_layout: #The render profile has changed while loading
+                self.requested_source = self.current_loaded_source
+        except Exception as e:
+            Session.logger.warning(f"Failed to load new file (the error {e} occurred). Displaying error...", exc_info=True)
+            PAGE_LOADS.inc("failed")
+            self.show_error()
+        self.handle_size_change() #In case the client was resized while loading
+
+    def cancel_load(self):
+        '''Stops waiting for the load in progress. It is left to finish on its own in the background, and its result is thrown away.'''
+        if self.load_future == None:
+            return
+        Session.logger.info("Cancelling load.")
+        PAGE_LOADS.inc("cancelled")
+        self.load_future.cancel()
+        self.load_future = None
+        self.history_entry = None
+        #The scene that was being left might still have form data to send, which must not be sent again
+        self.scene = self.get_loading_scene()
+
+    def show_error(self):
+        '''Shows the page that tells the user that a page could not be loaded.'''
+        self.scene = Session.get_static_scene(Session.ERROR_INFO_FILE, self.width, self.height, self.compact_layout)
+        self.current_loaded_source = Session.ERROR_INFO_FILE
+        self.update_refresh_watch()
+
+    def write_loading_status(self):
+        '''Writes a line at the bottom of the screen that shows how long the current load has taken, animated so that the user
+        can see that something is happening.'''
+        elapsed_time = time.monotonic() - self.load_start_time
+        spinner = LOADING_SPINNER[int(elapsed_time / LOADING_ANIMATION_INTERVAL) % len(LOADING_SPINNER)]
+        self.write_telnet_data()
+        self.frame_writer.write_status_line(f"{spinner} Loading... {int(elapsed_time)} s (Ctrl+C to cancel)"[:self.width-1], self.height)
+
+    def handle_size_change(self):
+        '''Redraws the screen and translates the current page again if the client's screen has been resized.'''
+        if not self.telnet.size_changed:
+            return
+        self.telnet.size_changed = False
+        Session.logger.info(f"Client screen size changed to {self.width}x{self.height}.")
+        self.frame_writer.differ.reset() #The client has probably moved things around on the screen
+        if self.current_loaded_source != None:
+            self.requested_source = self.current_loaded_source #Translate the current source again for the new size
+
+    def handle_terminal_type(self):
+        '''Picks the render profile that fits the terminal type of the client when the client has sent it, unless a profile is configured.'''
+        if not self.telnet.terminal_type_changed:
+            return
+        self.telnet.terminal_type_changed = False
+        Session.logger.info(f"Client {self.client_address} has the terminal type {self.telnet.terminal_type}.")
+        if CONFIGURED_PROFILE is None:
+            self.set_render_profile(get_profile_for_terminal_type(self.telnet.terminal_type), "terminal_type")
+
+    def receive_while_loading(self, data:bytes):
+        '''Handles data that has been received from the client while a page is being loaded in the background.
+        Only the keys that cancel the load (Ctrl+C) or close the session (escape and Ctrl+Q) are handled.
+        Other keys are ignored, since the page that they were meant for is being replaced.
+
+        :param data: The received data, including any Telnet commands.'''
+        self.last_input_time = time.monotonic()
+        if self.trace is not None:
+            self.trace.record_input(data, while_loading=True)
+        received_data = self.telnet.feed(data) #Screen size changes are handled when the load is done
+        if self.telnet.interrupted:
+            self.telnet.interrupted = False
+            received_data = KEY_COMBINATION_CTRL_C.encode() + received_data
+        self.handle_keys_while_loading(self.split_keys(received_data))
+
+    def handle_keys_while_loading(self, keys):
+        '''Handles keys that have been received from the client while a page is being loaded (see receive_while_loading()).'''
+        if KEY_ESCAPE.encode() in keys or KEY_COMBINATION_CTRL_Q.encode() in keys:
+            Session.logger.info("Received escape key while loading. Closing connection....")
+            self.cancel_load()
+            self.closed = True
+        elif KEY_COMBINATION_CTRL_C.encode() in keys:
+            Session.logger.info("Found Ctrl+C while loading. Resetting scene...")
+            self.cancel_load()
+            self.requested_source = Session.START_FILE
+        elif len(keys) > 0:
+            Session.logger.debug(f"Ignoring input while loading: {keys}")
+
+    def split_keys(self, received_data:bytes):
+        '''Splits received data into keys. The start of an escape sequence at the end of the data is held back until the rest
+        of it comes, or until ESCAPE_KEY_TIMEOUT seconds have passed (see handle_held_keys()).'''
+        keys = self.telnet.split_keys(received_data)
+        self.held_keys_deadline = time.monotonic() + ESCAPE_KEY_TIMEOUT if len(self.telnet.held_keys) > 0 else None
+        return keys
+
+    def get_wait_timeout(self, timeout):
+        '''Returns the max number of seconds to wait for input from the client, so that held back keys are handled in time (see handle_held_keys()).
+
+        :param timeout: The max number of seconds that the server would wait otherwise, or None to wait forever.'''
+        if self.held_keys_deadline is None:
+            return timeout
+        held_keys_timeout = max(self.held_keys_deadline - time.monotonic(), 0.01)
+        return held_keys_timeout if timeout is None else min(timeout, held_keys_timeout)
+
+    def handle_held_keys(self, wait=True):
+        '''Handles the keys that have been held back because they might have been the start of an escape sequence (like a lone escape),
+        once ESCAPE_KEY_TIMEOUT seconds have passed without the rest of the sequence. Should be called when waiting for input has timed out.
+
+        :param wait: If False, the keys are handled right away.'''
+        if self.held_keys_deadline is None or (wait and time.monotonic() < self.held_keys_deadline):
+            return
+        self.held_keys_deadline = None
+        keys = self.telnet.flush_keys()
+        if self.load_in_progress:
+            self.handle_keys_while_loading(keys)
+        elif self.scene != None:
+            self.handle_keys(keys)
+
+    def receive(self, data:bytes):
+        '''Handles data that has been received from the client.
+
+        :param data: The received data, including any Telnet commands.'''
+        self.last_input_time = time.monotonic()
+        if self.trace is not None:
+            self.trace.record_input(data)
+        if self.unanswered_input_time is None:
+            self.unanswered_input_time = time.perf_counter()
+        if self.profiler is not None:
+            self.profiler.start_frame()
+        received_data = self.telnet.feed(data)
+        self.handle_size_change()
+        self.handle_terminal_type()
+        if self.telnet.interrupted: #Clients might send Ctrl+C as a Telnet interrupt
+            self.telnet.interrupted = False
+            received_data = KEY_COMBINATION_CTRL_C.encode() + received_data
+        if len(received_data) == 0 or self.scene == None:
+            return
+        if self.telnet.character_mode:
+            self.handle_keys(self.split_keys(received_data))
+        else:
+            #Lines might be ended by "\r\n", "\r" or "\n"
+            self.line_buffer.extend(received_data.replace(b"\r\n", b"\n").replace(b"\r", b"\n"))
+            while b"\n" in self.line_buffer and not self.closed:
+                line_end = self.line_buffer.index(b"\n")
+                line = bytes(self.line_buffer[:line_end])
+                del self.line_buffer[:line_end+1]
+                self.handle_line(line)
+
+    def decode_input(self, encoded_data:bytes, final:bool=False):
+        '''Decodes input that has been received from the client (see SessionDecoder.decode_input()).
+
+        :returns: A tuple: (decoded data, detected encoding)'''
+        return self.decoder.decode_input(encoded_data, final)
+
+    def handle_keys(self, keys):
+        '''Handles keys that have been received from the client in character mode.
+
+        :param keys: The received keys (see split_keys() in telnet.py)'''
+        typed_text = [] #Text and backspaces that have been typed in a row, which are applied to the scene at once
+        for key in keys:
+            is_backspace = key in [KEY_BACKSPACE.encode(), KEY_BACKSPACE_ALTERNATIVE.encode()]
+            if key[0] >= ord(" ") and not key.startswith(KEY_ESCAPE.encode()) and not is_backspace:
+                received_data, data_encoding = self.decode_input(key)
+                Session.logger.info(f"Received text: {received_data} (encoding: {data_encoding}).")
+                typed_text.append(received_data)
+                continue
+            flushed_text, _ = self.decoder.flush_input() #Any other key ends a character that has been split between reads
+            if flushed_text != "":
+                typed_text.append(flushed_text)
+            if is_backspace:
+                typed_text.append(key.decode())
+                continue
+            self.update_scene_with_text(typed_text)
+            if self.closed or self.needs_blocking_work():
+                return
+            if self.profiler is not None and key in [KEY_COMBINATION_CTRL_P.encode(), KEY_COMBINATION_CTRL_O.encode()]:
+                self.handle_profiling_key(key.decode())
+            elif key == KEY_COMBINATION_CTRL_C.encode(): #Change source on Ctrl+C
+                Session.logger.info("Found Ctrl+C. Resetting scene...")
+                self.requested_source = Session.START_FILE #Reset source to the original landing page.
+            elif key in [KEY_COMBINATION_CTRL_B.encode(), KEY_COMBINATION_CTRL_F.encode()]: #Go back or forward on Ctrl+B and Ctrl+F
+                self.go_through_history(key.decode())
+            elif key == KEY_ESCAPE.encode() or key == KEY_COMBINATION_CTRL_Q.encode(): #Close connection on escape or Ctrl + Q
+                Session.logger.info("Received escape key. Closing connection....")
+                self.closed = True
+            elif key == KEY_ENTER.encode():
+                self.update_scene(KEY_ENTER)
+            elif key in ARROW_KEYS_REVERSED:
+                self.update_scene(key)
+            else:
+                Session.logger.debug(f"Ignoring unknown key {key}.")
+            if self.closed or self.needs_blocking_work(): #The rest of the keys were meant for the current scene
+                return
+        self.update_scene_with_text(typed_text)
+
+    def update_scene_with_text(self, typed_text:list):
+        '''Updates the current scene with text that has been typed in a row, all at once. That way, pasting a long text
+        into a text box takes one pass over the scene instead of one for every character.
+
+        :param typed_text: The typed text and backspaces, as strings. Emptied afterwards.'''
+        if len(typed_text) > 0:
+            self.update_scene("".join(typed_text))
+            typed_text.clear()
+
+    def handle_profiling_key(self, key):
+        '''Handles the keys that operators use to profile the session: Ctrl+P shows or hides the overlay, and Ctrl+O dumps the profile.'''
+        if key == KEY_COMBINATION_CTRL_P:
+            self.profiler.toggle_overlay()
+        else:
+            try:
+                self.profiler.dump()
+            except OSError as e:
+                Session.logger.warning(f"Failed to dump profile (the error {e} occurred).")
+
+    def handle_line(self, encoded_data):
+        '''Handles a line of input that has been received from the client in line mode.
+
+        :param encoded_data: The received line, as bytes.'''
+        encoded_data = encoded_data.strip()
+        received_data, data_encoding = self.decode_input(encoded_data, final=True)
+        Session.logger.info(f"Received data: {received_data} (length {len(received_data)}, encoding: {data_encoding}) (unencoded: {encoded_data}).")
+        if received_data == "":  # Translate to enter key
+            Session.logger.info("Translated empty data to enter key.")
+            encoded_data = KEY_ENTER
+        if KEY_COMBINATION_CTRL_C in received_data: #Change source on Ctrl+C
+            Session.logger.info("Found Ctrl+C. Resetting scene...")
+            self.requested_source = Session.START_FILE #Reset source to the original landing page. (the scene might be shared, so it is not changed)
+            return
+        if self.profiler is not None and received_data in [KEY_COMBINATION_CTRL_P, KEY_COMBINATION_CTRL_O]:
+            self.handle_profiling_key(received_data)
+            return
+        if received_data in [KEY_COMBINATION_CTRL_B, KEY_COMBINATION_CTRL_F]:
+            self.go_through_history(received_data)
+            return
+        if KEY_ESCAPE == received_data or KEY_COMBINATION_CTRL_Q in received_data: #Close connection on escape or Ctrl + Q
+            Session.logger.info("Received escape key. Closing connection....")
+            self.closed = True
+            return
+        if len(encoded_data.split()) != 0: #Split encoded data if we can
+            encoded_data = encoded_data.split()
+        typed_text = []
+        for received_key in encoded_data:
+            #Update image according to client input
+            if received_key in ARROW_KEYS_REVERSED or received_key == KEY_ENTER:
+                self.update_scene_with_text(typed_text)
+                self.update_scene(received_key, encoding=data_encoding)
+            else: #Every other part of the line is typed text. Parts with other control characters than backspaces are left out, like text boxes would
+                decoded_key = received_key.decode(data_encoding) if type(received_key) == bytes else received_key
+                if decoded_key.isprintable() or decoded_key in [KEY_BACKSPACE, KEY_BACKSPACE_ALTERNATIVE]:
+                    typed_text.append(decoded_key)
+        self.update_scene_with_text(typed_text)
@@ -0,0 +1,90 @@
+'''startup.py
+Gets the superbrain listening quickly after a (re)start. The heavy modules (like bs4, cssutils and requests) are only imported
+when a page is first fetched or translated, and the scenes of the start page and the loading and error screens are loaded when
+they are first shown, so the server can bind its port right away. Once it is listening, the prewarm runs in the background:
+it imports the heavy modules and loads the static scenes, so that the first clients do not have to wait for them.
+How long every import and every prewarmed scene took is logged as a startup report.'''
+import contextlib, importlib, logging, os, sys, threading, time
+from concurrent.futures import ThreadPoolExecutor
+sys.path.append(".")
+from const import *
+
+logger = logging.getLogger(__name__)
+START_TIME = time.perf_counter() #When the server started (this module is imported first by server.py)
+#Modules that take long to import, in the order they are imported in by the prewarm
+PREWARM_MODULES = ["charset_normalizer", "requests", "lxml.etree", "bs4", "cssutils", "content_renderer.from_html.format_translator"]
+
+class StartupReport:
+    '''How long the steps of the startup (imports and prewarmed scenes) took. Can be used from several threads at the same time.'''
+    def __init__(self):
+        self.steps = [] #(name, seconds)
+        self.listening_seconds = None #Seconds from the start until the server was listening
+        self.lock = threading.Lock()
+
+    @contextlib.contextmanager
+    def measure(self, name):
+        '''Measures how long the code in the context manager takes as a step of the startup.
+
+        :param name: The name of the step, like "import bs4". Steps that fail are not added to the report.'''
+        start_time = time.perf_counter()
+        yield
+        with self.lock:
+            self.steps.append((name, time.perf_counter() - start_time))
+
+    def set_listening(self):
+        '''Remembers that the server is listening now.'''
+        self.listening_seconds = time.perf_counter() - START_TIME
+
+    def format(self):
+        '''Returns the report as text.'''
+        with self.lock:
+            steps = list(self.steps)
+        lines = [f"Listening after {self.listening_seconds * 1000:.1f} ms." if self.listening_seconds is not None else "Not listening yet."]
+        lines += [f"{name}: {seconds * 1000:.1f} ms" for name, seconds in steps]
+        lines.append(f"Ready after {(time.perf_counter() - START_TIME) * 1000:.1f} ms.")
+        return "\n".join(lines)
+
+report = StartupReport()
+
+def import_module(name):
+    '''Imports a module as a step of the startup. Modules that are not installed are left out.'''
+    try:
+        with report.measure(f"import {name}"):
+            importlib.import_module(name)
+    except ImportError:
+        logger.debug(f"Not prewarming {name} since it is not installed.")
+
+def prewarm_scene(name, function):
+    '''Loads a static scene (or frame) as a step of the startup. Errors are logged, since the scene is loaded again when it is first shown.'''
+    try:
+        with report.measure(f"prewarm {name}"):
+            function()
+    except Exception as e:
+        logger.warning(f"Failed prewarming {name} (the exception {e} occurred).", exc_info=True)
+
+def prewarm():
+    '''Imports the heavy modules and then loads the static scenes and their first frames in parallel. Blocks.'''
+    from frame_cache import get_cached_frame
+    from render_profiles import CONFIGURED_PROFILE, is_compact
+    from session import Session
+    for module_name in PREWARM_MODULES:
+        import_module(module_name)
+    profile = CONFIGURED_PROFILE or RENDER_PROFILE_COLOR
+    def load_static_scene(source):
+        get_cached_frame(Session.get_static_scene(source, DEFAULT_CLIENT_WIDTH, DEFAULT_CLIENT_HEIGHT, is_compact(profile)), profile)
+    static_sources = [source for source in [Session.START_FILE, Session.LOADING_FILE, Session.ERROR_INFO_FILE, Session.ROOT_ERROR_FILE]
+                      if not Session.source_loader.is_url(source)] #The start page might be a website, which is loaded for every session
+    with ThreadPoolExecutor(max_workers=len(static_sources) + 1, thread_name_prefix="superbrain-prewarm") as executor:
+        for source in static_sources:
+            executor.submit(prewarm_scene, os.path.basename(source), lambda source=source: load_static_scene(source))
+        executor.submit(prewarm_scene, "busy frame", Session.build_busy_frame)
+    logger.info(f"Startup report:\n{report.format()}")
+
+def start_prewarm():
+    '''Remembers that the server is listening and starts the prewarm on a background thread (see prewarm()).
+
+    :returns: The thread.'''
+    report.set_listening()
+    thread = threading.Thread(target=prewarm, name="superbrain-prewarm", daemon=True)
+    thread.start()
+    return thread
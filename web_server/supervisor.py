@@ -0,0 +1,140 @@
+'''supervisor.py
+Runs the superbrain as several worker processes, so that translating and rendering pages can use more than one CPU core.
+Every worker runs its own server on the same port (using SO_REUSEPORT), and the operating system spreads
+new connections between them. The supervisor restarts workers that crash or stop responding.'''
+import logging, multiprocessing, signal, sys, time
+sys.path.append(".")
+from const import *
+
+logger = logging.getLogger(__name__)
+
+def run_worker(run_server, worker_index, host, port, heartbeat):
+    '''Runs the server in a worker process.
+
+    :param run_server: The function that runs the server (see run_server() in server.py)
+
+    :param worker_index: The index of the worker.
+
+    :param host: The host to run the server on.
+
+    :param port: The port to run the server on.
+
+    :param heartbeat: A shared value that the worker regularly sets to the current time to show that it is healthy.'''
+    signal.signal(signal.SIGTERM, signal.SIG_DFL) #Do not use the signal handler of the supervisor (run_server() sets its own)
+    def beat():
+        heartbeat.value = time.monotonic()
+    beat()
+    from metrics import start_exporter
+    start_exporter(worker_index)
+    run_server(host, port, reuse_port=True, heartbeat=beat)
+
+class Worker:
+    '''A worker process that is run by the supervisor.'''
+    def __init__(self, index):
+        '''Initializes a worker.
+
+        :param index: The number of the worker. Only used for logging.'''
+        self.index = index
+        self.process = None
+        self.heartbeat = multiprocessing.Value("d", 0, lock=False) #Monotonic time of the last heartbeat from the worker
+        self.restarts = 0
+        self.restart_at = 0 #When the worker can be started again after it has crashed
+
+    @property
+    def alive(self):
+        '''True if the worker process is running.'''
+        return self.process is not None and self.process.is_alive()
+
+    @property
+    def responding(self):
+        '''True if the worker process has sent a heartbeat recently.'''
+        return time.monotonic() - self.heartbeat.value < WORKER_HEARTBEAT_TIMEOUT
+
+    def stop(self):
+        '''Stops the worker process. Kills it if it does not stop on its own.'''
+        if self.process is None:
+            return
+        if self.process.is_alive():
+            self.process.terminate()
+            self.process.join(WORKER_STOP_TIMEOUT)
+            if self.process.is_alive():
+                logger.warning(f"Worker {self.index} did not stop. Killing it...")
+                self.process.kill()
+        self.process.join()
+        self.process.close()
+        self.process = None
+
+class Supervisor:
+    '''Starts worker processes and keeps them running.'''
+    def __init__(self, run_server, host, port, worker_count=WORKERS):
+        '''Initializes the supervisor.
+
+        :param run_server: The function that runs the server in a worker (see run_server() in server.py).
+        It has to accept reuse_port and heartbeat keyword arguments.
+
+        :param host: The host to run the server on.
+
+        :param port: The port to run the server on.
+
+        :param worker_count: The number of worker processes to run.'''
+        self.run_server = run_server
+        self.host = host
+        self.port = port
+        self.workers = [Worker(index) for index in range(worker_count)]
+        self.stopping = False
+        #Workers are forked so that they start right away. Every worker loads the static scenes itself once it is listening (see startup.py)
+        self.context = multiprocessing.get_context("fork")
+
+    def start_worker(self, worker:Worker):
+        '''Starts (or restarts) the process of a worker.'''
+        worker.heartbeat.value = time.monotonic() #Give the worker time to start before it has to send heartbeats
+        worker.process = self.context.Process(
+            target=run_worker,
+            args=(self.run_server, worker.index, self.host, self.port, worker.heartbeat),
+            name=f"superbrain-worker-{worker.index}"
+        )
+        worker.process.start()
+        logger.info(f"Started worker {worker.index} (PID {worker.process.pid}).")
+
+    def check_workers(self):
+        '''Restarts workers that have crashed or stopped sending heartbeats.'''
+        for worker in self.workers:
+            if worker.alive and worker.responding:
+                continue
+            if worker.process is not None: #The worker has crashed or hangs. Schedule a restart
+                if worker.alive:
+                    logger.error(f"Worker {worker.index} has not sent a heartbeat for {WORKER_HEARTBEAT_TIMEOUT} seconds. Restarting it...")
+                else:
+                    logger.error(f"Worker {worker.index} exited with code {worker.process.exitcode}. Restarting it...")
+                worker.stop()
+                worker.restarts += 1
+                #Wait a bit longer for every restart in a row so that a worker that crashes on start does not use up the CPU
+                worker.restart_at = time.monotonic() + min(WORKER_RESTART_DELAY * 2 ** min(worker.restarts - 1, 10), WORKER_MAX_RESTART_DELAY)
+            if time.monotonic() >= worker.restart_at:
+                self.start_worker(worker)
+
+    def handle_stop_signal(self, signal_number, frame):
+        '''Stops the supervisor when a stop signal is received.'''
+        logger.info(f"Received signal {signal_number}. Stopping workers...")
+        self.stopping = True
+
+    def run(self):
+        '''Runs the workers until the supervisor is stopped.'''
+        signal.signal(signal.SIGTERM, self.handle_stop_signal)
+        logger.info(f"Starting {len(self.workers)} workers on {self.host}:{self.port}...")
+        try:
+            for worker in self.workers:
+                self.start_worker(worker)
+            while not self.stopping:
+                time.sleep(HEALTH_CHECK_INTERVAL)
+                if not self.stopping:
+                    self.check_workers()
+                for worker in self.workers:
+                    if worker.alive and worker.responding and worker.restarts > 0 and time.monotonic() - worker.restart_at > WORKER_MAX_RESTART_DELAY:
+                        worker.restarts = 0 #The worker has been running fine for a while, so restart it right away the next time
+        except KeyboardInterrupt:
+            logger.info("Stopping workers...")
+        finally:
+            for worker in self.workers:
+                worker.stop()
+            logger.info("All workers stopped.")
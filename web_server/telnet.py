@@ -0,0 +1,320 @@
+'''telnet.py
+Handles the Telnet protocol (RFC 854) and option negotiation for the superbrain.
+This module only works with bytes and never reads or writes from a socket by itself,
+so it can be used by both the threaded and the asyncio server.'''
+import logging
+
+#Telnet commands
+IAC = 255 #Interpret as command
+DONT = 254
+DO = 253
+WONT = 252
+WILL = 251
+SB = 250 #Subnegotiation begin
+GA = 249 #Go ahead
+IP = 244 #Interrupt process
+SE = 240 #Subnegotiation end
+NEGOTIATION_COMMANDS = [DO, DONT, WILL, WONT]
+
+#Telnet options
+OPTION_ECHO = 1 #RFC 857
+OPTION_SGA = 3 #Suppress go ahead, RFC 858
+OPTION_TTYPE = 24 #Terminal type, RFC 1091
+OPTION_NAWS = 31 #Negotiate about window size, RFC 1073
+OPTION_LINEMODE = 34 #RFC 1184
+OPTION_MCCP2 = 86 #MUD Client Compression Protocol version 2. Everything we send after IAC SB MCCP2 IAC SE is a zlib stream
+TTYPE_IS = 0 #Subnegotiation of OPTION_TTYPE in which the client sends its terminal type
+TTYPE_SEND = 1 #Subnegotiation of OPTION_TTYPE in which we ask the client for its terminal type
+
+#Options that the superbrain can enable on its own side (the client sends DO)
+SUPPORTED_LOCAL_OPTIONS = [OPTION_ECHO, OPTION_SGA]
+#Options that the superbrain wants the client to enable (the client sends WILL)
+SUPPORTED_REMOTE_OPTIONS = [OPTION_NAWS, OPTION_SGA, OPTION_TTYPE]
+
+#Key sequences that split_keys() understands
+CSI = b"\x1b["
+SS3 = b"\x1bO" #Some terminals send arrow keys as SS3 sequences (like "\x1bOA") instead of CSI sequences
+CONTROL_CHARACTERS_END = 0x20 #Bytes below this are control characters
+ESCAPE = 0x1b
+MAX_ESCAPE_SEQUENCE_LENGTH = 16 #Longer unfinished sequences are not waited for anymore
+DELETE_CHARACTER = 0x7f
+
+class TelnetConnection:
+    '''Parses Telnet commands out of data received from a client and negotiates options with it.
+    Call feed() with received data to get the data without Telnet commands in it, and data_to_send()
+    to get negotiation data that should be sent to the client.'''
+    #Parser states
+    STATE_DATA = "data"
+    STATE_IAC = "iac"
+    STATE_NEGOTIATION = "negotiation"
+    STATE_SUBNEGOTIATION = "subnegotiation"
+    STATE_SUBNEGOTIATION_IAC = "subnegotiation_iac"
+    STATE_CR = "cr"
+
+    def __init__(self, width=80, height=24, offer_compression=False):
+        '''Initializes a Telnet connection.
+
+        :param width: Width of the client window until the client tells us its real width.
+
+        :param height: Height of the client window until the client tells us its real height.
+
+        :param offer_compression: If True, the client is asked if it wants compressed output (MCCP2).'''
+        self.width = width
+        self.height = height
+        self.size_changed = False #Set to True when the client has sent a new window size. Reset by the user of the class.
+        self.size_received = False #Set to True when the client has sent its window size for the first time
+        self.interrupted = False #Set to True when the client has sent an interrupt (IAC IP). Reset by the user of the class.
+        self.terminal_type = None #The terminal type that the client has sent, like "xterm-256color", if any
+        self.terminal_type_changed = False #Set to True when the client has sent its terminal type. Reset by the user of the class.
+        self.local_options = set() #Options that are enabled on our side
+        self.remote_options = set() #Options that are enabled on the client's side
+        self.pending_requests = set() #Negotiation (command, option) that we have sent and are waiting on an answer for
+        self.offer_compression = offer_compression
+        self.supported_local_options = SUPPORTED_LOCAL_OPTIONS + ([OPTION_MCCP2] if offer_compression else [])
+        self.compressing = False #True when everything sent to the client should be compressed. Set when the start of compression has been returned by data_to_send()
+        self.compression_start = None #Where in the output buffer compression should start, if it has been accepted but not started
+        self.state = TelnetConnection.STATE_DATA
+        self.negotiation_command = None
+        self.subnegotiation_buffer = bytearray()
+        self.output_buffer = bytearray()
+        self.held_keys = b"" #The start of an escape sequence at the end of the received keys, which the rest of might still come (see split_keys())
+        self.logger = logging.getLogger(__name__)
+
+    @property
+    def character_mode(self):
+        '''True if the client sends every keystroke directly instead of sending whole lines.
+        This is the case when we echo input and go aheads are suppressed.'''
+        return OPTION_ECHO in self.local_options and OPTION_SGA in self.local_options
+
+    @property
+    def negotiating(self):
+        '''True if we are still waiting for answers on sent negotiation requests, or on the window size or terminal type
+        from a client that has agreed to send it.'''
+        return len(self.pending_requests) > 0 or (OPTION_NAWS in self.remote_options and not self.size_received) \
+            or (OPTION_TTYPE in self.remote_options and self.terminal_type is None)
+
+    def start_negotiation(self):
+        '''Asks the client to send its window size and terminal type and to switch over to character mode.'''
+        self.send_negotiation(WILL, OPTION_ECHO)
+        self.send_negotiation(WILL, OPTION_SGA)
+        self.send_negotiation(DO, OPTION_SGA)
+        self.send_negotiation(DO, OPTION_NAWS)
+        self.send_negotiation(DO, OPTION_TTYPE)
+        if self.offer_compression:
+            self.send_negotiation(WILL, OPTION_MCCP2)
+
+    def send_negotiation(self, command, option):
+        '''Queues a negotiation command to be sent to the client.
+
+        :param command: DO, DONT, WILL or WONT.
+
+        :param option: The option to negotiate.'''
+        self.logger.debug(f"Sending negotiation {command} {option}.")
+        self.pending_requests.add((command, option))
+        self.output_buffer.extend(bytes([IAC, command, option]))
+
+    def send_subnegotiation(self, option, data:bytes):
+        '''Queues a subnegotiation to be sent to the client.
+
+        :param option: The option to subnegotiate.
+
+        :param data: Subnegotiation data.'''
+        self.output_buffer.extend(bytes([IAC, SB, option]) + data.replace(bytes([IAC]), bytes([IAC, IAC])) + bytes([IAC, SE]))
+
+    def data_to_send(self):
+        '''Returns (and clears) any data that should be sent to the client.
+        If the client has accepted compression, the data up to and including the start of compression is returned
+        and compressing is set to True. Everything after that (including the rest of the data, which is returned by
+        the next call) has to be compressed before it is sent.'''
+        end = len(self.output_buffer) if self.compression_start is None else self.compression_start
+        data = bytes(self.output_buffer[:end])
+        del self.output_buffer[:end]
+        if self.compression_start is not None:
+            self.compression_start = None
+            self.compressing = True
+        return data
+
+    def feed(self, data:bytes):
+        '''Parses data that has been received from the client.
+
+        :param data: The received data.
+
+        :returns: The received data with any Telnet commands removed.'''
+        application_data = bytearray()
+        for byte in data:
+            if self.state == TelnetConnection.STATE_DATA:
+                if byte == IAC:
+                    self.state = TelnetConnection.STATE_IAC
+                else:
+                    application_data.append(byte)
+                    if byte == 13: #"\r\0" means a carriage return, so the null should be removed
+                        self.state = TelnetConnection.STATE_CR
+            elif self.state == TelnetConnection.STATE_CR:
+                self.state = TelnetConnection.STATE_DATA
+                if byte == IAC:
+                    self.state = TelnetConnection.STATE_IAC
+                elif byte != 0:
+                    application_data.append(byte)
+                    if byte == 13:
+                        self.state = TelnetConnection.STATE_CR
+            elif self.state == TelnetConnection.STATE_IAC:
+                if byte == IAC: #Escaped 255 byte
+                    application_data.append(byte)
+                    self.state = TelnetConnection.STATE_DATA
+                elif byte in NEGOTIATION_COMMANDS:
+                    self.negotiation_command = byte
+                    self.state = TelnetConnection.STATE_NEGOTIATION
+                elif byte == SB:
+                    self.subnegotiation_buffer.clear()
+                    self.state = TelnetConnection.STATE_SUBNEGOTIATION
+                else:
+                    if byte == IP:
+                        self.logger.debug("Client sent an interrupt.")
+                        self.interrupted = True
+                    self.state = TelnetConnection.STATE_DATA
+            elif self.state == TelnetConnection.STATE_NEGOTIATION:
+                self.handle_negotiation(self.negotiation_command, byte)
+                self.state = TelnetConnection.STATE_DATA
+            elif self.state == TelnetConnection.STATE_SUBNEGOTIATION:
+                if byte == IAC:
+                    self.state = TelnetConnection.STATE_SUBNEGOTIATION_IAC
+                else:
+                    self.subnegotiation_buffer.append(byte)
+            elif self.state == TelnetConnection.STATE_SUBNEGOTIATION_IAC:
+                if byte == SE:
+                    self.handle_subnegotiation(bytes(self.subnegotiation_buffer))
+                    self.state = TelnetConnection.STATE_DATA
+                else: #Escaped 255 byte (or an invalid command which we treat the same way)
+                    self.subnegotiation_buffer.append(byte)
+                    self.state = TelnetConnection.STATE_SUBNEGOTIATION
+        return bytes(application_data)
+
+    def split_keys(self, data:bytes):
+        '''Splits data received in character mode into keys (see split_keys()). Clients might send an escape sequence (like an
+        arrow key) in several parts, so an unfinished sequence at the end of the data is held back and put in front of the next data.
+        A lone escape is held back as well, since it is the start of every sequence. Use flush_keys() if no more data has come.
+
+        :param data: The data to split (without any Telnet commands)
+
+        :returns: A list of keys as bytes.'''
+        data = self.held_keys + data
+        end = get_unfinished_sequence_start(data)
+        self.held_keys = data[end:]
+        return split_keys(data[:end])
+
+    def flush_keys(self):
+        '''Returns (and clears) the keys that have been held back by split_keys(), as they are.'''
+        keys = split_keys(self.held_keys)
+        self.held_keys = b""
+        return keys
+
+    def handle_negotiation(self, command, option):
+        '''Handles a negotiation command that has been received from the client.
+        Answers are only sent when an option changes state, so that negotiation never loops.
+
+        :param command: DO, DONT, WILL or WONT.
+
+        :param option: The option that is negotiated.'''
+        self.logger.debug(f"Received negotiation {command} {option}.")
+        if command in [DO, DONT]: #About our side
+            options, supported, accept, refuse = self.local_options, self.supported_local_options, WILL, WONT
+        else: #About the client's side
+            options, supported, accept, refuse = self.remote_options, SUPPORTED_REMOTE_OPTIONS, DO, DONT
+        was_requested = (accept, option) in self.pending_requests or (refuse, option) in self.pending_requests
+        self.pending_requests.discard((accept, option))
+        self.pending_requests.discard((refuse, option))
+        if command in [DO, WILL]:
+            if option in supported:
+                if option not in options:
+                    options.add(option)
+                    if not was_requested:
+                        self.output_buffer.extend(bytes([IAC, accept, option]))
+                    if option == OPTION_MCCP2 and command == DO:
+                        self.logger.debug("Client accepted compression.")
+                        self.send_subnegotiation(OPTION_MCCP2, b"")
+                        self.compression_start = len(self.output_buffer)
+                    elif option == OPTION_TTYPE and command == WILL:
+                        self.send_subnegotiation(OPTION_TTYPE, bytes([TTYPE_SEND]))
+            elif not was_requested:
+                self.output_buffer.extend(bytes([IAC, refuse, option]))
+        else:
+            if option in options:
+                options.discard(option)
+                if not was_requested:
+                    self.output_buffer.extend(bytes([IAC, refuse, option]))
+                if option == OPTION_MCCP2 and command == DONT: #The client wants to stop compression (for example because of an error)
+                    self.logger.debug("Client stopped compression.")
+                    self.compressing = False
+                    self.compression_start = None
+
+    def handle_subnegotiation(self, data:bytes):
+        '''Handles a subnegotiation that has been received from the client.
+
+        :param data: The subnegotiation data, starting with the option.'''
+        if len(data) == 0:
+            return
+        option = data[0]
+        if option == OPTION_NAWS and len(data) >= 5:
+            width = data[1]*256 + data[2]
+            height = data[3]*256 + data[4]
+            self.logger.debug(f"Client sent a window size of {width}x{height}.")
+            self.size_received = True
+            if width > 0 and height > 0 and (width, height) != (self.width, self.height): #0 means that the size is unknown
+                self.width = width
+                self.height = height
+                self.size_changed = True
+        elif option == OPTION_TTYPE and len(data) >= 2 and data[1] == TTYPE_IS:
+            self.terminal_type = data[2:].decode("ascii", errors="replace")
+            self.logger.debug(f"Client sent the terminal type {self.terminal_type}.")
+            self.terminal_type_changed = True
+        else:
+            self.logger.debug(f"Ignoring subnegotiation for option {option}.")
+
+def get_unfinished_sequence_start(data:bytes):
+    '''Returns where an escape sequence starts that has not been received completely at the end of some data,
+    or the length of the data if it ends with a complete key.'''
+    start = data.rfind(bytes([ESCAPE]), max(len(data) - MAX_ESCAPE_SEQUENCE_LENGTH, 0))
+    if start < 0:
+        return len(data)
+    sequence = data[start:]
+    if sequence == bytes([ESCAPE]) or sequence == SS3:
+        return start
+    #The final byte of a CSI sequence is between @ and ~. The bytes before it are parameters
+    if sequence.startswith(CSI) and all(0x20 <= byte < 0x40 for byte in sequence[len(CSI):]):
+        return start
+    return len(data)
+
+def split_keys(data:bytes):
+    '''Splits data received in character mode into individual keys.
+    Escape sequences (like arrow keys), control characters and line endings become one key each,
+    while runs of text are kept together as one key.
+
+    :param data: The data to split (without any Telnet commands)
+
+    :returns: A list of keys as bytes. Line endings ("\\r\\n", "\\r" and "\\n") are all returned as b"\\r".'''
+    keys = []
+    i = 0
+    while i < len(data):
+        byte = data[i]
+        if data.startswith(CSI, i): #Control sequence, for example an arrow key. Ends at a byte between @ and ~
+            end = i+len(CSI)
+            while end < len(data) and not 0x40 <= data[end] <= 0x7e:
+                end += 1
+            keys.append(data[i:end+1])
+            i = end+1
+        elif data.startswith(SS3, i) and len(data) > i+len(SS3): #Turn into the same key as the CSI sequence
+            keys.append(CSI + data[i+len(SS3):i+len(SS3)+1])
+            i += len(SS3)+1
+        elif byte == 13 or byte == 10:
+            keys.append(b"\r")
+            i += 2 if byte == 13 and data[i+1:i+2] == b"\n" else 1
+        elif byte < CONTROL_CHARACTERS_END or byte == DELETE_CHARACTER:
+            keys.append(data[i:i+1])
+            i += 1
+        else: #Text. Collect until the next control character
+            end = i
+            while end < len(data) and data[end] >= CONTROL_CHARACTERS_END and data[end] != DELETE_CHARACTER:
+                end += 1
+            keys.append(data[i:end])
+            i = end
+    return keys
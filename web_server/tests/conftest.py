@@ -0,0 +1,10 @@
+'''conftest.py
+Lets pytest import the modules of the superbrain like the server does: from the web_server directory.
+The other scripts in this directory (like load_test.py) are run by themselves and are not collected.'''
+import os, sys
+
+WEB_SERVER_DIRECTORY = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+os.chdir(WEB_SERVER_DIRECTORY)
+sys.path.insert(0, WEB_SERVER_DIRECTORY)
+
+collect_ignore = ["column_system_test.py", "load_test.py", "replay_trace.py", "text_tests.py"]
@@ -0,0 +1,421 @@
+'''load_test.py
+Load test for the superbrain. Serves some local stand-in websites, starts a superbrain server (unless --port is given)
+and connects many simulated Telnet clients to it that browse like users do: they move around with the arrow keys,
+follow links, type into text boxes and submit forms. When the test is done, it reports the keystroke-to-frame latency,
+frames per second, bytes per frame and the memory that the server uses for every session.
+
+Run it from the web_server directory, for example:
+python tests/load_test.py --clients 50 --duration 30'''
+import argparse, http.server, json, math, os, random, socket, subprocess, sys, threading, time, urllib.parse
+
+WEB_SERVER_DIRECTORY = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+PERSONAL_WEBSITE_FILE = os.path.join(WEB_SERVER_DIRECTORY, "example_servers", "personal_website", "index.html")
+
+#Telnet commands and options
+IAC, DONT, DO, WONT, WILL, SB, SE = 255, 254, 253, 252, 251, 250, 240
+OPTION_ECHO, OPTION_SGA, OPTION_TTYPE, OPTION_NAWS, OPTION_MCCP2 = 1, 3, 24, 31, 86
+TTYPE_IS = 0
+
+#Keys that the simulated clients press
+KEY_UP, KEY_DOWN, KEY_RIGHT, KEY_LEFT = b"\x1b[A", b"\x1b[B", b"\x1b[C", b"\x1b[D"
+KEY_ENTER = b"\r"
+KEY_BACKSPACE = b"\x7f"
+KEY_CTRL_C = b"\x03"
+KEY_CTRL_Q = b"\x11"
+WORDS = ["hello", "superbrain", "octopus", "telnet", "blop", "ahoy", "test", "räksmörgås", "load", "frame"]
+
+FRAME_GAP = 0.03 #Output that is this many seconds apart is counted as separate frames
+
+def percentile(values, percent):
+    '''Returns a percentile of some values (using the nearest-rank method), or None if there are no values.'''
+    if len(values) == 0:
+        return None
+    sorted_values = sorted(values)
+    return sorted_values[max(math.ceil(percent / 100 * len(sorted_values)), 1) - 1]
+
+#Stand-in websites
+def get_page(title, body):
+    '''Returns an HTML page.'''
+    return f"""<!DOCTYPE html>
+<html lang="en">
+<head>
+    <meta charset="UTF-8">
+    <title>{title}</title>
+</head>
+<body>
+{body}
+</body>
+</html>"""
+
+class StandInSiteHandler(http.server.BaseHTTPRequestHandler):
+    '''Serves the stand-in websites that the simulated clients browse:
+    an index with links, some long articles, a form and the personal website from example_servers.'''
+    submissions = 0
+
+    def get_url(self, path):
+        '''Returns the absolute URL of a path on the site.'''
+        #The superbrain only treats URLs with a host name and no trailing slash as URLs
+        return f"http://localhost:{self.server.server_address[1]}{path.rstrip('/')}"
+
+    def get_link(self, path, text):
+        '''Returns a button that links to a path on the site.'''
+        return f"<button style=\"color: blue\" data-link=\"{self.get_url(path)}\">{text}</button>"
+
+    def get_content(self):
+        '''Returns the content for the requested path, or None if there is nothing there.'''
+        path = urllib.parse.urlparse(self.path).path
+        if path == "/":
+            links = [self.get_link(f"/article/{number}", f"Article {number}") for number in range(1, 6)]
+            links.append(self.get_link("/form", "Form"))
+            links.append(self.get_link("/personal", "Personal website"))
+            return get_page("Load test index", "<p>---LOAD TEST---</p>\n<p>Pick a page below.</p>\n" + "\n".join(links))
+        if path.startswith("/article/"):
+            number = path.split("/")[-1]
+            paragraphs = [f"<p>Paragraph {index} of article {number}. " + "The quick brown fox jumps over the lazy dog. " * 4 + "</p>" for index in range(60)]
+            return get_page(f"Article {number}", f"<p style=\"color: green\">---ARTICLE {number}---</p>\n" + self.get_link("/", "Back") + "\n" + "\n".join(paragraphs))
+        if path == "/form":
+            return get_page("Form", f"""<p>Type some text below and then click on enter to send it.</p>
+<form action="{self.get_url('/submit')}" method="POST" data-send-from-terminal="true">
+    <label for="name">Name:</label>
+    <input id="name" name="name" type="text" data-include-in-payload="true"/>
+    <label for="message">Message:</label>
+    <input id="message" name="message" type="text" data-include-in-payload="true"/>
+    <button type="submit">Send!</button>
+</form>
+{self.get_link('/', 'Back')}""")
+        if path == "/results":
+            return get_page("Results", f"<p>{StandInSiteHandler.submissions} forms have been submitted.</p>\n" + self.get_link("/form", "Send another") + "\n" + self.get_link("/", "Back"))
+        if path == "/personal":
+            with open(PERSONAL_WEBSITE_FILE, encoding="utf-8") as personal_website_file:
+                return personal_website_file.read()
+        return None
+
+    def do_GET(self):
+        content = self.get_content()
+        if content is None:
+            self.send_error(404)
+            return
+        body = content.encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/html; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        StandInSiteHandler.submissions += 1
+        self.send_response(303)
+        self.send_header("Location", self.get_url("/results"))
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+    def log_message(self, format, *args):
+        pass
+
+def start_stand_in_site(host):
+    '''Starts the stand-in websites on a free port in the background.
+
+    :returns: The URL of the index of the websites.'''
+    site_server = http.server.ThreadingHTTPServer((host, 0), StandInSiteHandler)
+    site_server.daemon_threads = True
+    threading.Thread(target=site_server.serve_forever, daemon=True).start()
+    return f"http://localhost:{site_server.server_address[1]}"
+
+#The superbrain server
+def get_free_port(host):
+    '''Returns a port that is free on a host.'''
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as free_socket:
+        free_socket.bind((host, 0))
+        return free_socket.getsockname()[1]
+
+def start_superbrain(host, port, start_page, server_mode, workers):
+    '''Starts a superbrain server that starts sessions on the stand-in websites and waits for it to accept connections.
+
+    :returns: The server process.'''
+    environment = dict(os.environ)
+    environment.update({
+        "TELNET_SERVER_HOST": host,
+        "TELNET_SERVER_PORT": str(port),
+        "SUPERBRAIN_START_PAGE": start_page,
+        "SUPERBRAIN_SERVER_MODE": server_mode,
+        "SUPERBRAIN_WORKERS": str(workers),
+        "SUPERBRAIN_MAX_SESSIONS": "0", #All simulated clients come from the same IP address
+        "SUPERBRAIN_MAX_SESSIONS_PER_IP": "0",
+    })
+    environment.setdefault("SUPERBRAIN_LOG_LEVEL", "warning")
+    server_process = subprocess.Popen([sys.executable, "server.py"], cwd=WEB_SERVER_DIRECTORY, env=environment)
+    deadline = time.monotonic() + 60
+    while time.monotonic() < deadline:
+        if server_process.poll() is not None:
+            raise RuntimeError(f"The superbrain exited with code {server_process.returncode} before accepting connections.")
+        try:
+            socket.create_connection((host, port), timeout=1).close()
+            return server_process
+        except OSError:
+            time.sleep(0.2)
+    server_process.kill()
+    raise RuntimeError("The superbrain did not start accepting connections in time.")
+
+def get_process_tree(pid):
+    '''Returns the PID of a process and all its descendants (like the workers of a supervisor). Only works on Linux.'''
+    pids = [pid]
+    for process_pid in pids:
+        try:
+            for task in os.listdir(f"/proc/{process_pid}/task"):
+                with open(f"/proc/{process_pid}/task/{task}/children") as children_file:
+                    pids.extend(int(child) for child in children_file.read().split())
+        except OSError:
+            continue
+    return pids
+
+def get_rss(pid):
+    '''Returns the resident memory (in bytes) of a process and its descendants, or None if it can not be read.'''
+    total = 0
+    for process_pid in get_process_tree(pid):
+        try:
+            with open(f"/proc/{process_pid}/status") as status_file:
+                for line in status_file:
+                    if line.startswith("VmRSS:"):
+                        total += int(line.split()[1]) * 1024
+        except OSError:
+            if process_pid == pid:
+                return None
+    return total
+
+#Simulated clients
+class Statistics:
+    '''Measurements from all simulated clients. Can be updated from several threads at the same time.'''
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.connected_clients = 0
+        self.failed_clients = 0
+        self.first_frame_latencies = [] #Seconds from connecting to the first frame
+        self.keystroke_latencies = [] #Seconds from sending a key to the first byte of the next frame
+        self.frame_sizes = [] #Bytes received for every frame
+        self.keys_sent = 0
+        self.keys_without_frame = 0 #Keys that did not change anything on the screen (in time)
+
+    def add_frames(self, frame_sizes):
+        with self.lock:
+            self.frame_sizes.extend(frame_sizes)
+
+class SimulatedClient:
+    '''A Telnet client that browses like a user.'''
+    def __init__(self, index, arguments, statistics:Statistics, stop_time):
+        '''Initializes a simulated client.
+
+        :param index: The number of the client. Used to seed its random choices.
+
+        :param arguments: The command line arguments of the load test.
+
+        :param statistics: Where to add measurements.
+
+        :param stop_time: Monotonic time when the client should disconnect.'''
+        self.arguments = arguments
+        self.statistics = statistics
+        self.stop_time = stop_time
+        self.random = random.Random(arguments.seed * 100003 + index)
+        self.socket = None
+
+    def choose_keys(self):
+        '''Chooses what the user does next, as a list of keys to press.'''
+        action = self.random.choices(["navigate", "follow_link", "type", "submit", "home"], weights=[50, 15, 20, 10, 5])[0]
+        if action == "navigate":
+            return self.random.choices([KEY_DOWN, KEY_RIGHT, KEY_UP, KEY_LEFT], weights=[4, 3, 2, 1], k=self.random.randint(1, 3))
+        if action == "follow_link":
+            return [KEY_ENTER]
+        word = self.random.choice(WORDS).encode("utf-8")
+        if action == "type":
+            return [word, KEY_BACKSPACE]
+        if action == "submit":
+            return [word, KEY_DOWN, word, KEY_DOWN, KEY_ENTER]
+        return [KEY_CTRL_C]
+
+    def read_frames(self, timeout, until_timeout=False):
+        '''Reads frames from the server. A frame is output that is not more than FRAME_GAP seconds apart.
+
+        :param timeout: Max number of seconds to wait for the first frame.
+
+        :param until_timeout: If True, keep reading frames until the timeout instead of returning after the first frame.
+
+        :returns: A tuple: (time of the first byte or None if nothing was received, sizes of the received frames)'''
+        first_byte_time = None
+        frame_sizes = []
+        deadline = time.monotonic() + timeout
+        in_frame = False
+        while True:
+            #Wait for the rest of the current frame, or for a new frame until the timeout
+            wait_time = FRAME_GAP if in_frame else deadline - time.monotonic()
+            if wait_time <= 0:
+                return first_byte_time, frame_sizes
+            self.socket.settimeout(wait_time)
+            try:
+                data = self.socket.recv(65536)
+            except socket.timeout:
+                if not in_frame or not until_timeout:
+                    return first_byte_time, frame_sizes
+                in_frame = False
+                continue
+            if len(data) == 0:
+                raise ConnectionError("The server closed the connection.")
+            if first_byte_time is None:
+                first_byte_time = time.perf_counter()
+            if not in_frame:
+                frame_sizes.append(0)
+                in_frame = True
+            frame_sizes[-1] += len(data)
+
+    def connect(self):
+        '''Connects to the server and answers its Telnet negotiation like a regular client.'''
+        self.socket = socket.create_connection((self.arguments.host, self.arguments.port), timeout=30)
+        if self.read_frames(30)[0] is None:
+            raise TimeoutError("The server did not start Telnet negotiation.")
+        start_time = time.perf_counter()
+        width, height = self.arguments.width, self.arguments.height
+        if self.arguments.terminal_type is not None: #Sent right away instead of waiting for the server to ask for it
+            terminal_type_answer = bytes([IAC, WILL, OPTION_TTYPE, IAC, SB, OPTION_TTYPE, TTYPE_IS]) + self.arguments.terminal_type.encode("ascii") + bytes([IAC, SE])
+        else:
+            terminal_type_answer = bytes([IAC, WONT, OPTION_TTYPE])
+        self.socket.sendall(bytes([
+            IAC, DO, OPTION_ECHO, IAC, DO, OPTION_SGA, IAC, WILL, OPTION_SGA,
+            IAC, WILL, OPTION_NAWS, IAC, SB, OPTION_NAWS, width >> 8, width & 255, height >> 8, height & 255, IAC, SE,
+            IAC, DO if self.arguments.compress else DONT, OPTION_MCCP2
+        ]) + terminal_type_answer)
+        first_byte_time, frame_sizes = self.read_frames(30)
+        if first_byte_time is None:
+            raise TimeoutError("No frame was received after connecting.")
+        with self.statistics.lock:
+            self.statistics.connected_clients += 1
+            self.statistics.first_frame_latencies.append(first_byte_time - start_time)
+        self.statistics.add_frames(frame_sizes)
+
+    def run(self):
+        '''Browses until the stop time.'''
+        try:
+            self.connect()
+            while time.monotonic() < self.stop_time:
+                for key in self.choose_keys():
+                    send_time = time.perf_counter()
+                    self.socket.sendall(key)
+                    first_byte_time, frame_sizes = self.read_frames(self.arguments.response_timeout)
+                    self.statistics.add_frames(frame_sizes)
+                    with self.statistics.lock:
+                        self.statistics.keys_sent += 1
+                        if first_byte_time is None:
+                            self.statistics.keys_without_frame += 1
+                        else:
+                            self.statistics.keystroke_latencies.append(first_byte_time - send_time)
+                    #Wait like a user would, but keep reading any output that is late (like a page that has loaded)
+                    self.statistics.add_frames(self.read_frames(self.random.expovariate(1 / self.arguments.think_time), until_timeout=True)[1])
+            self.socket.sendall(KEY_CTRL_Q)
+        except (OSError, ConnectionError, TimeoutError) as e:
+            with self.statistics.lock:
+                self.statistics.failed_clients += 1
+            print(f"Client failed: {e}", file=sys.stderr)
+        finally:
+            if self.socket is not None:
+                self.socket.close()
+
+def format_milliseconds(seconds):
+    return "n/a" if seconds is None else f"{seconds * 1000:.1f} ms"
+
+def get_report(arguments, statistics:Statistics, duration, baseline_rss, peak_rss):
+    '''Returns the results of the load test as a dictionary.'''
+    frame_sizes = statistics.frame_sizes
+    report = {
+        "clients": arguments.clients,
+        "connected_clients": statistics.connected_clients,
+        "failed_clients": statistics.failed_clients,
+        "duration_seconds": round(duration, 2),
+        "keys_sent": statistics.keys_sent,
+        "keys_without_frame": statistics.keys_without_frame,
+        "frames": len(frame_sizes),
+        "frames_per_second": round(len(frame_sizes) / duration, 2) if duration > 0 else None,
+        "mean_bytes_per_frame": round(sum(frame_sizes) / len(frame_sizes), 1) if len(frame_sizes) > 0 else None,
+        "rss_baseline_bytes": baseline_rss,
+        "rss_peak_bytes": peak_rss,
+        "rss_per_session_bytes": round((peak_rss - baseline_rss) / statistics.connected_clients) if None not in [baseline_rss, peak_rss] and statistics.connected_clients > 0 else None,
+    }
+    for percent in [50, 95, 99]:
+        report[f"keystroke_latency_p{percent}_seconds"] = percentile(statistics.keystroke_latencies, percent)
+        report[f"first_frame_latency_p{percent}_seconds"] = percentile(statistics.first_frame_latencies, percent)
+        report[f"bytes_per_frame_p{percent}"] = percentile(frame_sizes, percent)
+    return report
+
+def print_report(report):
+    '''Prints the results of the load test in a human-readable way.'''
+    print(f"Clients: {report['clients']} ({report['connected_clients']} connected, {report['failed_clients']} failed) for {report['duration_seconds']} seconds")
+    print("Keystroke-to-frame latency: " + ", ".join(f"p{percent} {format_milliseconds(report[f'keystroke_latency_p{percent}_seconds'])}" for percent in [50, 95, 99]))
+    print("Connect-to-first-frame latency: " + ", ".join(f"p{percent} {format_milliseconds(report[f'first_frame_latency_p{percent}_seconds'])}" for percent in [50, 95, 99]))
+    print(f"Keys sent: {report['keys_sent']} ({report['keys_without_frame']} did not change the screen)")
+    print(f"Frames: {report['frames']} ({report['frames_per_second']} per second)")
+    print(f"Bytes per frame: mean {report['mean_bytes_per_frame']}, " + ", ".join(f"p{percent} {report[f'bytes_per_frame_p{percent}']}" for percent in [50, 95, 99]))
+    if report["rss_per_session_bytes"] is None:
+        print("RSS per session: n/a (the memory of the server could not be read)")
+    else:
+        print(f"RSS per session: {report['rss_per_session_bytes'] / 1024:.1f} KiB (server: {report['rss_baseline_bytes'] / 1024 ** 2:.1f} MiB idle, {report['rss_peak_bytes'] / 1024 ** 2:.1f} MiB at peak)")
+
+def main():
+    parser = argparse.ArgumentParser(description="Load test for the superbrain.")
+    parser.add_argument("--clients", type=int, default=20, help="number of simulated clients")
+    parser.add_argument("--duration", type=float, default=30, help="seconds that every client browses for")
+    parser.add_argument("--ramp-up", type=float, default=5, help="seconds over which the clients connect")
+    parser.add_argument("--think-time", type=float, default=0.5, help="mean seconds between actions of a client")
+    parser.add_argument("--response-timeout", type=float, default=1, help="max seconds to wait for a frame after a key")
+    parser.add_argument("--width", type=int, default=80, help="screen width of the clients")
+    parser.add_argument("--height", type=int, default=24, help="screen height of the clients")
+    parser.add_argument("--compress", action="store_true", help="accept compressed output (MCCP2), like MUD clients do")
+    parser.add_argument("--terminal-type", default=None, help="terminal type that the clients send, like xterm-256color or vt100. if not set, they do not send one")
+    parser.add_argument("--seed", type=int, default=1, help="seed for the random choices of the clients")
+    parser.add_argument("--host", default="127.0.0.1", help="host of the superbrain and the stand-in websites")
+    parser.add_argument("--port", type=int, default=None, help="port of a superbrain that is already running. if not set, one is started")
+    parser.add_argument("--server-pid", type=int, default=None, help="PID of a superbrain that is already running, to measure its memory")
+    parser.add_argument("--server-mode", default="threaded", help="SUPERBRAIN_SERVER_MODE of the started superbrain")
+    parser.add_argument("--workers", type=int, default=1, help="SUPERBRAIN_WORKERS of the started superbrain")
+    parser.add_argument("--json", action="store_true", help="print the results as JSON")
+    arguments = parser.parse_args()
+
+    start_page = start_stand_in_site(arguments.host)
+    server_process = None
+    server_pid = arguments.server_pid
+    if arguments.port is None:
+        arguments.port = get_free_port(arguments.host)
+        server_process = start_superbrain(arguments.host, arguments.port, start_page, arguments.server_mode, arguments.workers)
+        server_pid = server_process.pid
+    else:
+        print(f"Using the superbrain on port {arguments.port}. Set SUPERBRAIN_START_PAGE={start_page} on it to browse the stand-in websites.", file=sys.stderr)
+    try:
+        time.sleep(1) #Let the server settle before measuring its idle memory
+        baseline_rss = get_rss(server_pid) if server_pid is not None else None
+        peak_rss = baseline_rss
+        statistics = Statistics()
+        start_time = time.monotonic()
+        threads = []
+        for index in range(arguments.clients):
+            #Connect evenly over the ramp-up, and let every client browse for the full duration after it is done
+            connect_time = start_time + arguments.ramp_up * index / max(arguments.clients, 1)
+            client = SimulatedClient(index, arguments, statistics, start_time + arguments.ramp_up + arguments.duration)
+            while time.monotonic() < connect_time:
+                time.sleep(min(connect_time - time.monotonic(), 0.05))
+            thread = threading.Thread(target=client.run, daemon=True)
+            thread.start()
+            threads.append(thread)
+        while any(thread.is_alive() for thread in threads):
+            rss = get_rss(server_pid) if server_pid is not None else None
+            if rss is not None:
+                peak_rss = max(peak_rss or 0, rss)
+            time.sleep(0.5)
+        duration = time.monotonic() - start_time
+    finally:
+        if server_process is not None:
+            server_process.terminate()
+            server_process.wait()
+    report = get_report(arguments, statistics, duration, baseline_rss, peak_rss)
+    if arguments.json:
+        print(json.dumps(report, indent=4))
+    else:
+        print_report(report)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,240 @@
+'''replay_trace.py
+Replays a session that has been recorded as a trace (see tracing.py and SUPERBRAIN_TRACE_DIRECTORY) offline, without a client
+or any network access: the recorded input is fed to a session, websites are loaded from the recorded content and form data
+is "sent" by returning the recorded responses. Reports how long every step (like a key press and the frame that it leads to)
+takes with this build, and which frames are drawn differently than when the trace was recorded.
+Local files (like the start page) are loaded from disk, so changes to them also show up as changed frames.
+
+Run it from the web_server directory, for example:
+python tests/replay_trace.py traces/session-127.0.0.1-51234-20260101-120000.jsonl.gz
+
+Exits with 1 if any frame has changed.'''
+import argparse, base64, collections, gzip, json, logging, os, sys, time
+
+def read_trace(path):
+    '''Returns the events of a trace file.'''
+    with gzip.open(path, "rt", encoding="utf-8") as trace_file:
+        return [json.loads(line) for line in trace_file if line.strip() != ""]
+
+def configure_environment(events):
+    '''Sets up the environment (before anything from the superbrain is imported) so that the replay runs like the recorded session.'''
+    start_event = next((event for event in events if event["type"] == "start"), None)
+    if start_event is not None:
+        os.environ["SUPERBRAIN_START_PAGE"] = start_event["start_file"]
+        os.environ["SUPERBRAIN_DIFFERENTIAL_UPDATES"] = str(start_event["differential_updates"]).lower()
+        os.environ["SUPERBRAIN_MCCP"] = str(start_event["mccp_enabled"]).lower()
+    os.environ["SUPERBRAIN_TRACE_DIRECTORY"] = "" #Do not record the replay
+    os.environ["SUPERBRAIN_PROFILING"] = "true" #For the timings of the steps
+    os.environ["SUPERBRAIN_LOAD_TIMEOUT"] = "0" #Loads are waited for, however long they take
+    sys.path.append(os.getcwd())
+
+class RecordedResponse:
+    '''Stands in for the response of a form that was sent while the trace was recorded.'''
+    def __init__(self, event):
+        self.url = event["url"]
+        self.status_code = event["status_code"]
+        self.ok = self.status_code < 400
+        self.text = ""
+
+class RecordedRequests:
+    '''Stands in for the HTTP client that sessions send form data with (see Session.post_form), so that form data is not sent anywhere.'''
+    def __init__(self, post_events):
+        self.post_events = collections.deque(post_events)
+
+    def post(self, url, **kwargs):
+        if len(self.post_events) == 0:
+            raise Exception(f"The trace has no more recorded form responses (for {url}).")
+        event = self.post_events.popleft()
+        if "error" in event:
+            raise Exception(event["error"])
+        return RecordedResponse(event)
+
+class FrameCollector:
+    '''Takes the place of the trace recorder of the replayed session and keeps the frames that it draws.'''
+    def __init__(self):
+        self.frames = [] #(size, hash) of every frame
+
+    def record(self, event_type, **data):
+        pass
+
+    def record_input(self, data, while_loading=False):
+        pass
+
+    def record_frame(self, frame_output):
+        from tracing import get_frame_hash
+        self.frames.append((len(frame_output), get_frame_hash(frame_output)))
+
+    def close(self):
+        pass
+
+def describe_input(data:bytes):
+    '''Returns a short description of received data for the report.'''
+    description = repr(data)
+    return description if len(description) <= 24 else description[:21] + "..."
+
+def replay(events):
+    '''Replays a trace.
+
+    :returns: A list of steps. Every step is a dictionary with a description, the time that the step took, the timings of any page
+    that was loaded in it and the indexes of the frames that were drawn in it.'''
+    from content_renderer.from_html.sourceloader import SourceLoader
+    from session import Session
+    from profiling import SessionProfiler
+    from const import ESCAPE_KEY_TIMEOUT
+
+    class RecordedSourceLoader(SourceLoader):
+        '''Loads websites from the content in the trace instead of from the network.'''
+        def __init__(self, source_events, **kwargs):
+            super().__init__(**kwargs)
+            self.contents = collections.defaultdict(collections.deque)
+            for event in source_events:
+                self.contents[event["source"]].append(event["content"])
+
+        def load_source_content(self, source_string, decoder=None):
+            if not self.is_url(source_string):
+                return super().load_source_content(source_string, decoder)
+            contents = self.contents.get(source_string)
+            if not contents:
+                self.logger.warning(f"The trace has no recorded content for {source_string}.")
+                return None
+            #A source that is loaded more times than recorded gets the last recorded content
+            return contents.popleft() if len(contents) > 1 else contents[0]
+
+    old_source_loader = Session.source_loader
+    Session.source_loader = RecordedSourceLoader([event for event in events if event["type"] == "source"],
+        load_from_files=old_source_loader.load_from_files, load_from_urls=True,
+        trusted_directories=old_source_loader.trusted_directories, trusted_urls=[], on_fetch=old_source_loader.on_fetch,
+        measure=old_source_loader.measure)
+    Session.post_form = RecordedRequests([event for event in events if event["type"] == "post"]).post
+    Session.update_refresh_watch = lambda session, content=None: None #Refreshes are replayed from the trace instead
+
+    session = Session()
+    session.trace = collector = FrameCollector()
+    session.profiler = SessionProfiler("replay")
+    steps = []
+    step = None
+
+    def start_step(description):
+        nonlocal step
+        step = {"description": description, "start_time": time.perf_counter(), "frames": [], "pages": []}
+        steps.append(step)
+
+    def end_step():
+        step["seconds"] = time.perf_counter() - step.pop("start_time")
+
+    def write_frame(scene=None):
+        session.write_frame(scene)
+        step["frames"].append(len(collector.frames) - 1)
+
+    def handle_held_keys(input_event, pending_inputs):
+        '''Handles a held back escape key (see Session.handle_held_keys()) if the server did, because no more input came in time.'''
+        next_input = next((event for event in pending_inputs if event["type"] == "input"), None)
+        if next_input is None or next_input["time"] - input_event["time"] >= ESCAPE_KEY_TIMEOUT:
+            session.handle_held_keys(wait=False)
+
+    def finish_load(pending_inputs):
+        '''Feeds the input that was received while loading to the session and waits for the load.'''
+        while session.load_in_progress and not session.closed:
+            if len(pending_inputs) > 0 and pending_inputs[0].get("while_loading"):
+                event = pending_inputs.popleft()
+                session.receive_while_loading(base64.b64decode(event["data"]))
+                handle_held_keys(event, pending_inputs)
+            else:
+                session.load_future.exception() #Waits for the load
+            session.update_load()
+        if session.profiler.page_timings is not None and session.profiler.page_timings not in step["pages"]:
+            step["pages"].append(session.profiler.page_timings)
+
+    #Telnet negotiation, up to the start page
+    remaining_events = collections.deque(event for event in events if event["type"] in ["input", "refresh", "ready"])
+    session.start()
+    session.write_telnet_data()
+    start_step("start page")
+    while len(remaining_events) > 0:
+        event = remaining_events.popleft()
+        if event["type"] == "ready":
+            break
+        if event["type"] == "input":
+            session.receive(base64.b64decode(event["data"]))
+            session.write_telnet_data()
+    session.load_start_scene()
+    if session.profiler.page_timings is not None:
+        step["pages"].append(session.profiler.page_timings)
+    #The same loop as the servers run
+    while not session.closed:
+        if session.is_loading():
+            write_frame(session.get_loading_scene())
+            session.start_load()
+            finish_load(remaining_events)
+            continue
+        if session.needs_blocking_work():
+            session.do_blocking_work()
+            continue
+        write_frame()
+        end_step()
+        if len(remaining_events) == 0:
+            break
+        event = remaining_events.popleft()
+        if event["type"] == "refresh":
+            start_step(f"refresh of {event['source']}")
+            session.on_source_refreshed(event["source"], event["content"])
+        elif event["type"] == "input":
+            data = base64.b64decode(event["data"])
+            start_step(f"input {describe_input(data)}")
+            session.receive(data)
+            handle_held_keys(event, remaining_events)
+    if "seconds" not in step:
+        end_step()
+    session.close()
+    return steps, collector.frames
+
+def compare_frames(recorded_frames, replayed_frames):
+    '''Returns the indexes of the replayed frames that differ from the recorded ones, and whether the number of frames differs.'''
+    changed_frames = [index for index, frame in enumerate(replayed_frames)
+                      if index >= len(recorded_frames) or frame[1] != recorded_frames[index][1]]
+    return changed_frames, len(recorded_frames) != len(replayed_frames)
+
+def format_milliseconds(seconds):
+    return f"{seconds * 1000:.1f} ms"
+
+def main():
+    parser = argparse.ArgumentParser(description="Replays a recorded superbrain session offline.")
+    parser.add_argument("trace", help="the trace file to replay")
+    parser.add_argument("--json", action="store_true", help="print the results as JSON")
+    parser.add_argument("--verbose", action="store_true", help="show the log of the replayed session")
+    arguments = parser.parse_args()
+    logging.basicConfig(level=logging.INFO if arguments.verbose else logging.ERROR)
+    events = read_trace(arguments.trace)
+    configure_environment(events)
+    recorded_frames = [(event["size"], event["hash"]) for event in events if event["type"] == "frame"]
+    steps, replayed_frames = replay(events)
+    changed_frames, frame_count_changed = compare_frames(recorded_frames, replayed_frames)
+    for step in steps:
+        step["changed"] = any(index in changed_frames for index in step["frames"])
+    recorded_seconds = events[-1]["time"] if len(events) > 0 else 0
+    if arguments.json:
+        print(json.dumps({
+            "steps": [{"description": step["description"], "seconds": step["seconds"], "frames": step["frames"], "changed": step["changed"],
+                       "pages": [{"source": timings.source, "fetch_seconds": timings.fetch_seconds, "parse_seconds": timings.parse_seconds,
+                                  "convert_seconds": timings.total_convert_seconds, "layout_seconds": timings.layout_seconds} for timings in step["pages"]]}
+                      for step in steps],
+            "total_seconds": sum(step["seconds"] for step in steps),
+            "recorded_seconds": recorded_seconds,
+            "recorded_frames": len(recorded_frames),
+            "replayed_frames": len(replayed_frames),
+            "changed_frames": changed_frames
+        }, indent=4))
+    else:
+        for index, step in enumerate(steps):
+            frame_sizes = ", ".join(f"{replayed_frames[frame_index][0]} B" for frame_index in step["frames"])
+            print(f"{index:4} {step['description']:32} {format_milliseconds(step['seconds']):>10}  frames: {frame_sizes or '-'}{'  CHANGED' if step['changed'] else ''}")
+            for timings in step["pages"]:
+                print(f"       {timings.source}: parse {format_milliseconds(timings.parse_seconds)}, convert {format_milliseconds(timings.total_convert_seconds)}, layout {format_milliseconds(timings.layout_seconds)}")
+        print(f"Replayed {len(steps)} steps in {format_milliseconds(sum(step['seconds'] for step in steps))} (the recorded session took {recorded_seconds:.1f} s).")
+        print(f"Frames: {len(replayed_frames)} replayed, {len(recorded_frames)} recorded, {len(changed_frames)} changed.")
+        if frame_count_changed:
+            print("The number of frames has changed. The session took another path than when it was recorded.")
+    sys.exit(1 if len(changed_frames) > 0 or frame_count_changed else 0)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,55 @@
+'''test_decoding.py
+Tests for finding the encoding of documents and client input in content_renderer/from_html/decoding.py.'''
+import codecs
+from content_renderer.from_html.decoding import SOURCE_BOM, SOURCE_DECLARED, SOURCE_REMEMBERED, SOURCE_UTF8, \
+    SessionDecoder, decode
+
+def test_decode_bom_comes_first():
+    assert decode(codecs.BOM_UTF8 + "Hällo".encode("utf-8"), content_type="text/html; charset=latin-1") == ("Hällo", "utf-8-sig", SOURCE_BOM)
+
+def test_decode_utf16_bom():
+    text, encoding, source = decode("Hej".encode("utf-16"))
+    assert (text, source) == ("Hej", SOURCE_BOM)
+
+def test_decode_content_type_charset():
+    assert decode("Hällo".encode("latin-1"), content_type="text/html; charset=ISO-8859-1") == ("Hällo", "iso8859-1", SOURCE_DECLARED)
+
+def test_decode_meta_charset():
+    data = "<html><head><meta charset=\"windows-1252\"></head><body>Hällo</body></html>".encode("cp1252")
+    text, encoding, source = decode(data)
+    assert (encoding, source) == ("cp1252", SOURCE_DECLARED)
+    assert "Hällo" in text
+
+def test_decode_meta_charset_ignored_for_input():
+    data = "<meta charset=\"latin-1\"> Hällo".encode("utf-8")
+    assert decode(data, look_for_declaration=False)[1:] == ("utf-8", SOURCE_UTF8)
+
+def test_decode_invalid_declared_charset_falls_back_to_utf8():
+    assert decode("Hällo".encode("utf-8"), content_type="text/html; charset=ascii") == ("Hällo", "utf-8", SOURCE_UTF8)
+
+def test_decode_remembered_encoding():
+    assert decode("Hällo".encode("latin-1"), remembered_encoding="iso8859-1") == ("Hällo", "iso8859-1", SOURCE_REMEMBERED)
+
+def test_decode_input_ascii():
+    assert SessionDecoder().decode_input(b"hello") == ("hello", "ascii")
+
+def test_decode_input_utf8_character_split_across_reads():
+    decoder = SessionDecoder()
+    data = "å€".encode("utf-8")
+    assert decoder.decode_input(data[:1]) == ("", "utf-8")
+    assert decoder.decode_input(data[1:4]) == ("å", "utf-8")
+    assert decoder.decode_input(data[4:]) == ("€", "utf-8")
+    assert decoder.input_encoding is None
+
+def test_decode_input_flush_unfinished_character():
+    decoder = SessionDecoder()
+    assert decoder.decode_input("é".encode("latin-1")) == ("", "utf-8") #Could be the start of a UTF-8 character
+    text, encoding = decoder.flush_input()
+    assert text != "" and encoding != "utf-8"
+    assert decoder.flush_input()[0] == ""
+
+def test_decode_input_final_keeps_nothing():
+    decoder = SessionDecoder()
+    text, encoding = decoder.decode_input("aé".encode("utf-8")[:2], final=True)
+    assert text != "" and encoding != "utf-8"
+    assert decoder.input_decoder.getstate()[0] == b""
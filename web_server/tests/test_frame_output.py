@@ -0,0 +1,72 @@
+'''test_frame_output.py
+Tests for the output that is created for every frame in frame_output.py.'''
+import zlib
+from const import CLEAR_SCREEN, NAVIGATE, RENDER_PROFILE_MONOCHROME, TERMINAL_COLORS
+from frame_output import ERASE_BELOW, ERASE_TO_END_OF_LINE, FrameDiffer, FrameWriter, filter_styles
+
+RESET = TERMINAL_COLORS.RESET
+RED = "\x1b[31m"
+
+def redraw_line(line_number, line, style=""):
+    '''Returns the output that FrameDiffer creates to redraw one line.'''
+    return NAVIGATE.TO_COORDINATE.format(line_number, 1) + RESET + style + line + RESET + ERASE_TO_END_OF_LINE
+
+def test_first_frame_redraws_whole_screen():
+    differ = FrameDiffer()
+    assert differ.diff("a\nb") == CLEAR_SCREEN + "a\r\nb"
+
+def test_unchanged_frame_sends_nothing():
+    differ = FrameDiffer()
+    differ.diff("a\nb")
+    assert differ.diff("a\nb") == ""
+
+def test_only_changed_lines_are_redrawn():
+    differ = FrameDiffer()
+    differ.diff("a\nb\nc")
+    assert differ.diff("a\nB\nc") == redraw_line(2, "B")
+
+def test_trailing_whitespace_is_erased_instead_of_sent():
+    differ = FrameDiffer()
+    differ.diff("a   \nb")
+    assert differ.diff("c   \nb") == redraw_line(1, "c")
+
+def test_styles_active_at_line_start_are_added_again():
+    differ = FrameDiffer()
+    differ.diff(f"{RED}a\nb{RESET}")
+    assert differ.diff(f"{RED}a\nB{RESET}") == redraw_line(2, f"B{RESET}", style=RED)
+
+def test_shorter_frame_erases_lines_below():
+    differ = FrameDiffer()
+    differ.diff("a\nb\nc")
+    assert differ.diff("a") == NAVIGATE.TO_COORDINATE.format(2, 1) + ERASE_BELOW
+
+def test_cursor_string_is_sent_after_frame():
+    differ = FrameDiffer()
+    cursor_string = NAVIGATE.TO_COORDINATE.format(1, 2)
+    differ.diff("ab" + cursor_string, cursor_string)
+    assert differ.diff("ab" + cursor_string, cursor_string) == cursor_string
+
+def test_non_differential_redraws_every_frame():
+    differ = FrameDiffer(differential=False)
+    differ.diff("a\nb")
+    assert differ.diff("a\nb") == CLEAR_SCREEN + "a\r\nb"
+
+def test_reset_and_invalidate_line():
+    differ = FrameDiffer()
+    differ.diff("a\nb")
+    differ.invalidate_line(0)
+    assert differ.diff("a\nb") == redraw_line(1, "a")
+    differ.reset()
+    assert differ.diff("a\nb") == CLEAR_SCREEN + "a\r\nb"
+
+def test_flush_without_new_data_writes_nothing():
+    writer = FrameWriter(FrameDiffer())
+    writer.start_compression(6)
+    writer.write(b"a")
+    decompressor = zlib.decompressobj()
+    assert decompressor.decompress(writer.pop()) == b"a"
+    writer.write(b"")
+    assert writer.pop() == b"" #An empty sync flush would still be an empty deflate block
+
+def test_filter_styles_monochrome_keeps_font_weights():
+    assert filter_styles("\x1b[1;31mA\x1b[38;5;100mB\x1b[0m", RENDER_PROFILE_MONOCHROME) == "\x1b[1mAB\x1b[0m"
@@ -0,0 +1,53 @@
+'''test_history.py
+Tests for how the back/forward history in history.py is bounded.'''
+from const import SCENE_BYTES_PER_LINE
+from history import History
+
+class FakeScene:
+    '''Stands in for a scene with a number of lines of content.'''
+    def __init__(self, lines=1):
+        self.total_content_height = lines
+        self.current_scroll_position = 0
+
+def get_sources(entries):
+    return [entry.source for entry in entries]
+
+def test_oldest_pages_are_forgotten_above_max_entries():
+    history = History(max_entries=2, max_size=1000*SCENE_BYTES_PER_LINE)
+    for source in ["a", "b", "c"]:
+        history.add(source, FakeScene())
+    assert get_sources(history.back_entries) == ["b", "c"]
+
+def test_trim_takes_from_the_longer_side():
+    history = History(max_entries=3, max_size=1000*SCENE_BYTES_PER_LINE)
+    for source in ["a", "b", "c"]:
+        history.add(source, FakeScene())
+    history.go_back("d", FakeScene())
+    history.go_back("c", FakeScene())
+    assert get_sources(history.back_entries) == ["a"]
+    assert get_sources(history.forward_entries) == ["d", "c"]
+    history.max_entries = 2
+    history.trim()
+    assert get_sources(history.back_entries) == ["a"]
+    assert get_sources(history.forward_entries) == ["c"] #The page furthest forward is forgotten
+
+def test_least_recently_visited_scenes_are_forgotten_above_max_size():
+    history = History(max_entries=10, max_size=2*SCENE_BYTES_PER_LINE)
+    for source in ["a", "b", "c"]:
+        history.add(source, FakeScene())
+    assert [entry.scene is not None for entry in history.back_entries] == [False, True, True]
+    assert get_sources(history.back_entries) == ["a", "b", "c"] #The pages themselves are kept
+
+def test_forgotten_scene_keeps_scroll_position():
+    history = History(max_entries=10, max_size=0)
+    scene = FakeScene()
+    scene.current_scroll_position = 5
+    history.add("a", scene)
+    entry = history.go_back("b", FakeScene())
+    assert (entry.source, entry.scene, entry.scroll_position) == ("a", None, 5)
+
+def test_add_without_keeping_scene():
+    history = History(max_entries=10, max_size=1000*SCENE_BYTES_PER_LINE)
+    history.add("a", FakeScene(), keep_scene=False)
+    assert history.back_entries[0].scene is None
+    assert history.back_entries[0].size == 0
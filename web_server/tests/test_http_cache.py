@@ -0,0 +1,92 @@
+'''test_http_cache.py
+Tests for the freshness, revalidation and storing rules of the shared response cache in http_cache.py.'''
+from http_cache import HTTPCache, get_freshness_lifetime, parse_cache_control
+
+URL = "http://example.com/"
+
+class FakeResponse:
+    '''Stands in for a response of the requests library.'''
+    def __init__(self, status_code=200, headers=None, content=b"page"):
+        self.status_code = status_code
+        self.headers = headers or {}
+        self.content = content
+
+class FakeWebsite:
+    '''A request function for HTTPCache.get() that answers with the given responses in order and remembers the requests.'''
+    def __init__(self, *responses):
+        self.responses = list(responses)
+        self.requests = [] #(url, headers)
+
+    def __call__(self, url, headers):
+        self.requests.append((url, headers))
+        return self.responses.pop(0)
+
+def expire(cache, url):
+    '''Makes a cached response look like it was stored long ago.'''
+    cached_response = cache.entries[url]
+    cached_response.stored_at -= cached_response.freshness_lifetime + cached_response.stale_lifetime + 1
+
+def test_freshness_lifetime():
+    assert get_freshness_lifetime({}, parse_cache_control("max-age=60")) == 60
+    assert get_freshness_lifetime({}, parse_cache_control("max-age=60, s-maxage=10")) == 10
+    assert get_freshness_lifetime({"Age": "50"}, parse_cache_control("max-age=60")) == 10
+    assert get_freshness_lifetime({}, parse_cache_control("max-age=60, no-cache")) == 0
+    assert get_freshness_lifetime({"Expires": "Thu, 01 Jan 2015 00:01:00 GMT", "Date": "Thu, 01 Jan 2015 00:00:00 GMT"}, {}) == 60
+    assert get_freshness_lifetime({"Expires": "0"}, {}) == 0
+
+def test_fresh_response_is_used_without_request():
+    cache = HTTPCache(max_size=1024)
+    website = FakeWebsite(FakeResponse(headers={"Cache-Control": "max-age=60"}))
+    assert cache.get(URL, website).content == b"page"
+    assert cache.get(URL, website).content == b"page"
+    assert len(website.requests) == 1
+
+def test_expired_response_is_revalidated_with_304():
+    cache = HTTPCache(max_size=1024)
+    website = FakeWebsite(FakeResponse(headers={"Cache-Control": "max-age=60", "ETag": "\"v1\""}),
+                          FakeResponse(status_code=304, headers={"Cache-Control": "max-age=120"}, content=b""))
+    cache.get(URL, website)
+    expire(cache, URL)
+    cached_response = cache.get(URL, website)
+    assert website.requests[1] == (URL, {"If-None-Match": "\"v1\""})
+    assert cached_response.content == b"page"
+    assert cached_response.freshness_lifetime == 120
+    assert cache.get(URL, website) is cached_response #Fresh again
+    assert len(website.requests) == 2
+
+def test_expired_response_is_replaced_when_modified():
+    cache = HTTPCache(max_size=1024)
+    website = FakeWebsite(FakeResponse(headers={"Last-Modified": "Thu, 01 Jan 2015 00:00:00 GMT"}),
+                          FakeResponse(headers={"Cache-Control": "max-age=60"}, content=b"new page"))
+    cache.get(URL, website)
+    assert cache.get(URL, website).content == b"new page"
+    assert website.requests[1][1] == {"If-Modified-Since": "Thu, 01 Jan 2015 00:00:00 GMT"}
+    assert cache.size == len(b"new page")
+
+def test_no_cache_is_revalidated_every_time():
+    cache = HTTPCache(max_size=1024)
+    website = FakeWebsite(FakeResponse(headers={"Cache-Control": "no-cache", "ETag": "\"v1\""}),
+                          FakeResponse(status_code=304, content=b""))
+    cache.get(URL, website)
+    assert cache.get(URL, website).content == b"page"
+    assert len(website.requests) == 2
+
+def test_responses_that_must_not_be_stored():
+    for response in [FakeResponse(headers={"Cache-Control": "max-age=60, no-store"}),
+                     FakeResponse(headers={"Cache-Control": "max-age=60, private"}),
+                     FakeResponse(headers={"Cache-Control": "max-age=60", "Vary": "*"}),
+                     FakeResponse(status_code=404, headers={"Cache-Control": "max-age=60"}),
+                     FakeResponse()]: #Neither fresh nor revalidatable
+        cache = HTTPCache(max_size=1024)
+        cache.get(URL, FakeWebsite(response))
+        assert len(cache.entries) == 0 and cache.size == 0
+
+def test_least_recently_used_response_is_forgotten():
+    cache = HTTPCache(max_size=10)
+    website = FakeWebsite(*[FakeResponse(headers={"Cache-Control": "max-age=60"}, content=b"12345") for _ in range(3)])
+    cache.get("http://example.com/a", website)
+    cache.get("http://example.com/b", website)
+    cache.get("http://example.com/a", website) #Makes b the least recently used
+    cache.get("http://example.com/c", website)
+    assert list(cache.entries) == ["http://example.com/a", "http://example.com/c"]
+    assert cache.size == 10
@@ -0,0 +1,55 @@
+'''test_scene.py
+Tests for translating and rendering scenes (content_renderer/) and sharing them between sessions (frame_cache.py).'''
+import contextlib, threading
+from content_renderer.from_html.format_translator import Translator
+from frame_cache import frame_cache, get_cached_frame
+
+PAGE = "<html><head></head><body>" + "".join(f"<p>Line {i}</p>" for i in range(40)) + "</body></html>"
+
+def create_scene():
+    return Translator().to_scene(PAGE, source="test.html", width=40, height=10)
+
+def test_render_frame_does_not_change_scene():
+    scene = create_scene()
+    first_frame = scene.current_row_string
+    scene.current_scroll_position = 5
+    frame, total_content_height = scene.render_frame()
+    assert frame != first_frame
+    assert total_content_height == scene.total_content_height
+    assert scene.current_row_string == first_frame
+    assert scene.render() == frame == scene.current_row_string
+
+def test_shared_scene_rendered_from_many_threads():
+    scene = create_scene()
+    scene.prototype_key = ("test.html", "rendered from many threads", 40, 10, False)
+    expected_frame, _ = scene.render_frame()
+    frames = []
+    def render():
+        for _ in range(20):
+            frame_cache.entries.clear() #Every call renders the scene again
+            frames.append(get_cached_frame(scene).frame)
+    threads = [threading.Thread(target=render) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert frames == [expected_frame] * len(frames)
+
+def test_render_does_not_change_shared_scene():
+    scene = create_scene()
+    first_frame, total_content_height = scene.current_row_string, scene.total_content_height
+    scene.prototype_key = ("test.html", "not changed by render", 40, 10, False)
+    scene.cursor_string = "\x1b[2;3H"
+    assert scene.render().endswith("\x1b[2;3H")
+    assert (scene.current_row_string, scene.total_content_height) == (first_frame, total_content_height)
+    copy = scene.copy_for_session() #Sessions render their own copies
+    assert copy.render() == copy.current_row_string != first_frame
+
+def test_translator_measures_steps():
+    steps = []
+    def measure(step, *labels):
+        steps.append((step,) + labels)
+        return contextlib.nullcontext()
+    Translator(measure).to_scene(PAGE, source="test.html", width=40, height=10)
+    assert steps[0] == ("break_down",) and steps[1] == ("parse",)
+    assert ("convert", "p") in steps
@@ -0,0 +1,35 @@
+'''test_server.py
+Tests for admitting clients in the threaded server (server.py).'''
+import socket, socketserver
+from server import ThreadedTCPServer
+
+def handle_one_client(server_class, handler_class):
+    '''Connects a client to a server, lets the server handle it and returns the server after it has been closed.'''
+    class JoinedServer(server_class):
+        daemon_threads = False #So that server_close() waits for the thread of the client
+    server = JoinedServer(("127.0.0.1", 0), handler_class)
+    client = socket.create_connection(server.server_address)
+    try:
+        server.handle_request()
+    finally:
+        server.server_close()
+        client.close()
+    return server
+
+def test_session_is_released_after_client():
+    server = handle_one_client(ThreadedTCPServer, socketserver.BaseRequestHandler)
+    assert server.admission.active_sessions == 0 and server.admitted_requests == {}
+
+def test_session_is_released_if_thread_can_not_start():
+    class ServerWithoutThreads(ThreadedTCPServer):
+        def process_request(self, request, client_address):
+            raise RuntimeError("can't start new thread")
+    server = handle_one_client(ServerWithoutThreads, socketserver.BaseRequestHandler)
+    assert server.admission.active_sessions == 0 and server.admitted_requests == {}
+
+def test_session_is_released_if_setup_fails():
+    class FailingHandler(socketserver.BaseRequestHandler):
+        def setup(self):
+            raise OSError("Bad file descriptor")
+    server = handle_one_client(ThreadedTCPServer, FailingHandler)
+    assert server.admission.active_sessions == 0 and server.admitted_requests == {}
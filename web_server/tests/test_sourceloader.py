@@ -0,0 +1,57 @@
+'''test_sourceloader.py
+Tests for loading sources with content_renderer/from_html/sourceloader.py and the functions that it is given.'''
+from content_renderer.from_html.sourceloader import SourceLoader
+from http_cache import HTTPCache
+
+URL = "http://example.com/page"
+
+class FakeResponse:
+    '''Stands in for a response of the requests library.'''
+    def __init__(self, status_code=200, headers=None, content=b"page"):
+        self.status_code = status_code
+        self.headers = headers or {}
+        self.content = content
+
+def create_source_loader(responses, **kwargs):
+    '''Creates a source loader that fetches the given responses in order. The requests are added to the requests list.'''
+    requests = []
+    def fetch(url, headers):
+        requests.append((url, headers))
+        return responses.pop(0)
+    source_loader = SourceLoader(load_from_files=True, load_from_urls=True, trusted_directories=[], trusted_urls=[],
+                                 restrict_filepaths=False, fetch=fetch, **kwargs)
+    return source_loader, requests
+
+def test_load_url_with_hooks():
+    events, fetches = [], []
+    source_loader, requests = create_source_loader([FakeResponse(headers={"Content-Type": "text/html; charset=latin-1"}, content="Hällo".encode("latin-1"))],
+        record_event=lambda event_type, **data: events.append((event_type, data)),
+        on_fetch=lambda source, seconds, failed: fetches.append((source, failed)))
+    assert source_loader.load_source_content(URL) == "Hällo"
+    assert requests[0][0] == URL and "User-Agent" in requests[0][1]
+    assert events == [("source", {"source": URL, "content": "Hällo"})]
+    assert fetches == [(URL, False)]
+
+def test_load_url_through_response_cache():
+    source_loader, requests = create_source_loader([FakeResponse(headers={"Cache-Control": "max-age=60"})], response_cache=HTTPCache(max_size=1024))
+    assert source_loader.load_source_content(URL) == "page"
+    assert source_loader.load_source_content(URL) == "page"
+    assert len(requests) == 1
+
+def test_failed_loads_are_reported():
+    fetches = []
+    def fail(url, headers):
+        raise ConnectionError("No route to host")
+    source_loader, _ = create_source_loader([FakeResponse(status_code=404, content=b"Not found")],
+        on_fetch=lambda source, seconds, failed: fetches.append((source, failed)))
+    assert source_loader.load_source_content(URL) == "Not found" #Error pages are still shown
+    source_loader.fetch = fail
+    assert source_loader.load_source_content(URL) is None
+    assert source_loader.load_source_content("does_not_exist.html") is None #Never loaded, so not reported
+    assert fetches == [(URL, True), (URL, True)]
+
+def test_load_file_without_hooks(tmp_path):
+    path = tmp_path / "page.html"
+    path.write_bytes(b"<html><body>File</body></html>")
+    source_loader = SourceLoader(load_from_files=True, load_from_urls=False, trusted_directories=[str(tmp_path)], trusted_urls=[])
+    assert source_loader.load_source_content(str(path)) == "<html><body>File</body></html>"
@@ -0,0 +1,61 @@
+'''test_telnet.py
+Tests for the Telnet parsing and key splitting in telnet.py.'''
+from telnet import CSI, IAC, OPTION_NAWS, SB, SE, WILL, TelnetConnection, split_keys
+
+def test_split_keys_text_and_control_characters():
+    assert split_keys(b"abc\x7fd\r\nx\ty") == [b"abc", b"\x7f", b"d", b"\r", b"x", b"\t", b"y"]
+
+def test_split_keys_line_endings():
+    assert split_keys(b"a\rb\nc\r\n") == [b"a", b"\r", b"b", b"\r", b"c", b"\r"]
+
+def test_split_keys_escape_sequences():
+    assert split_keys(b"\x1b[A\x1b[1;5Cx") == [b"\x1b[A", b"\x1b[1;5C", b"x"]
+
+def test_split_keys_turns_ss3_into_csi():
+    assert split_keys(b"\x1bOB") == [CSI + b"B"]
+
+def test_split_keys_lone_escape():
+    assert split_keys(b"\x1b") == [b"\x1b"]
+
+def test_feed_removes_telnet_commands():
+    connection = TelnetConnection()
+    assert connection.feed(b"a" + bytes([IAC, IAC]) + b"b\r\0c") == b"a\xffb\rc"
+
+def test_feed_iac_split_across_reads():
+    connection = TelnetConnection()
+    assert connection.feed(b"a" + bytes([IAC])) == b"a"
+    assert connection.feed(bytes([WILL])) == b""
+    assert connection.feed(bytes([OPTION_NAWS]) + b"b") == b"b"
+    assert OPTION_NAWS in connection.remote_options
+
+def test_feed_window_size_split_across_reads():
+    connection = TelnetConnection()
+    data = bytes([IAC, SB, OPTION_NAWS, 0, 100, 0, 40, IAC, SE]) + b"x"
+    received = b"".join(connection.feed(data[i:i+1]) for i in range(len(data)))
+    assert received == b"x"
+    assert (connection.width, connection.height) == (100, 40)
+    assert connection.size_changed
+
+def test_csi_split_across_reads():
+    connection = TelnetConnection()
+    assert connection.split_keys(b"a\x1b") == [b"a"]
+    assert connection.split_keys(b"[") == []
+    assert connection.split_keys(b"1;5") == []
+    assert connection.split_keys(b"Cb") == [b"\x1b[1;5C", b"b"]
+    assert connection.held_keys == b""
+
+def test_ss3_split_across_reads():
+    connection = TelnetConnection()
+    assert connection.split_keys(b"\x1bO") == []
+    assert connection.split_keys(b"A") == [CSI + b"A"]
+
+def test_lone_escape_is_held_until_flushed():
+    connection = TelnetConnection()
+    assert connection.split_keys(b"\x1b") == []
+    assert connection.flush_keys() == [b"\x1b"]
+    assert connection.flush_keys() == []
+
+def test_escape_followed_by_other_key_is_not_held():
+    connection = TelnetConnection()
+    assert connection.split_keys(b"\x1bx") == [b"\x1b", b"x"]
+    assert connection.held_keys == b""
@@ -0,0 +1,97 @@
+'''tracing.py
+Records sessions as trace files (if SUPERBRAIN_TRACE_DIRECTORY is set), so that they can be replayed offline with replay_trace.py,
+for example to find out if a new build is slower or draws pages differently than the one that is running.
+A trace is a gzipped JSON Lines file with one event per line:
+* start: the settings that the session was run with.
+* input: raw bytes (base64) received from the client, including Telnet commands.
+* source: the content of a website that was loaded.
+* post: the result of sending form data to a website.
+* refresh: a newer version of the current page that was applied (see refresher.py).
+* frame: the size and a hash of the output for a frame (before compression), to compare replayed frames with.
+Every event has the number of seconds since the session started in "time".'''
+import base64, contextlib, gzip, hashlib, json, logging, os, sys, threading, time
+sys.path.append(".")
+from const import *
+
+logger = logging.getLogger(__name__)
+_active = threading.local() #The trace that loads on the current thread are recorded in, if any
+
+def get_frame_hash(frame_output:bytes):
+    '''Returns a hash of the output for a frame.'''
+    return hashlib.blake2b(frame_output, digest_size=16).hexdigest()
+
+class TraceRecorder:
+    '''Writes the events of a session to a trace file. Can be used from several threads at the same time.'''
+    def __init__(self, path):
+        '''Opens a trace file for writing.
+
+        :param path: The path of the file.'''
+        self.path = path
+        self.start_time = time.monotonic()
+        self.trace_file = gzip.open(path, "wt", encoding="utf-8")
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def open_for_session(client_address):
+        '''Starts a trace for a new session if tracing is enabled.
+
+        :returns: The recorder, or None if tracing is disabled or the file could not be created.'''
+        if TRACE_DIRECTORY == "":
+            return None
+        client_name = f"{client_address[0]}-{client_address[1]}" if client_address else "unknown"
+        path = os.path.join(TRACE_DIRECTORY, f"session-{client_name}-{time.strftime('%Y%m%d-%H%M%S')}.jsonl.gz")
+        try:
+            os.makedirs(TRACE_DIRECTORY, exist_ok=True)
+            return TraceRecorder(path)
+        except OSError as e:
+            logger.warning(f"Failed to start trace {path} (the error {e} occurred).")
+            return None
+
+    def record(self, event_type, **data):
+        '''Adds an event to the trace.
+
+        :param event_type: The type of the event, like "input".
+
+        :param data: The data of the event. Has to be JSON serializable.'''
+        event = {"type": event_type, "time": round(time.monotonic() - self.start_time, 6), **data}
+        with self.lock:
+            if self.trace_file is None:
+                return
+            try:
+                self.trace_file.write(json.dumps(event) + "\n")
+            except (OSError, ValueError) as e:
+                logger.warning(f"Failed to write to trace {self.path} (the error {e} occurred). Stopping the trace.")
+                self.trace_file = None
+
+    def record_input(self, data:bytes, while_loading=False):
+        '''Adds data received from the client to the trace.
+
+        :param while_loading: True if the data was received while a page was loading (see Session.receive_while_loading())'''
+        self.record("input", data=base64.b64encode(data).decode("ascii"), while_loading=while_loading)
+
+    def record_frame(self, frame_output:bytes):
+        '''Adds a frame to the trace.'''
+        self.record("frame", size=len(frame_output), hash=get_frame_hash(frame_output))
+
+    def close(self):
+        with self.lock:
+            if self.trace_file is not None:
+                self.trace_file.close()
+                self.trace_file = None
+
+@contextlib.contextmanager
+def record_loads(trace:TraceRecorder):
+    '''Records the websites that are loaded (and the forms that are sent) while the code in the context manager runs (on the same thread).
+
+    :param trace: The trace to record in. If None, nothing is recorded.'''
+    _active.trace = trace
+    try:
+        yield trace
+    finally:
+        _active.trace = None
+
+def record(event_type, **data):
+    '''Adds an event to the trace of the load that is running on the current thread, if any (see record_loads).'''
+    trace = getattr(_active, "trace", None)
+    if trace is not None:
+        trace.record(event_type, **data)
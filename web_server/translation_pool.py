@@ -0,0 +1,193 @@
+'''translation_pool.py
+Translates websites into scenes in a pool of worker processes. Parsing the HTML, converting the tags and laying out and rendering
+the scene is CPU-bound and holds the GIL, so translating a big page on a thread of the server would make every other session
+wait with its keystrokes. In the pool, the page is translated in another process and only the finished scene (its rows and
+first frame) is sent back. The pool is bounded: at most SUPERBRAIN_TRANSLATION_QUEUE_SIZE pages can be waiting for or being
+translated at the same time, and pages that take longer than SUPERBRAIN_TRANSLATION_TIMEOUT seconds are given up on.
+With SUPERBRAIN_TRANSLATION_WORKERS set to 0, pages are translated on the calling thread instead.'''
+import concurrent.futures, contextlib, logging, multiprocessing, os, sys, threading, time
+sys.path.append(".")
+from const import *
+from metrics import BREAK_DOWN_SECONDS, TRANSLATIONS, TRANSLATION_JOBS
+from profiling import PageTimings, collect_timings, get_active_timings, measure_translation_step
+
+logger = logging.getLogger(__name__)
+
+class TranslationError(Exception):
+    '''Raised when a job could not be run in the translation pool, because the pool is full or the job took too long.'''
+
+class TranslationResult:
+    '''What a worker sends back after translating a page.'''
+    def __init__(self, scene, break_down_seconds, page_timings:PageTimings=None):
+        self.scene = scene
+        self.break_down_seconds = break_down_seconds
+        self.page_timings = page_timings #Parse and convert timings, if the page is being profiled (see profiling.py)
+
+def exit_with_parent(parent_pid):
+    '''Exits the worker process when the server process is gone. Runs on a thread in every worker, since workers
+    are not told when the server is killed and would otherwise be left running.'''
+    while os.getppid() == parent_pid:
+        time.sleep(WORKER_PARENT_CHECK_INTERVAL)
+    os._exit(0)
+
+def initialize_worker(parent_pid):
+    threading.Thread(target=exit_with_parent, args=(parent_pid,), name="superbrain-translation-parent-check", daemon=True).start()
+
+def translate_in_worker(content:str, source, scene_kwargs:dict, collect_page_timings:bool):
+    '''Translates content into a scene. Runs in a worker process.
+
+    :param content: The content.
+
+    :param source: The source that the content was loaded from.
+
+    :param scene_kwargs: Keyword arguments to pass on to the Scene().
+
+    :param collect_page_timings: Whether to collect parse and convert timings for the profiler of the session.'''
+    from content_renderer.from_html.format_translator import Translator
+    page_timings = PageTimings(source) if collect_page_timings else None
+    start_time = time.perf_counter()
+    with collect_timings(page_timings) if page_timings is not None else contextlib.nullcontext():
+        scene = Translator(measure_translation_step).to_scene(content, source=source, **scene_kwargs)
+    break_down_seconds = time.perf_counter() - start_time
+    scene.render() #The first frame, which is sent back with the scene
+    return TranslationResult(scene, break_down_seconds, page_timings)
+
+class TranslationPool:
+    '''A bounded pool of worker processes that jobs (like translating a page) are run in.'''
+    def __init__(self, workers=TRANSLATION_WORKERS, max_jobs=TRANSLATION_QUEUE_SIZE, timeout=TRANSLATION_TIMEOUT):
+        '''Initializes a translation pool. The worker processes are started when they are first needed.
+
+        :param workers: Number of worker processes.
+
+        :param max_jobs: Max number of jobs that can be waiting or running at the same time. Jobs over this are rejected.
+
+        :param timeout: Max seconds to wait for a job. 0 means no limit.'''
+        self.workers = workers
+        self.max_jobs = max_jobs
+        self.timeout = timeout
+        self.job_slots = threading.BoundedSemaphore(max_jobs)
+        self.lock = threading.Lock()
+        self.executor = self.create_executor()
+
+    def create_executor(self):
+        #Workers are spawned instead of forked, since forking a process that runs many threads can copy locks that are held
+        return concurrent.futures.ProcessPoolExecutor(max_workers=self.workers, mp_context=multiprocessing.get_context("spawn"),
+                                                      initializer=initialize_worker, initargs=(os.getpid(),))
+
+    def run(self, function, *args):
+        '''Runs a function in a worker process and waits for its result. Blocks.
+
+        :param function: The function. It, its arguments and its result have to be picklable.
+
+        :param args: Arguments to pass on to the function.
+
+        :raises TranslationError: If the pool is full or the job takes longer than the timeout.
+        Exceptions raised by the function are raised again.'''
+        if not self.job_slots.acquire(blocking=False):
+            TRANSLATIONS.inc("rejected")
+            raise TranslationError(f"The translation pool is full ({self.max_jobs} jobs are waiting or running).")
+        try:
+            with self.lock:
+                executor = self.executor
+            future = executor.submit(function, *args)
+        except Exception:
+            self.job_slots.release()
+            raise
+        TRANSLATION_JOBS.inc()
+        future.add_done_callback(self.on_job_done) #A job that is given up on keeps its slot until it is done
+        try:
+            result = future.result(timeout=self.timeout if self.timeout > 0 else None)
+        except concurrent.futures.TimeoutError:
+            future.cancel() #Does nothing if it has already started
+            TRANSLATIONS.inc("timed_out")
+            raise TranslationError(f"The job took longer than {self.timeout} seconds.")
+        except concurrent.futures.process.BrokenProcessPool:
+            TRANSLATIONS.inc("failed")
+            self.replace_executor(executor)
+            raise
+        except Exception:
+            TRANSLATIONS.inc("failed")
+            raise
+        TRANSLATIONS.inc("done")
+        return result
+
+    def on_job_done(self, future):
+        TRANSLATION_JOBS.dec()
+        self.job_slots.release()
+
+    def replace_executor(self, broken_executor):
+        '''Starts new worker processes after one has died (for example because it ran out of memory).'''
+        with self.lock:
+            if self.executor is not broken_executor: #Already replaced by another thread
+                return
+            logger.warning("A worker process of the translation pool has died. Starting new ones...")
+            self.executor = self.create_executor()
+        broken_executor.shutdown(wait=False)
+
+    def shutdown(self):
+        '''Stops the worker processes. Jobs that have not started yet are cancelled.'''
+        with self.lock:
+            executor = self.executor
+        executor.shutdown(cancel_futures=True)
+
+_pool = None
+_pool_lock = threading.Lock()
+
+def get_translation_pool():
+    '''Returns the translation pool that is shared by all sessions, or None if pages are translated on the calling thread
+    (SUPERBRAIN_TRANSLATION_WORKERS is 0). The pool is created on first use.'''
+    global _pool
+    if TRANSLATION_WORKERS <= 0:
+        return None
+    with _pool_lock:
+        if _pool is None:
+            _pool = TranslationPool()
+        return _pool
+
+def shutdown_translation_pool():
+    '''Stops the translation pool if it has been started (see TranslationPool.shutdown()). Called when the server stops, since
+    worker processes that are left to the interpreter's exit can make it hang or warn about leaked semaphores.'''
+    global _pool
+    with _pool_lock:
+        pool, _pool = _pool, None
+    if pool is not None:
+        pool.shutdown()
+
+def translate(source_loader, content:str, source, raise_translation_errors=False, **scene_kwargs):
+    '''Translates content that has been loaded from a source into a Scene() in the translation pool.
+
+    :param source_loader: The SourceLoader to translate the content with if there is no pool.
+
+    :param content: The content.
+
+    :param source: The source that the content was loaded from.
+
+    :param raise_translation_errors: If True, a TranslationError (the pool is full or the page took too long) is raised
+    instead of returning None, so that the caller can try again later.
+
+    :param scene_kwargs: Any extra keyword arguments to pass on to the Scene().
+
+    :returns: The scene, or None if the content could not be translated. The scene has been rendered, so its
+    current_row_string is its first frame.'''
+    pool = get_translation_pool()
+    if pool is None:
+        scene = source_loader.translate(content, source, **scene_kwargs)
+        if scene is not None:
+            scene.render()
+        return scene
+    page_timings = get_active_timings()
+    try:
+        result = pool.run(translate_in_worker, content, source, scene_kwargs, page_timings is not None)
+    except TranslationError as e:
+        if raise_translation_errors:
+            raise
+        logger.warning(f"Failed translating {source} (the error {e} occurred).")
+        return None
+    except Exception as e:
+        logger.warning(f"Failed loading {source} into a scene - the exception {e} occurred.", exc_info=True)
+        return None
+    BREAK_DOWN_SECONDS.observe(result.break_down_seconds)
+    if page_timings is not None and result.page_timings is not None:
+        page_timings.parse_seconds += result.page_timings.parse_seconds
+        page_timings.convert_seconds.update(result.page_timings.convert_seconds)
+    return result.scene